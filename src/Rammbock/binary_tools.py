@@ -13,6 +13,7 @@
 #  limitations under the License.
 
 import binascii
+import re
 import struct
 
 try:
@@ -40,6 +41,18 @@ except NameError, name_error:
         return '0b' + ''.join(out)
 
 LONGLONG = struct.Struct('>Q')
+_INT_FORMATS = {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}
+_STRUCTS = {}
+
+
+class _SharedStruct(struct.Struct):
+    """Immutable codec that is shared instead of copied with templates."""
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
 
 def to_bin(string_value):
@@ -49,12 +62,12 @@ def to_bin(string_value):
     if string_value.startswith('0x'):
         return _hex_to_bin(string_value)
     elif string_value.startswith('0b'):
-        return _int_to_bin(int(string_value.replace('0b', '')
-                                           .replace(' ', ''), 2))
-    return _int_to_bin(int(string_value))
+        return int_to_bin(int(string_value.replace('0b', '')
+                                          .replace(' ', ''), 2))
+    return int_to_bin(int(string_value))
 
 
-def _int_to_bin(integer):
+def int_to_bin(integer):
     if integer >= 18446744073709551616L:
         return to_bin(hex(integer))
     return LONGLONG.pack(integer).lstrip('\x00') or '\x00'
@@ -75,6 +88,10 @@ def to_bin_of_length(length, string_value):
     return bin.rjust(length, '\x00')
 
 
+def int_to_bin_of_length(length, integer):
+    return binascii.unhexlify('%0*x' % (length * 2, integer))
+
+
 def to_hex(binary):
     return binascii.hexlify(binary)
 
@@ -83,37 +100,73 @@ def to_0xhex(binary):
     return '0x' + to_hex(binary)
 
 
+def bin_to_int(binary):
+    if 0 < len(binary) <= 8:
+        return LONGLONG.unpack(binary.rjust(8, '\x00'))[0]
+    return int(to_hex(binary), 16)
+
+
 def to_binary_string_of_length(length, bytes):
-    result = bin(int(to_0xhex(bytes), 16))
-    if len(result) < length + 2:
-        result = '0b' + '0' * (length - len(result) + 2) + result[2:]
-    return result
+    return '0b' + format(bin_to_int(bytes), '0%db' % length)
 
 
 def to_bin_str_from_int_string(length, value):
     return to_binary_string_of_length(length, to_bin(value))[2:]
 
 
+def _tbcd_digits(byte):
+    low, high = byte & 0x0f, byte >> 4
+    return str(low) if high == 0x0f else '%d%d' % (low, high)
+
+
+_TBCD_DIGITS = tuple(_tbcd_digits(byte) for byte in range(256))
+_TBCD_PAIRS = dict(('%d%d' % (low, high), chr(high << 4 | low))
+                   for low in range(10) for high in range(10))
+_TBCD_LAST = dict((str(low), chr(0xf0 | low)) for low in range(10))
+_TBCD_FILLER = re.compile('[\xf0-\xff]')
+
+
+def tbcd_length(binary):
+    """Returns the number of TBCD digits in `binary` before the filler."""
+    filler = _TBCD_FILLER.search(binary)
+    return filler.start() * 2 + 1 if filler else len(binary) * 2
+
+
 def to_tbcd_value(binary):
-    bin_str, value = to_binary_string_of_length(len(to_hex(binary)) *
-                                                4, binary), ""
-    for index in range(2, len(bin_str), 8):
-        if int(bin_str[index:index + 4], 2) == 15:
-            return value + str(int(bin_str[index + 4: index + 8], 2))
-        value += "%s%s" % (int(bin_str[index + 4:index + 8], 2),
-                           int(bin_str[index: index + 4], 2))
-    return value
+    filler = _TBCD_FILLER.search(binary)
+    if filler:
+        binary = binary[:filler.start() + 1]
+    return ''.join([_TBCD_DIGITS[byte] for byte in bytearray(binary)])
 
 
 def to_tbcd_binary(tbcd_string):
-    value, index = "0b", 0
-    while index <= len(tbcd_string) - 2:
-        value += to_bin_str_from_int_string(4, tbcd_string[index + 1]) +\
-            to_bin_str_from_int_string(4, tbcd_string[index])
-        index += 2
-    return to_bin(value if index == len(tbcd_string)
-                  else value + to_bin_str_from_int_string(4, 15) +
-                  to_bin_str_from_int_string(4, tbcd_string[index]))
+    try:
+        result = [_TBCD_PAIRS[tbcd_string[index:index + 2]]
+                  for index in range(0, len(tbcd_string) - 1, 2)]
+        if len(tbcd_string) % 2:
+            result.append(_TBCD_LAST[tbcd_string[-1]])
+    except KeyError:
+        raise ValueError("Illegal TBCD value '%s'" % tbcd_string)
+    return ''.join(result)
+
+
+def slice_tbcd(binary, start, length):
+    """Returns `length` digits of TBCD encoded `binary` starting from digit
+    index `start` as TBCD encoded bytes."""
+    if length <= 0:
+        return ''
+    first = start // 2
+    data = bytearray(binary[first:first + length // 2 + 1])
+    if start % 2:
+        result = bytearray((data[index + 1] & 0x0f) << 4 | data[index] >> 4
+                           for index in range(length // 2))
+        last = data[length // 2] >> 4 if length % 2 else None
+    else:
+        result = data[:length // 2]
+        last = data[length // 2] & 0x0f if length % 2 else None
+    if last is not None:
+        result.append(0xf0 | last)
+    return str(result)
 
 
 def to_twos_comp(val, bits):
@@ -135,6 +188,35 @@ def _invert(value):
     return "".join(str(int(a) ^ 1) for a in value)
 
 
+def shared_struct(fmt):
+    """Returns a `struct.Struct` for `fmt` shared by all its users."""
+    if fmt not in _STRUCTS:
+        _STRUCTS[fmt] = _SharedStruct(fmt)
+    return _STRUCTS[fmt]
+
+
+def int_struct(length, little_endian=False, signed=False):
+    """Returns a shared `struct.Struct` for integers of `length` bytes or
+    None if there is no native format for that length."""
+    fmt = _INT_FORMATS.get(length)
+    if not fmt:
+        return None
+    return shared_struct(('<' if little_endian else '>') +
+                         (fmt.lower() if signed else fmt))
+
+
+def to_integer(value):
+    """Parses `value` to a Python integer accepting all the formats that
+    `to_bin` accepts."""
+    if isinstance(value, (int, long)):
+        return value
+    value = str(value)
+    try:
+        return to_int(value)
+    except ValueError:
+        return int(to_0xhex(to_bin(value)), 16)
+
+
 def to_int(string_value):
     if string_value in (None, ''):
         raise Exception("No value or empty value given")
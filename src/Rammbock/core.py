@@ -16,17 +16,20 @@ from __future__ import with_statement
 import copy
 from contextlib import contextmanager
 from .logger import logger
-from .synchronization import SynchronizedType
+from .synchronization import SynchronizedType, LOCK, released
 from .templates.containers import BagTemplate, CaseTemplate
 from .message import _StructuredElement
-from .networking import (TCPServer, TCPClient, UDPServer, UDPClient, SCTPServer,
-                         SCTPClient, _NamedCache)
+from .networking import (TCPServer, TCPClient, UDPServer, UDPSessionServer, UDPClient, SCTPServer,
+                         SCTPClient, AsyncTCPServer, AsyncTCPClient, AsyncUDPServer, AsyncUDPClient,
+                         _NamedCache)
 from .message_sequence import MessageSequence
 from .templates import (Protocol, UInt, Int, PDU, MessageTemplate, Char, Binary,
                         TBCD, StructTemplate, ListTemplate, UnionTemplate,
                         BinaryContainerTemplate, ConditionalTemplate,
-                        TBCDContainerTemplate)
+                        TBCDContainerTemplate, MessageImage)
+from .templates.corpus import parse_generator, generate_corpus
 from .binary_tools import to_0xhex, to_bin
+from .executor import EXECUTOR, DEFAULT_QUEUE_SIZE
 
 
 class RammbockCore(object):
@@ -34,6 +37,7 @@ class RammbockCore(object):
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
 
     __metaclass__ = SynchronizedType
+    _lock = LOCK
 
     def __init__(self):
         self._init_caches()
@@ -48,6 +52,7 @@ class RammbockCore(object):
         self._field_values = {}
         self._message_sequence = MessageSequence()
         self._message_templates = {}
+        self._message_images = {}
         self.reset_handler_messages()
 
     @property
@@ -71,9 +76,9 @@ class RammbockCore(object):
         The header_filter defines which header field will be used to identify the
         message defined in template. (Otherwise all incoming messages will match!)
 
-        The interval defines the interval in seconds on which the handler will
-        be called on background. By default the incoming messages are checked
-        every 0.5 seconds.
+        The handler is called on background as soon as a matching message
+        arrives. The interval argument is not used anymore and is only
+        accepted for backwards compatibility.
 
         The handler function will be called with two arguments: the rammbock library
         instance and the received message.
@@ -106,12 +111,13 @@ class RammbockCore(object):
         The header_filter defines which header field will be used to identify the
         message defined in template. (Otherwise all incoming messages will match!)
 
-        The interval defines the interval in seconds on which the handler will
-        be called on background. By default the incoming messages are checked
-        every 0.5 seconds.
+        The handler is called on background as soon as a matching message
+        arrives. The interval argument is not used anymore and is only
+        accepted for backwards compatibility.
 
         The alias is the alias for the connection. By default the current active
-        connection will be used.
+        connection will be used. On UDP servers with `peer_sessions`, the
+        handler is used for all sessions by default.
 
         The handler function will be called with two arguments: the rammbock library
         instance and the received message.
@@ -133,18 +139,60 @@ class RammbockCore(object):
         server, server_name = self._servers.get_with_name(name)
         server.set_handler(msg_template, handler_func, header_filter=header_filter, alias=alias, interval=interval)
 
+    def set_handler_executor(self, workers=0, queue_size=DEFAULT_QUEUE_SIZE):
+        """Sets how the handlers set with `Set client handler` and `Set server handler` are run.
+
+        By default `workers` is 0 and handlers are run in the thread that
+        receives the message, so a slow handler delays receiving messages on
+        all nodes. With workers, the messages are queued to a queue of
+        `queue_size` messages and the handlers are run by a pool of `workers`
+        threads. Handlers of one connection are run one at a time in the order
+        the messages were received, but handlers of different connections are
+        run in parallel. Messages arriving to a full queue are not handled.
+        Failures of handlers run by workers are only logged. When workers are
+        removed, this keyword waits until the queued handlers have been run.
+
+        Notice that handlers run in parallel must not change state shared by
+        other handlers, for example by loading templates.
+
+        Examples:
+        | Set handler executor | workers=4 |
+        | Set handler executor | workers=1 | queue_size=100 |
+        """
+        with released(LOCK):
+            EXECUTOR.configure(workers, queue_size)
+
+    def get_handler_statistics(self):
+        """Returns statistics of running handlers as a dictionary.
+
+        The statistics contain `handled`, `failed` and `rejected` handler
+        calls, the number of `workers`, the current and maximum numbers of
+        messages in the queue as `queued` and `max_queued`, and the
+        `average_run_time`, `max_run_time` and `max_queue_time` of handlers
+        in seconds. See `Set handler executor`.
+
+        Example:
+        | ${stats} = | Get handler statistics |
+        | Should be equal as integers | ${stats['rejected']} | 0 |
+        """
+        return EXECUTOR.get_statistics()
+
     def reset_rammbock(self):
         """Closes all connections, deletes all servers, clients, and protocols.
 
         You should call this method before exiting your test run. This will
         close all the connections and the ports will therefore be available for
-        reuse faster.
+        reuse faster. The handler executor is reset to run handlers without
+        workers after the queued handlers have been run.
         """
         for client in self._clients:
             client.close()
         for server in self._servers:
             server.close()
         self._init_caches()
+        with released(LOCK):
+            EXECUTOR.configure(0)
+        EXECUTOR.reset_statistics()
 
     def clear_message_streams(self):
         """ Resets streams and sockets of incoming messages.
@@ -176,27 +224,81 @@ class RammbockCore(object):
         self._protocols[protocol.name] = protocol
         self._protocol_in_progress = False
 
-    def start_udp_server(self, ip, port, name=None, timeout=None, protocol=None, family='ipv4'):
+    def start_udp_server(self, ip, port, name=None, timeout=None, protocol=None, family='ipv4',
+                         cache_size=None, cache_policy=None, peer_sessions=False, idle_timeout=None,
+                         async_transport=False):
         """Starts a new UDP server to given `ip` and `port`.
 
         Server can be given a `name`, default `timeout` and a `protocol`.
         `family` can be either ipv4 (default) or ipv6.
 
+        Received messages that have not been read yet are kept in a cache,
+        which is unlimited by default. `cache_size` limits the number of
+        cached messages, and `cache_policy` decides what happens when a
+        message arrives to a full cache:
+        - `drop-oldest` (default) evicts the oldest cached message.
+        - `drop-newest` evicts the arrived message.
+        - `fail` fails the receive reading the message and all receives
+        after it until `Clear message streams`.
+        Evicted messages can be inspected with `Get server evicted messages
+        counts`. A warning is logged when the cache gets 80% full.
+
+        If `peer_sessions` is True, the server keeps a session with its own
+        message cache for every client. Sessions are created when the first
+        datagram from a client arrives and are named `ip:port` of the client.
+        Use the session name as the connection alias to receive from or send
+        to a specific client. Receiving without an alias receives from any
+        client, and the client of the received message becomes the current
+        client. Handlers set without an alias are used for all clients.
+        `Wait for connections` waits until the given number of clients have
+        sent datagrams. Sessions that have not received or sent datagrams for
+        `idle_timeout` seconds are closed, by default never.
+
+        If `async_transport` is True, received datagrams are read on
+        background by the one thread that also runs background handlers, and
+        receiving keywords take them from a queue. This lets one process serve
+        thousands of servers, clients and connections. Servers with
+        `peer_sessions` are always read this way.
+
         Examples:
         | Start UDP server | 10.10.10.2 | 53 |
         | Start UDP server | 10.10.10.2 | 53 | Server1 |
         | Start UDP server | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start UDP server | 10.10.10.2 | 53 | timeout=5 |
         | Start UDP server | 0:0:0:0:0:0:0:1 | 53 | family=ipv6 |
+        | Start UDP server | 10.10.10.2 | 53 | cache_size=1000 | cache_policy=drop-newest |
+        | Start UDP server | 10.10.10.2 | 53 | peer_sessions=True | idle_timeout=60 |
+        | Start UDP server | 10.10.10.2 | 53 | async_transport=True |
         """
-        self._start_server(UDPServer, ip, port, name, timeout, protocol, family)
+        if self._to_bool(peer_sessions):
+            self._start_server(UDPSessionServer, ip, port, name, timeout, protocol, family, cache_size, cache_policy,
+                               idle_timeout=idle_timeout)
+        else:
+            server_class = AsyncUDPServer if self._to_bool(async_transport) else UDPServer
+            self._start_server(server_class, ip, port, name, timeout, protocol, family, cache_size, cache_policy)
 
-    def start_tcp_server(self, ip, port, name=None, timeout=None, protocol=None, family='ipv4'):
+    def start_tcp_server(self, ip, port, name=None, timeout=None, protocol=None, family='ipv4',
+                         cache_size=None, cache_policy=None, backlog=None, auto_accept=False,
+                         async_transport=False):
         """Starts a new TCP server to given `ip` and `port`.
 
         Server can be given a `name`, default `timeout` and a `protocol`.
         `family` can be either ipv4 (default) or ipv6. Notice that you have to
-        use `Accept Connection` keyword for server to receive connections.
+        use `Accept Connection` keyword for server to receive connections,
+        unless `auto_accept` is set.
+
+        `cache_size` and `cache_policy` limit the cache of unread messages
+        like in `Start UDP server`.
+
+        `backlog` is the number of connections the operating system queues
+        before they are accepted, 5 by default. If `auto_accept` is True, the
+        server accepts connections on background as soon as they arrive and
+        names them `connection1`, `connection2` and so on. The latest accepted
+        connection becomes the current connection. Use `Wait for connections`
+        to wait until clients have connected.
+
+        If `async_transport` is True, the connections are read on background
+        like the UDP servers with `async_transport` in `Start UDP server`.
 
         Examples:
         | Start TCP server | 10.10.10.2 | 53 |
@@ -204,10 +306,16 @@ class RammbockCore(object):
         | Start TCP server | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start TCP server | 10.10.10.2 | 53 | timeout=5 |
         | Start TCP server | 0:0:0:0:0:0:0:1 | 53 | family=ipv6 |
+        | Start TCP server | 10.10.10.2 | 53 | cache_size=1000 |
+        | Start TCP server | 10.10.10.2 | 53 | backlog=1000 | auto_accept=True |
+        | Start TCP server | 10.10.10.2 | 53 | auto_accept=True | async_transport=True |
         """
-        self._start_server(TCPServer, ip, port, name, timeout, protocol, family)
+        server_class = AsyncTCPServer if self._to_bool(async_transport) else TCPServer
+        self._start_server(server_class, ip, port, name, timeout, protocol, family, cache_size, cache_policy,
+                           backlog=backlog, auto_accept=self._to_bool(auto_accept))
 
-    def start_sctp_server(self, ip, port, name=None, timeout=None, protocol=None, family='ipv4'):
+    def start_sctp_server(self, ip, port, name=None, timeout=None, protocol=None, family='ipv4',
+                          cache_size=None, cache_policy=None, backlog=None, auto_accept=False):
         """Starts a new STCP server to given `ip` and `port`.
 
         `family` can be either ipv4 (default) or ipv6.
@@ -215,22 +323,37 @@ class RammbockCore(object):
         pysctp (https://github.com/philpraxis/pysctp) need to be installed your system.
         Server can be given a `name`, default `timeout` and a `protocol`.
         Notice that you have to use `Accept Connection` keyword for server to
-        receive connections.
+        receive connections, unless `auto_accept` is set.
+
+        `cache_size` and `cache_policy` limit the cache of unread messages
+        like in `Start UDP server`. `backlog` and `auto_accept` work like in
+        `Start TCP server`.
 
         Examples:
         | Start STCP server | 10.10.10.2 | 53 |
         | Start STCP server | 10.10.10.2 | 53 | Server1 |
         | Start STCP server | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start STCP server | 10.10.10.2 | 53 | timeout=5 |
+        | Start STCP server | 10.10.10.2 | 53 | cache_size=1000 |
+        | Start STCP server | 10.10.10.2 | 53 | auto_accept=True |
         """
-        self._start_server(SCTPServer, ip, port, name, timeout, protocol, family)
+        self._start_server(SCTPServer, ip, port, name, timeout, protocol, family, cache_size, cache_policy,
+                           backlog=backlog, auto_accept=self._to_bool(auto_accept))
 
-    def _start_server(self, server_class, ip, port, name, timeout, protocol, family):
+    def _start_server(self, server_class, ip, port, name, timeout, protocol, family, cache_size, cache_policy,
+                      **options):
         protocol = self._get_protocol(protocol)
-        server = server_class(ip=ip, port=port, timeout=timeout, protocol=protocol, family=family)
+        server = server_class(ip=ip, port=port, timeout=timeout, protocol=protocol, family=family,
+                              cache_size=cache_size, cache_policy=cache_policy, **options)
         return self._servers.add(server, name)
 
-    def start_udp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, family='ipv4'):
+    def _to_bool(self, value):
+        if isinstance(value, basestring):
+            return value.lower() not in ('false', '')
+        return bool(value)
+
+    def start_udp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, family='ipv4',
+                         cache_size=None, cache_policy=None, async_transport=False):
         """Starts a new UDP client.
 
         Client can be optionally given `ip` and `port` to bind to, as well as
@@ -239,16 +362,24 @@ class RammbockCore(object):
 
         You should use `Connect` keyword to connect client to a host.
 
+        `cache_size` and `cache_policy` limit the cache of unread messages
+        like in `Start UDP server`. If `async_transport` is True, the client
+        is read on background like the UDP servers with `async_transport`.
+
         Examples:
         | Start UDP client |
         | Start UDP client | name=Client1 | protocol=GTPV2 |
         | Start UDP client | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start UDP client | timeout=5 |
         | Start UDP client | 0:0:0:0:0:0:0:1 | 53 | family=ipv6 |
+        | Start UDP client | cache_size=1000 | cache_policy=fail |
+        | Start UDP client | async_transport=True |
         """
-        self._start_client(UDPClient, ip, port, name, timeout, protocol, family)
+        client_class = AsyncUDPClient if self._to_bool(async_transport) else UDPClient
+        self._start_client(client_class, ip, port, name, timeout, protocol, family, cache_size, cache_policy)
 
-    def start_tcp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, family='ipv4'):
+    def start_tcp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, family='ipv4',
+                         cache_size=None, cache_policy=None, async_transport=False):
         """Starts a new TCP client.
 
         Client can be optionally given `ip` and `port` to bind to, as well as
@@ -257,16 +388,24 @@ class RammbockCore(object):
 
         You should use `Connect` keyword to connect client to a host.
 
+        `cache_size` and `cache_policy` limit the cache of unread messages
+        like in `Start UDP server`. If `async_transport` is True, the client
+        is read on background like the UDP servers with `async_transport`.
+
         Examples:
         | Start TCP client |
         | Start TCP client | name=Client1 | protocol=GTPV2 |
         | Start TCP client | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start TCP client | timeout=5 |
         | Start TCP client | 0:0:0:0:0:0:0:1 | 53 | family=ipv6 |
+        | Start TCP client | cache_size=1000 | cache_policy=fail |
+        | Start TCP client | async_transport=True |
         """
-        self._start_client(TCPClient, ip, port, name, timeout, protocol, family)
+        client_class = AsyncTCPClient if self._to_bool(async_transport) else TCPClient
+        self._start_client(client_class, ip, port, name, timeout, protocol, family, cache_size, cache_policy)
 
-    def start_sctp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, family='ipv4'):
+    def start_sctp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, family='ipv4',
+                          cache_size=None, cache_policy=None):
         """Starts a new SCTP client.
 
         Client can be optionally given `ip` and `port` to bind to, as well as
@@ -275,17 +414,22 @@ class RammbockCore(object):
 
         You should use `Connect` keyword to connect client to a host.
 
+        `cache_size` and `cache_policy` limit the cache of unread messages
+        like in `Start UDP server`.
+
         Examples:
         | Start TCP client |
         | Start TCP client | name=Client1 | protocol=GTPV2 |
         | Start TCP client | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start TCP client | timeout=5 |
+        | Start TCP client | cache_size=1000 | cache_policy=fail |
         """
-        self._start_client(SCTPClient, ip, port, name, timeout, protocol, family)
+        self._start_client(SCTPClient, ip, port, name, timeout, protocol, family, cache_size, cache_policy)
 
-    def _start_client(self, client_class, ip, port, name, timeout, protocol, family):
+    def _start_client(self, client_class, ip, port, name, timeout, protocol, family, cache_size, cache_policy):
         protocol = self._get_protocol(protocol)
-        client = client_class(timeout=timeout, protocol=protocol, family=family)
+        client = client_class(timeout=timeout, protocol=protocol, family=family,
+                              cache_size=cache_size, cache_policy=cache_policy)
         if ip or port:
             client.set_own_ip_and_port(ip=ip, port=port)
         return self._clients.add(client, name)
@@ -320,7 +464,26 @@ class RammbockCore(object):
         | Accept connection | Server1 | my_connection | timeout=5 |
         """
         server = self._servers.get(name)
-        server.accept_connection(alias, timeout)
+        with released(LOCK):
+            server.accept_connection(alias, timeout)
+
+    def wait_for_connections(self, count, name=None, timeout=None):
+        """Waits until server identified by `name`, or the latest server if
+        `name` is empty, has at least `count` connections. Returns the number
+        of connections.
+
+        Connections are accepted on background by servers started with
+        `auto_accept`, see `Start TCP server`. For UDP servers with
+        `peer_sessions`, the sessions of clients are counted. `timeout`
+        defaults to the default timeout of the server.
+
+        Examples:
+        | Wait for connections | 100 |
+        | ${count} = | Wait for connections | 10 | Server1 | timeout=5 |
+        """
+        server = self._servers.get(name)
+        with released(LOCK):
+            return server.wait_for_connections(count, timeout)
 
     def connect(self, host, port, name=None):
         """Connects a client to given `host` and `port`. If client `name` is not
@@ -331,7 +494,8 @@ class RammbockCore(object):
         | Connect | 127.0.0.1 | 8080 | Client1 |
         """
         client = self._clients.get(name)
-        client.connect_to(host, port)
+        with released(LOCK):
+            client.connect_to(host, port)
 
     def _register_send(self, sender, label, name, connection=None):
         self._message_sequence.send(name, sender.get_own_address(), sender.get_peer_address(alias=connection),
@@ -382,7 +546,8 @@ class RammbockCore(object):
         | ${binary} = | Client receives binary | Client1 | timeout=5 |
         """
         client, name = self._clients.get_with_name(name)
-        msg = client.receive(timeout=timeout)
+        with released(LOCK):
+            msg = client.receive(timeout=timeout)
         self._register_receive(client, label, name)
         return msg
 
@@ -409,7 +574,8 @@ class RammbockCore(object):
         | ${binary} | ${ip} | ${port} = | Server receives binary from | Server1 | connection=my_connection | timeout=5 |
         """
         server, name = self._servers.get_with_name(name)
-        msg, ip, port = server.receive_from(timeout=timeout, alias=connection)
+        with released(LOCK):
+            msg, ip, port = server.receive_from(timeout=timeout, alias=connection)
         self._register_receive(server, label, name, connection=connection)
         return msg, ip, port
 
@@ -503,6 +669,112 @@ class RammbockCore(object):
         _, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         return self._encode_message(message_fields, header_fields)
 
+    def save_message_image(self, name, *parameters):
+        """Encodes a message with the current template and saves its bytes as
+        a message image with `name`.
+
+        Images are sent with `Client sends message image` and `Server sends
+        message image` without encoding the message again. Only the fields
+        listed in `variables`, separated with commas, can be changed when
+        sending. Length fields depending on the size of a variable field are
+        updated automatically. Header fields are listed with `header:` prefix.
+        Other parameters are message field values as in `Get message`.
+
+        Returns the encoded message.
+
+        Examples:
+        | Save message image | MyImage | variables=sequence_number |
+        | Save message image | MyImage | variables=sequence_number,header:session_id | field_name:value |
+        """
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        variables = [field.strip() for field in configs.pop('variables', '').split(',') if field.strip()]
+        if configs:
+            raise AssertionError('Cannot set configs %s in Save message image' % ', '.join(configs))
+        msg = self._encode_message(message_fields, header_fields)
+        self._message_images[name] = MessageImage(self._get_message_template(), msg, variables)
+        return msg
+
+    def client_sends_message_image(self, image, *parameters):
+        """Sends message image saved with `Save message image`.
+
+        Optional parameters are client `name` and message `label` separated
+        with equals and values of the variable fields separated with colon.
+        Values of variable header fields are given with syntax
+        header:header_field_name:value. Fields not given keep the latest value
+        sent.
+
+        Examples:
+        | Client sends message image | MyImage | sequence_number:42 |
+        | Client sends message image | MyImage | name=Client1 | header:session_id:0x0a |
+        """
+        self._send_message_image(self.client_sends_binary, image, parameters)
+
+    def server_sends_message_image(self, image, *parameters):
+        """Sends message image saved with `Save message image`.
+
+        Optional parameters are server `name`, `connection` alias and message
+        `label` separated with equals and values of the variable fields
+        separated with colon. Values of variable header fields are given with
+        syntax header:header_field_name:value. Fields not given keep the
+        latest value sent.
+
+        Examples:
+        | Server sends message image | MyImage | sequence_number:42 |
+        | Server sends message image | MyImage | connection=my_connection | header:session_id:0x0a |
+        """
+        self._send_message_image(self.server_sends_binary, image, parameters)
+
+    def _send_message_image(self, callback, image, parameters):
+        if image not in self._message_images:
+            raise AssertionError('Message image %s not saved.' % image)
+        configs, fields, header_fields = self._parse_parameters(parameters)
+        fields.update(('header:' + name, value) for name, value in header_fields.items())
+        configs.setdefault('label', image)
+        callback(self._message_images[image].encode(fields), **configs)
+
+    def generate_message_corpus(self, count, *parameters):
+        """Encodes `count` messages with the current template into one binary.
+
+        Returns the binary and a list of offsets where the messages start in
+        it. Field values given as generators change from message to message:
+        - `counter(start, step)` counts up from `start`, by default from 0 by 1
+        - `random(min, max)` gives random integers between `min` and `max`
+        - `cycle(value1, value2, ...)` repeats the given values in order
+
+        Other field values are the same in all messages, as in `Get message`.
+        Header fields are given with syntax header:header_field_name:value.
+        Optional `seed` makes random values repeatable and `file` writes the
+        binary also to given file.
+
+        Values of fixed length integer fields are generated in batches with
+        NumPy when it is installed. Fields with dynamic length are encoded
+        one message at a time.
+
+        Examples:
+        | ${corpus} | ${offsets} = | Generate message corpus | 1000000 | sequence:counter(1) |
+        | ${corpus} | ${offsets} = | Generate message corpus | 1000 | header:session_id:random(1, 65535) | seed=42 | file=corpus.bin |
+        """
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        seed, file_name = configs.pop('seed', None), configs.pop('file', None)
+        if configs:
+            raise AssertionError('Cannot set configs %s in Generate message corpus' % ', '.join(configs))
+        message_fields, header_fields = dict(message_fields), dict(header_fields)
+        generators = {}
+        for prefix, fields in (('', message_fields), ('header:', header_fields)):
+            for name, value in fields.items():
+                generator = parse_generator(value)
+                if generator:
+                    generators[prefix + name] = generator
+                    fields[name] = str(generator.first)
+        msg = self._encode_message(message_fields, header_fields)
+        image = MessageImage(self._get_message_template(), msg, generators.keys())
+        corpus, offsets = generate_corpus(image, int(count), generators,
+                                          seed=int(seed) if seed is not None else None)
+        if file_name:
+            with open(file_name, 'wb') as output:
+                output.write(corpus)
+        return corpus, offsets
+
     def _encode_message(self, message_fields, header_fields):
         msg = self._get_message_template().encode(message_fields, header_fields)
         logger.debug('%s' % repr(msg))
@@ -559,6 +831,7 @@ class RammbockCore(object):
         - `name` the client name (default is the latest used) example: `name=Client 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, decode parts of the message only when they are accessed. Default is False. Example: `lazy=True`
         -  message field values for validation separated with colon. example: `some_field:0xaf05`
 
         Examples:
@@ -580,6 +853,7 @@ class RammbockCore(object):
         - `name` the client name (default is the latest used) example: `name=Client 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, decode parts of the message only when they are accessed. Default is False. Example: `lazy=True`
 
         Examples:
         | ${msg} = | Client receives without validation |
@@ -600,6 +874,8 @@ class RammbockCore(object):
         - `connection` alias. example: `connection=connection 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, decode parts of the message only when they are accessed. Default is False. Example: `lazy=True`
+        - `any_connection` if set to True, receive the first matching message from any connection of a TCP or SCTP server. The connection of the message becomes the current connection, and its alias is logged and returned by `Get current connection`. Example: `any_connection=True`
         -  message field values for validation separated with colon. example: `some_field:0xaf05`
 
         Optional parameters are server `name`, `connection` alias and
@@ -610,6 +886,8 @@ class RammbockCore(object):
         | ${msg} = | Server receives message |
         | ${msg} = | Server receives message | name=Server1 | alias=my_connection | timeout=5 |
         | ${msg} = | Server receives message | message_field:(0|1) |
+        | ${msg} = | Server receives message | any_connection=True | timeout=5 |
+        | ${connection} = | Get current connection |
         """
         with self._receive(self._servers, *parameters) as (msg, message_fields, header_fields):
             self._validate_message(msg, message_fields, header_fields)
@@ -626,6 +904,8 @@ class RammbockCore(object):
         - `connection` alias. example: `connection=connection 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, decode parts of the message only when they are accessed. Default is False. Example: `lazy=True`
+        - `any_connection` if set to True, receive the first matching message from any connection of a TCP or SCTP server. The connection of the message becomes the current connection, and its alias is logged and returned by `Get current connection`. Example: `any_connection=True`
 
         Examples:
         | ${msg} = | Server receives without validation |
@@ -656,11 +936,14 @@ class RammbockCore(object):
     def _receive(self, nodes, *parameters):
         configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         node, name = nodes.get_with_name(configs.pop('name', None))
-        msg = node.get_message(self._get_message_template(), **configs)
+        template = self._get_message_template()
+        with released(LOCK):
+            msg = node.get_message(template, **configs)
         try:
             yield msg, message_fields, header_fields
             self._register_receive(node, self._current_container.name, name)
-            logger.debug("Received %s" % repr(msg))
+            # repr would decode all the parts a lazily decoded message skipped
+            logger.debug("Received %s" % (msg._get_name() if configs.get('lazy') else repr(msg)))
         except AssertionError, e:
             self._register_receive(node, self._current_container.name, name, error=e.args[0])
             raise e
@@ -1030,6 +1313,43 @@ class RammbockCore(object):
         server = self._servers.get(server_name)
         return server.get_messages_count_in_buffer()
 
+    def get_client_evicted_messages_counts(self, client_name=None):
+        """Gets counts of messages evicted from the full message cache of client.
+
+        Returns a dictionary from header filter values of the evicted
+        messages to counts. See `Start UDP server` for limiting the cache.
+
+        Example:
+        | ${counts} = | Get client evicted messages counts | Client1 |
+        """
+        client = self._clients.get_with_name(client_name)[0]
+        return client.get_evicted_messages_counts()
+
+    def get_server_evicted_messages_counts(self, server_name=None):
+        """Gets counts of messages evicted from the full message cache of server.
+
+        Counts of all connections of a stream server are added together. See
+        `Get client evicted messages counts`.
+        """
+        server = self._servers.get(server_name)
+        return server.get_evicted_messages_counts()
+
+    def get_current_connection(self, server_name=None):
+        """Gets the alias of the current connection of server.
+
+        The connection of a message received with `any_connection` becomes
+        the current connection, see `Server receives message`. For UDP
+        servers with `peer_sessions`, the name of the current session is
+        returned.
+
+        Example:
+        | ${msg} = | Server receives message | any_connection=True |
+        | ${connection} = | Get current connection |
+        | Server sends message | connection=${connection} |
+        """
+        server = self._servers.get(server_name)
+        return server.get_current_connection()
+
     def close_client(self, name=None):
         """Closes the client connection based on the `client_name`.
 
@@ -0,0 +1,156 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import time
+import traceback
+from collections import deque
+
+from .logger import logger
+
+DEFAULT_QUEUE_SIZE = 1000
+
+
+class HandlerExecutor(object):
+    """Runs background handlers of message streams.
+
+    Without workers handlers run in the thread that received the message.
+    With workers, handlers are queued to a bounded queue and run by a pool of
+    threads. Handlers of messages with the same key, the receiving message
+    stream, run one at a time in the order the messages were received, while
+    handlers of different keys run in parallel.
+
+    Handlers still queued when the workers are removed are run by the old
+    workers before handlers are run inline again, so that no handler overtakes
+    an earlier one.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._workers = []
+        self._queue_size = DEFAULT_QUEUE_SIZE
+        self._tasks = {}
+        self._ready = deque()
+        self._queued = 0
+        self._local = threading.local()
+        self.reset_statistics()
+
+    def configure(self, workers=0, queue_size=DEFAULT_QUEUE_SIZE):
+        workers, queue_size = int(workers), int(queue_size)
+        if workers < 0 or queue_size < 1:
+            raise AssertionError('Handler executor needs zero or more workers and a positive queue size.')
+        if getattr(self._local, 'worker', False):
+            raise AssertionError('Handler executor can not be configured from a handler run by a worker.')
+        with self._condition:
+            self._generation += 1
+            self._queue_size = queue_size
+            self._workers = [self._start_worker(self._generation, index) for index in range(workers)]
+            self._condition.notify_all()
+            while not self._workers and self._tasks:
+                self._condition.wait()
+
+    def _start_worker(self, generation, index):
+        worker = threading.Thread(target=self._work, args=(generation,), name="Handler worker %d" % (index + 1))
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def submit(self, key, handler, inline_lock=None):
+        """Runs or queues `handler`. Handlers run inline hold `inline_lock`."""
+        with self._condition:
+            inline = not self._workers and not self._tasks
+        if inline:
+            self._run_inline(handler, inline_lock)
+            return
+        with self._condition:
+            if self._queued >= self._queue_size:
+                self._statistics['rejected'] += 1
+                logger.warn('Handler queue is full with %d messages. Message is not handled.' % self._queued)
+                return
+            task = (time.time(), handler)
+            if key in self._tasks:
+                self._tasks[key].append(task)
+            else:
+                self._tasks[key] = deque([task])
+                self._ready.append(key)
+            self._queued += 1
+            self._statistics['max_queued'] = max(self._statistics['max_queued'], self._queued)
+            self._condition.notify()
+
+    def _run_inline(self, handler, lock):
+        if not lock:
+            self._run(handler, time.time(), raise_errors=True)
+            return
+        with lock:
+            self._run(handler, time.time(), raise_errors=True)
+
+    def _work(self, generation):
+        self._local.worker = True
+        while True:
+            with self._condition:
+                while not self._ready and generation == self._generation:
+                    self._condition.wait()
+                # Workers of an old pool finish the queue if there is no new pool.
+                if generation != self._generation and (self._workers or not self._ready):
+                    return
+                key = self._ready.popleft()
+                queued, handler = self._tasks[key].popleft()
+                self._queued -= 1
+            self._run(handler, queued)
+            with self._condition:
+                if self._tasks[key]:
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._tasks[key]
+                    if not self._tasks:
+                        self._condition.notify_all()
+
+    def _run(self, handler, queued, raise_errors=False):
+        start = time.time()
+        try:
+            handler()
+        except Exception:
+            self._update_statistics(queued, start, 'failed')
+            if raise_errors:
+                raise
+            logger.debug("failure in background handler %s" % traceback.format_exc())
+        else:
+            self._update_statistics(queued, start, 'handled')
+
+    def _update_statistics(self, queued, start, result):
+        run_time = time.time() - start
+        with self._condition:
+            statistics = self._statistics
+            statistics[result] += 1
+            statistics['total_run_time'] += run_time
+            statistics['max_run_time'] = max(statistics['max_run_time'], run_time)
+            statistics['max_queue_time'] = max(statistics['max_queue_time'], start - queued)
+
+    def reset_statistics(self):
+        self._statistics = {'handled': 0, 'failed': 0, 'rejected': 0, 'max_queued': 0,
+                            'total_run_time': 0.0, 'max_run_time': 0.0, 'max_queue_time': 0.0}
+
+    def get_statistics(self):
+        with self._condition:
+            statistics = dict(self._statistics)
+            statistics['workers'] = len(self._workers)
+            statistics['queued'] = self._queued
+        calls = statistics['handled'] + statistics['failed']
+        statistics['average_run_time'] = statistics['total_run_time'] / calls if calls else 0.0
+        return statistics
+
+
+EXECUTOR = HandlerExecutor()
@@ -14,10 +14,14 @@
 
 from math import ceil
 from .binary_tools import to_0xhex, to_binary_string_of_length, \
-    to_bin_of_length, to_tbcd_value, to_tbcd_binary, from_twos_comp
+    int_to_bin_of_length, to_tbcd_value, to_tbcd_binary, from_twos_comp, \
+    bin_to_int
 from .ordered_dict import OrderedDict
 
 
+_NON_PRINTABLE = ''.join(chr(i) for i in range(256) if not 32 <= i < 128)
+
+
 class _StructuredElement(object):
 
     _type = None
@@ -30,18 +34,45 @@ class _StructuredElement(object):
     def __setitem__(self, name, child):
         self._fields[unicode(name)] = child
         child._parent = self
+        self._changed()
 
     def __getitem__(self, name):
         return self._fields[unicode(name)]
 
     def __getattr__(self, name):
+        if name == '_fields' and '_pending_decode' in self.__dict__:
+            self._decode_pending()
+            return self._fields
         return self[name]
 
+    def _set_pending_decode(self, length, decode):
+        """Defers decoding the children until they are first needed.
+
+        `decode` returns an element of the same type with decoded children.
+        Until then the element has the given length and no `_fields`.
+        """
+        del self._fields
+        self._decoded_length = length
+        self._pending_decode = decode
+
+    def _decode_pending(self):
+        decoded = self._pending_decode()
+        del self._pending_decode
+        self._fields = decoded._fields
+        for child in self._fields.values():
+            child._parent = self
+
     def __delitem__(self, name):
         name = unicode(name)
         item = self._fields[name]
         del self._fields[name]
         item._parent = None
+        self._changed()
+
+    def _changed(self):
+        """Tells the parents that the children of this element have changed."""
+        if self._parent:
+            self._parent._changed()
 
     def __str__(self):
         return self._get_name()
@@ -66,9 +97,18 @@ class _StructuredElement(object):
         return '%s %s' % (self._type, self._name)
 
     def _get_raw_bytes(self):
-        return ''.join((field._raw for field in self._fields.values()))
+        raw = bytearray()
+        self._write_raw(raw)
+        return str(raw)
+
+    def _write_raw(self, raw):
+        """Appends the encoded bytes of this element to bytearray `raw`."""
+        for field in self._fields.values():
+            field._write_raw(raw)
 
     def __len__(self):
+        if '_fields' not in self.__dict__:
+            return self._decoded_length
         return sum(len(field) for field in self._fields.values())
 
     def __nonzero__(self):
@@ -127,15 +167,19 @@ class Struct(_StructuredElement):
         self._align = align
 
     def __len__(self):
+        if '_fields' not in self.__dict__:
+            return self._decoded_length
         result = sum(len(field) for field in self._fields.values())
         return self._get_aligned(result)
 
     def _get_aligned(self, length):
         return length + (self._align - length % self._align) % self._align
 
-    def _get_raw_bytes(self):
-        result = ''.join((field._raw for field in self._fields.values()))
-        return result.ljust(self._get_aligned(len(result)), '\x00')
+    def _write_raw(self, raw):
+        start = len(raw)
+        _StructuredElement._write_raw(self, raw)
+        length = len(raw) - start
+        raw.extend('\x00' * (self._get_aligned(length) - length))
 
 
 class Union(_StructuredElement):
@@ -153,6 +197,9 @@ class Union(_StructuredElement):
                 max_raw = field._raw
         return max_raw.ljust(self._length, '\x00')
 
+    def _write_raw(self, raw):
+        raw.extend(self._get_raw_bytes())
+
     def __len__(self):
         return self._length
 
@@ -172,12 +219,20 @@ class BinaryContainer(_StructuredElement):
         return self._binlength() / 8
 
     def _get_raw_bytes(self):
-        # TODO: faster implementation...
-        result = to_bin_of_length(len(self), ' '.join((field.bin for field in self._fields.values())))
+        value = 0
+        for field in self._fields.values():
+            if int(field) >> field.binlength:
+                raise AssertionError('Value %s of binary field %s does not fit in %d bits'
+                                     % (field.hex, field._get_recursive_name(), field.binlength))
+            value = value << field.binlength | int(field)
+        result = int_to_bin_of_length(len(self), value)
         if self._little_endian:
             return result[::-1]
         return result
 
+    def _write_raw(self, raw):
+        raw.extend(self._get_raw_bytes())
+
 
 class TBCDContainer(BinaryContainer):
 
@@ -204,11 +259,25 @@ class Conditional(_StructuredElement):
 class Message(_StructuredElement):
 
     _type = 'Message'
+    _encoded = None
+
+    def _changed(self):
+        self._encoded = None
 
     def _add_header(self, header):
         new = OrderedDict({'_header': header})
         new.update(self._fields)
         self._fields = new
+        self._encoded = None
+
+    def _set_raw_bytes(self, raw):
+        """Stores the encoded bytes of a complete message for sending."""
+        self._encoded = str(raw)
+
+    def _get_raw_bytes(self):
+        if self._encoded is None:
+            return _StructuredElement._get_raw_bytes(self)
+        return self._encoded
 
     def _get_recursive_name(self):
         return ''
@@ -219,8 +288,25 @@ class Header(_StructuredElement):
     _type = 'Header'
 
 
+class _cached_property(object):
+    """Read-only property whose value is computed once per instance."""
+
+    def __init__(self, func):
+        self._func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.__name__] = self._func(instance)
+        return value
+
+
 class Field(object):
 
+    _codec = None
+
     def __init__(self, type, name, value, aligned_len=None, little_endian=False):
         self._type = type
         self._name = name
@@ -229,38 +315,42 @@ class Field(object):
         self._little_endian = little_endian
         self._parent = None
 
-    @property
+    @_cached_property
     def _value(self):
         return self._original_value[::-1] if self._little_endian else self._original_value
-    # TODO: If needed, original value and raw value can be precalculated
-    # in __init__
 
     @property
     def name(self):
         return self._name
 
-    @property
+    @_cached_property
     def int(self):
         if self._type == 'int':
             return self.sint
         return int(self)
 
     def __int__(self):
-        return int(to_0xhex(self._value), 16)
+        return self._uint
+
+    @_cached_property
+    def _uint(self):
+        if self._codec:
+            return self._codec.unpack_from(self._original_value)[0]
+        return bin_to_int(self._value)
 
     @property
     def uint(self):
         return self.int
 
-    @property
+    @_cached_property
     def sint(self):
         return from_twos_comp(int(self), len(self._value) * 8)
 
-    @property
+    @_cached_property
     def hex(self):
         return hex(self)
 
-    @property
+    @_cached_property
     def tbcd(self):
         return to_tbcd_value(self._original_value)
 
@@ -278,21 +368,27 @@ class Field(object):
     def chars(self):
         return self.ascii
 
-    @property
+    @_cached_property
     def bin(self):
         return self._bin()
 
     def _bin(self):
         return to_binary_string_of_length(self._length * 8, self._value)
 
-    @property
+    @_cached_property
     def ascii(self):
+        if isinstance(self._value, str):
+            return self._value.translate(None, _NON_PRINTABLE)
         return ''.join(i for i in self._value if 128 > ord(i) >= 32)
 
-    @property
+    @_cached_property
     def _raw(self):
         return self._original_value.ljust(self._length, '\x00')
 
+    def _write_raw(self, raw):
+        raw.extend(self._original_value)
+        raw.extend('\x00' * (self._length - len(self._original_value)))
+
     def __str__(self):
         return str(self.__getattribute__(self._type))
 
@@ -13,11 +13,17 @@
 #  limitations under the License.
 
 
+import errno
+import select
 import socket
+import threading
 import time
+from collections import deque
 from .logger import logger
-from .synchronization import SynchronizedType
+from .reactor import REACTOR, get_poller
+from .synchronization import SynchronizedType, unsynchronized
 from .binary_tools import to_hex
+from .templates.message_stream import get_cache_size, get_cache_policy
 
 try:
     from sctp import sctpsocket_tcp
@@ -27,7 +33,12 @@ except ImportError:
 
 UDP_BUFFER_SIZE = 65536
 TCP_BUFFER_SIZE = 1000000
+TCP_RECEIVE_SIZE = 16384
+STREAM_BUFFER_SIZE = 131072
+QUEUED_STREAM_BUFFER_SIZE = 1024
 TCP_MAX_QUEUED_CONNECTIONS = 5
+ANY_CONNECTION_POLL_INTERVAL = 0.1
+SESSION_EXPIRY_INTERVAL = 1.0
 
 
 def get_family(family):
@@ -51,14 +62,38 @@ class _WithTimeouts(object):
         self._default_timeout = self._get_timeout(timeout)
 
 
+def _wait_for_socket(sock, timeout, writable=False):
+    """Tells if `sock` becomes readable, or `writable`, within `timeout`.
+
+    Waits with `poll` where available, because `select` does not accept file
+    descriptors from `FD_SETSIZE`, usually 1024, up.
+    """
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT if writable else select.POLLIN)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+    if writable:
+        return bool(select.select([], [sock], [], timeout)[1])
+    return bool(select.select([sock], [], [], timeout)[0])
+
+
+def _is_set(option):
+    return bool(option) and str(option).lower() != 'false'
+
+
 class _NetworkNode(_WithTimeouts):
 
     __metaclass__ = SynchronizedType
 
     _message_stream = None
+    _cache_size = None
+    _cache_policy = None
     parent = None
     name = '<not set>'
 
+    def __init__(self):
+        self._lock = threading.RLock()
+
     def set_handler(self, msg_template, handler_func, header_filter, alias=None, interval=None):
         if alias:
             raise AssertionError('Named connections not supported.')
@@ -67,6 +102,9 @@ class _NetworkNode(_WithTimeouts):
     def get_own_address(self):
         return self._socket.getsockname()[:2]
 
+    def fileno(self):
+        return self._socket.fileno()
+
     def get_peer_address(self, alias=None):
         if alias:
             raise AssertionError('Named connections not supported.')
@@ -75,26 +113,47 @@ class _NetworkNode(_WithTimeouts):
     def close(self):
         if self._is_connected:
             self._is_connected = False
-            self._socket.close()
             if self._message_stream:
                 self._message_stream.close()
             self._message_stream = None
+            self._socket.close()
 
     # TODO: Rename to _get_new_message_stream
     def _get_message_stream(self):
         if not self._protocol:
             return None
-        return self._protocol.get_message_stream(BufferedStream(self, self._default_timeout))
+        return self._protocol.get_message_stream(self._get_buffered_stream(),
+                                                 self._cache_size, self._cache_policy, self._lock)
+
+    def _get_buffered_stream(self):
+        return BufferedStream(self, self._default_timeout)
+
+    def _set_cache(self, cache_size, cache_policy):
+        self._cache_size = get_cache_size(cache_size)
+        self._cache_policy = get_cache_policy(cache_policy)
+
+    def get_message(self, message_template, timeout=None, header_filter=None, latest=None, lazy=None,
+                    any_connection=False):
+        if _is_set(any_connection):
+            raise AssertionError('any_connection is only supported on stream servers')
+        self._check_template(message_template)
+        return self._get_from_stream(message_template, self._message_stream, timeout=timeout, header_filter=header_filter, latest=latest, lazy=lazy)
 
-    def get_message(self, message_template, timeout=None, header_filter=None, latest=None):
+    def get_received_message(self, message_template, header_filter=None, latest=None, lazy=None):
+        self._check_template(message_template)
+        return self._message_stream.get_received(message_template, header_filter=header_filter, latest=latest, lazy=lazy)
+
+    def _check_template(self, message_template):
         if not self._protocol:
             raise AssertionError('Can not receive messages without protocol. Initialize network node with "protocol=<protocl name>"')
         if self._protocol != message_template._protocol:
             raise AssertionError('Template protocol does not match network node protocol %s!=%s' % (self.protocol_name, message_template._protocol.name))
-        return self._get_from_stream(message_template, self._message_stream, timeout=timeout, header_filter=header_filter, latest=latest)
 
-    def _get_from_stream(self, message_template, stream, timeout, header_filter, latest):
-        return stream.get(message_template, timeout=timeout, header_filter=header_filter, latest=latest)
+    def is_closed_by_peer(self):
+        return bool(self._message_stream) and self._message_stream.is_closed_by_peer()
+
+    def _get_from_stream(self, message_template, stream, timeout, header_filter, latest, lazy=None):
+        return stream.get(message_template, timeout=timeout, header_filter=header_filter, latest=latest, lazy=lazy)
 
     def log_send(self, binary, ip, port):
         logger.debug("Send %d bytes: %s to %s:%s over %s" % (len(binary), to_hex(binary), ip, port, self._transport_layer_name))
@@ -127,6 +186,17 @@ class _NetworkNode(_WithTimeouts):
         self.log_receive(msg, ip, port)
         return msg, ip, port
 
+    def receive_into(self, buffer, timeout=None):
+        timeout = self._get_timeout(timeout)
+        self._socket.settimeout(timeout)
+        return self._receive_into_ip_port(buffer)[0]
+
+    def _receive_into_ip_port(self, buffer):
+        size = self._socket.recv_into(buffer)
+        ip, port = self._socket.getpeername()[:2]
+        self.log_receive(buffer[:size], ip, port)
+        return size, ip, port
+
     def send(self, msg, alias=None):
         self._raise_error_if_alias_given(alias)
         ip, port = self.get_peer_address()
@@ -147,11 +217,17 @@ class _NetworkNode(_WithTimeouts):
     def get_messages_count_in_buffer(self):
         return self._message_stream.get_messages_count_in_cache()
 
+    def get_evicted_messages_counts(self):
+        if not self._message_stream:
+            return {}
+        return self._message_stream.get_evicted_messages_counts()
+
 
 class _TCPNode(object):
 
     _transport_layer_name = 'TCP'
     _size_limit = TCP_BUFFER_SIZE
+    _receive_size = TCP_RECEIVE_SIZE
 
     def _init_socket(self, family):
         self._socket = socket.socket(get_family(family), socket.SOCK_STREAM)
@@ -162,6 +238,7 @@ class _UDPNode(object):
 
     _transport_layer_name = 'UDP'
     _size_limit = UDP_BUFFER_SIZE
+    _receive_size = UDP_BUFFER_SIZE
 
     def _init_socket(self, family):
         self._socket = socket.socket(get_family(family), socket.SOCK_DGRAM)
@@ -172,6 +249,7 @@ class _SCTPNode(object):
 
     _transport_layer_name = 'SCTP'
     _size_limit = TCP_BUFFER_SIZE
+    _receive_size = TCP_RECEIVE_SIZE
 
     def _init_socket(self, family):
         if not SCTP_ENABLED:
@@ -179,12 +257,173 @@ class _SCTPNode(object):
         self._socket = sctpsocket_tcp(get_family(family))
 
 
+class _AsyncNode(object):
+    """Node whose socket is read on background by the reactor.
+
+    The socket is non-blocking. The reactor thread reads whatever has arrived
+    to a queue, from which the node receives, so the sockets of any number of
+    asynchronous nodes are read by one thread and waiting receivers never
+    touch the socket. Message streams of the node decode messages from the
+    queue and are scheduled to the reactor when data arrives.
+    """
+
+    def _init_async(self):
+        self._received = deque()
+        self._received_changed = threading.Condition(threading.Lock())
+        self._closed_by_peer = False
+        self._remote = None
+
+    def _start_async(self):
+        self._is_stream = self._socket.type == socket.SOCK_STREAM
+        if self._is_stream:
+            self._remote = self._socket.getpeername()
+        self._socket.setblocking(0)
+        REACTOR.register(self)
+
+    def _get_buffered_stream(self):
+        return _QueuedStream(self, self._default_timeout, size=QUEUED_STREAM_BUFFER_SIZE)
+
+    def handle_readable(self):
+        """Reads the data that has arrived to the receive queue.
+
+        Called by the reactor when the socket is readable. Returns False if
+        the node has been closed or the peer has closed the connection.
+        """
+        received = False
+        while self._is_connected and not self._closed_by_peer:
+            try:
+                data, address = self._read_available()
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    logger.debug("Receiving failed: %s" % e)
+                    # A failed stream socket would stay readable forever.
+                    self._closed_by_peer = self._is_stream
+                break
+            with self._received_changed:
+                if data or not self._is_stream:
+                    self._received.append((data, address))
+                else:
+                    self._closed_by_peer = True
+                self._received_changed.notify_all()
+            received = True
+        if received or self._closed_by_peer:
+            self._data_arrived()
+        return self._is_connected and not self._closed_by_peer
+
+    def _read_available(self):
+        if self._is_stream:
+            return self._socket.recv(self._receive_size), self._remote
+        return self._socket.recvfrom(self._size_limit)
+
+    def _data_arrived(self):
+        # Handlers of the message stream are run by the reactor after this.
+        if self._message_stream:
+            REACTOR.schedule(self._message_stream)
+        if self.parent:
+            self.parent._data_arrived()
+
+    def _has_queued(self):
+        return bool(self._received)
+
+    def _is_queue_closed(self):
+        return self._closed_by_peer and not self._received
+
+    def _next_queued_size(self):
+        received = self._received
+        return len(received[0][0]) if received else 0
+
+    def _wait_for_queued(self, timeout):
+        with self._received_changed:
+            self._wait_in_queue(timeout)
+
+    def _wait_in_queue(self, timeout):
+        cutoff = time.time() + timeout if timeout is not None else None
+        while not self._received and not self._closed_by_peer:
+            if not self._is_connected:
+                raise socket.error(errno.ENOTCONN, 'Socket is not connected')
+            remaining = cutoff - time.time() if cutoff is not None else None
+            if remaining is not None and remaining <= 0:
+                raise socket.timeout('timed out')
+            self._received_changed.wait(remaining)
+
+    def _next_received(self, timeout, size):
+        """Returns the next received data and its source address. Data of a
+        stream is split when it is longer than `size`, and is empty after the
+        peer has closed the connection."""
+        with self._received_changed:
+            self._wait_in_queue(self._get_timeout(timeout))
+            if not self._received:
+                return '', self._remote
+            data, address = self._received.popleft()
+            if len(data) > size:
+                if self._is_stream:
+                    self._received.appendleft((data[size:], address))
+                data = data[:size]
+            return data, address
+
+    # Receiving takes only the lock of the queue, so closing and sending are
+    # not blocked by waiting receivers.
+    def receive(self, timeout=None, alias=None):
+        return self.receive_from(timeout, alias)[0]
+
+    def receive_from(self, timeout=None, alias=None):
+        self._raise_error_if_alias_given(alias)
+        data, address = self._next_received(timeout, self._size_limit)
+        ip, port = address[:2]
+        self.log_receive(data, ip, port)
+        self._received_from(ip, port)
+        return data, ip, port
+
+    def receive_into(self, buffer, timeout=None):
+        data, address = self._next_received(timeout, len(buffer))
+        buffer[:len(data)] = data
+        ip, port = address[:2]
+        self.log_receive(data, ip, port)
+        self._received_from(ip, port)
+        return len(data)
+
+    def _received_from(self, ip, port):
+        pass
+
+    def _sendall(self, msg):
+        # Sockets encode unicode, which buffer would expose as it is stored.
+        data = buffer(str(msg) if isinstance(msg, unicode) else msg)
+        while True:
+            try:
+                sent = self._send_available(data)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    raise
+                self._wait_until_writable()
+                continue
+            data = buffer(data, sent)
+            if not data or not self._is_stream:
+                return
+
+    def _send_available(self, data):
+        return self._socket.send(data)
+
+    def _wait_until_writable(self):
+        if not _wait_for_socket(self._socket, self._default_timeout, writable=True):
+            raise socket.timeout('timed out')
+
+    def close(self):
+        if self._is_connected:
+            REACTOR.unregister(self)
+        super(_AsyncNode, self).close()
+        with self._received_changed:
+            self._received_changed.notify_all()
+
+
 class _Server(_NetworkNode):
 
-    def __init__(self, ip, port, timeout=None):
+    def __init__(self, ip, port, timeout=None, cache_size=None, cache_policy=None):
         self._ip = ip
         self._port = int(port)
         self._set_default_timeout(timeout)
+        self._set_cache(cache_size, cache_policy)
         _NetworkNode.__init__(self)
 
     def _bind_socket(self):
@@ -194,11 +433,14 @@ class _Server(_NetworkNode):
             raise Exception("error: [Errno %d] %s for address %s:%d" % (e[0], e[1], self._ip, self._port))
         self._is_connected = True
 
+    def get_current_connection(self):
+        raise AssertionError('Only stream servers and UDP servers with peer sessions have connections.')
+
 
 class UDPServer(_Server, _UDPNode):
 
-    def __init__(self, ip, port, timeout=None, protocol=None, family=None):
-        _Server.__init__(self, ip, port, timeout)
+    def __init__(self, ip, port, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None):
+        _Server.__init__(self, ip, port, timeout, cache_size, cache_policy)
         self._protocol = protocol
         self._last_client = None
         self._init_socket(family)
@@ -212,6 +454,13 @@ class UDPServer(_Server, _UDPNode):
         self._last_client = (ip, int(port))
         return msg, ip, port
 
+    def _receive_into_ip_port(self, buffer):
+        size, address = self._socket.recvfrom_into(buffer)
+        ip, port = address[:2]
+        self.log_receive(buffer[:size], ip, port)
+        self._last_client = (ip, int(port))
+        return size, ip, port
+
     def _check_no_alias(self, alias):
         if alias:
             raise Exception('Connection aliases are not supported on UDP Servers')
@@ -230,37 +479,392 @@ class UDPServer(_Server, _UDPNode):
         return self._last_client
 
 
+class UDPSessionServer(UDPServer):
+    """UDP server that keeps a session for every peer.
+
+    Datagrams are read on background by the reactor and passed to the session
+    of their source address, which has its own message stream. Sessions are
+    named `ip:port` and can be used like connections of stream servers.
+    Receiving without a session alias receives from any session and makes the
+    session of the received message the current session, which is used for
+    sending. Sessions that have not received or sent datagrams for
+    `idle_timeout` seconds are closed.
+    """
+
+    def __init__(self, ip, port, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None,
+                 idle_timeout=None):
+        UDPServer.__init__(self, ip, port, timeout, protocol, family, cache_size, cache_policy)
+        # Sessions take this lock while holding their own, see synchronization.
+        self._sessions_changed = threading.Condition(threading.Lock())
+        self._sessions = {}
+        self._current = None
+        self._handlers = []
+        self._arrivals = 0
+        self._first_polled = 0
+        self._idle_timeout = _get_idle_timeout(idle_timeout)
+        self._next_expiry = time.time()
+        self._receive_buffer = bytearray(self._size_limit)
+        self._socket.setblocking(0)
+        REACTOR.register(self)
+
+    def _get_message_stream(self):
+        return None
+
+    @unsynchronized
+    def handle_readable(self):
+        """Reads the received datagrams to the sessions of their peers.
+
+        Called by the reactor when the socket is readable. Returns False if
+        the server has been closed.
+        """
+        streams = set()
+        while self._is_connected:
+            try:
+                size, address = self._socket.recvfrom_into(self._receive_buffer)
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    logger.debug("Receiving datagram failed: %s" % e)
+                break
+            stream = self._add_datagram(str(buffer(self._receive_buffer, 0, size)), address[:2])
+            if stream:
+                streams.add(stream)
+        # Handlers of the sessions are run by the reactor after this.
+        for stream in streams:
+            REACTOR.schedule(stream)
+        self._expire_idle_sessions()
+        return self._is_connected
+
+    def _add_datagram(self, datagram, address):
+        with self._sessions_changed:
+            session = self._sessions.get(address) or self._add_session(address)
+            session._queue_datagram(datagram)
+            session.last_active = time.time()
+            self._arrivals += 1
+            self._sessions_changed.notify_all()
+        return session._message_stream
+
+    def _add_session(self, address):
+        session = _UDPSession(self, address, self._protocol, self._handlers)
+        self._sessions[address] = session
+        self._sessions_changed.notify_all()
+        logger.debug("New session %s" % session.name)
+        return session
+
+    def _expire_idle_sessions(self):
+        if self._idle_timeout is None or time.time() < self._next_expiry:
+            return
+        with self._sessions_changed:
+            now = time.time()
+            self._next_expiry = now + min(self._idle_timeout, SESSION_EXPIRY_INTERVAL)
+            # Sessions someone is waiting for are not idle.
+            expired = [session for session in self._sessions.itervalues()
+                       if not session._waiters and now - session.last_active >= self._idle_timeout]
+            for session in expired:
+                del self._sessions[session.get_peer_address()]
+        for session in expired:
+            logger.debug("Closing session %s idle for %.1f seconds" % (session.name, now - session.last_active))
+            session.close()
+        if expired:
+            with self._sessions_changed:
+                self._sessions_changed.notify_all()
+
+    def _get_session(self, alias=None):
+        self._expire_idle_sessions()
+        address = self._to_address(alias) if alias else self._current
+        with self._sessions_changed:
+            if not address:
+                raise AssertionError('Server has no default client, because it has not received messages from clients yet.')
+            if address not in self._sessions:
+                raise AssertionError('Server has no session with %s:%s.' % address)
+            return self._sessions[address]
+
+    def _to_address(self, alias):
+        ip, _, port = str(alias).rpartition(':')
+        try:
+            return ip.strip('[]'), int(port)
+        except ValueError:
+            raise AssertionError("Session alias must be in format ip:port, got '%s'." % alias)
+
+    def _get_sessions(self):
+        with self._sessions_changed:
+            return self._sessions.values()
+
+    def _wait_for_datagram(self, session, timeout):
+        cutoff = time.time() + timeout if timeout is not None else None
+        with self._sessions_changed:
+            session._waiters += 1
+            try:
+                if session._overflow:
+                    raise session._overflow
+                while not session._datagrams:
+                    if not session._is_connected:
+                        raise AssertionError('Session %s has been closed.' % session.name)
+                    remaining = cutoff - time.time() if cutoff is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise socket.timeout('timed out')
+                    self._sessions_changed.wait(remaining)
+            finally:
+                session._waiters -= 1
+
+    @unsynchronized
+    def wait_for_connections(self, count, timeout=None):
+        count = int(count)
+        timeout = self._get_timeout(timeout)
+        cutoff = time.time() + timeout if timeout is not None else None
+        with self._sessions_changed:
+            while len(self._sessions) < count:
+                remaining = cutoff - time.time() if cutoff is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise AssertionError('Timeout %fs exceeded while waiting for %d sessions, got %d.'
+                                         % (timeout, count, len(self._sessions)))
+                self._sessions_changed.wait(remaining)
+            return len(self._sessions)
+
+    @unsynchronized
+    def set_handler(self, msg_template, handler_func, header_filter, alias=None, interval=None):
+        if alias:
+            self._get_session(alias).set_handler(msg_template, handler_func, header_filter, interval=interval)
+            return
+        self._check_template(msg_template)
+        with self._sessions_changed:
+            self._handlers.append((msg_template, handler_func, header_filter))
+            sessions = self._sessions.values()
+        for session in sessions:
+            session.set_handler(msg_template, handler_func, header_filter, interval=interval)
+
+    @unsynchronized
+    def receive_from(self, timeout=None, alias=None):
+        if alias:
+            return self._get_session(alias).receive_from(timeout=timeout)
+        return self._receive_from_any_session(_get_received_datagram, timeout, socket.timeout)
+
+    @unsynchronized
+    def get_message(self, message_template, timeout=None, alias=None, header_filter=None, latest=None, lazy=None,
+                    any_connection=False):
+        if alias:
+            return self._get_session(alias).get_message(message_template, timeout=timeout, header_filter=header_filter,
+                                                        latest=latest, lazy=lazy)
+        self._check_template(message_template)
+
+        def get_received_message(session):
+            return session.get_received_message(message_template, header_filter=header_filter, latest=latest,
+                                                lazy=lazy)
+        return self._receive_from_any_session(get_received_message, timeout, AssertionError)
+
+    def _receive_from_any_session(self, get_received, timeout, timeout_error):
+        """Returns what `get_received` returns first for any session and makes
+        the session the current session.
+
+        Sessions are tried starting from a different session every time, so
+        busy peers do not starve the others.
+        """
+        timeout = self._get_timeout(timeout)
+        cutoff = time.time() + timeout if timeout is not None else None
+        while True:
+            with self._sessions_changed:
+                arrivals = self._arrivals
+                sessions = self._get_polling_order()
+            for session in sessions:
+                if not session._has_received():
+                    continue
+                received = get_received(session)
+                if received:
+                    self._set_current_session(session)
+                    return received
+            with self._sessions_changed:
+                remaining = cutoff - time.time() if cutoff is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise timeout_error('Timeout %fs exceeded while receiving from any session.' % timeout)
+                if arrivals == self._arrivals:
+                    self._sessions_changed.wait(remaining)
+
+    def _get_polling_order(self):
+        sessions = self._sessions.values()
+        self._first_polled += 1
+        if not sessions:
+            return sessions
+        first = self._first_polled % len(sessions)
+        return sessions[first:] + sessions[:first]
+
+    def _set_current_session(self, session):
+        with self._sessions_changed:
+            if session.get_peer_address() in self._sessions:
+                self._current = session.get_peer_address()
+        logger.info("Received message from session %s" % session.name)
+
+    @unsynchronized
+    def get_current_connection(self):
+        return self._get_session().name
+
+    @unsynchronized
+    def send(self, msg, alias=None):
+        self._get_session(alias).send(msg)
+
+    @unsynchronized
+    def send_to(self, msg, ip, port):
+        address = (ip, int(port))
+        with self._sessions_changed:
+            session = self._sessions.get(address) or self._add_session(address)
+            self._current = address
+        session.send(msg)
+
+    @unsynchronized
+    def get_peer_address(self, alias=None):
+        return self._get_session(alias).get_peer_address()
+
+    @unsynchronized
+    def empty(self):
+        for session in self._get_sessions():
+            session.empty()
+
+    @unsynchronized
+    def get_messages_count_in_buffer(self):
+        return sum(session.get_messages_count_in_buffer() for session in self._get_sessions())
+
+    @unsynchronized
+    def get_evicted_messages_counts(self):
+        counts = {}
+        for session in self._get_sessions():
+            for key, count in session.get_evicted_messages_counts().items():
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def close(self):
+        if self._is_connected:
+            self._is_connected = False
+            REACTOR.unregister(self)
+            with self._sessions_changed:
+                sessions, self._sessions, self._current = self._sessions.values(), {}, None
+            for session in sessions:
+                session.close()
+            self._socket.close()
+
+
+def _get_idle_timeout(idle_timeout):
+    if idle_timeout in (None, '') or str(idle_timeout).lower() == 'none':
+        return None
+    idle_timeout = float(idle_timeout)
+    if idle_timeout <= 0:
+        raise AssertionError('Session idle timeout must be positive, got %s.' % idle_timeout)
+    return idle_timeout
+
+
+def _get_received_datagram(session):
+    try:
+        return session.receive_from(timeout=0)
+    except socket.timeout:
+        return None
+
+
 class StreamServer(_Server):
 
-    def __init__(self, ip, port, timeout=None, protocol=None, family=None):
-        _Server.__init__(self, ip, port, timeout)
+    def __init__(self, ip, port, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None,
+                 backlog=None, auto_accept=False):
+        _Server.__init__(self, ip, port, timeout, cache_size, cache_policy)
+        self._connections_changed = threading.Condition(self._lock)
         self._init_socket(family)
         self._bind_socket()
-        self._socket.listen(TCP_MAX_QUEUED_CONNECTIONS)
+        self._socket.listen(int(backlog) if backlog else TCP_MAX_QUEUED_CONNECTIONS)
         self._protocol = protocol
         self._init_connection_cache()
+        self._first_polled = 0
+        self._auto_accept = auto_accept
+        self._accept_failing = False
+        if auto_accept:
+            self._socket.setblocking(0)
+            REACTOR.register(self)
 
     def _init_connection_cache(self):
         self._connections = _NamedCache('connection', "No connections accepted!")
 
+    def _get_connection(self, alias=None):
+        with self._lock:
+            return self._connections.get(alias)
+
+    def _get_connections(self):
+        with self._lock:
+            return list(self._connections)
+
+    @unsynchronized
     def set_handler(self, msg_template, handler_func, header_filter, alias=None, interval=None):
-        connection = self._connections.get(alias)
+        connection = self._get_connection(alias)
         connection.set_handler(msg_template, handler_func, header_filter, interval=interval)
 
+    @unsynchronized
     def receive_from(self, timeout=None, alias=None):
-        connection = self._connections.get(alias)
+        connection = self._get_connection(alias)
         return connection.receive_from(timeout=timeout)
 
+    @unsynchronized
     def accept_connection(self, alias=None, timeout=0):
+        if self._auto_accept:
+            raise AssertionError('Server accepts connections automatically. Use Wait for connections instead.')
         timeout = self._get_timeout(timeout)
         if timeout > 0:
             self._socket.settimeout(timeout)
         connection, client_address = self._socket.accept()
-        self._connections.add(_TCPConnection(self, connection, protocol=self._protocol), alias)
+        self._add_connection(connection, alias)
         return client_address
 
+    def _add_connection(self, sock, alias=None):
+        connection = self._create_connection(sock)
+        with self._lock:
+            self._connections.add(connection, alias)
+            self._connections_changed.notify_all()
+        return connection
+
+    def _create_connection(self, sock):
+        return _TCPConnection(self, sock, protocol=self._protocol)
+
+    def handle_readable(self):
+        """Accepts all pending connections with generated aliases.
+
+        Called by the reactor when connections of an auto accepting server
+        are pending. Returns False if the server has been closed. Connections
+        reset before they are accepted are skipped. Running out of file
+        descriptors is warned about once, and accepting is retried when the
+        reactor finds the connections still pending.
+        """
+        while self._is_connected:
+            try:
+                connection, client_address = self._socket.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.ECONNABORTED, errno.EPROTO, errno.EINTR):
+                    continue
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self._accept_failed(e)
+                break
+            self._accept_failing = False
+            connection = self._add_connection(connection)
+            logger.debug("Accepted connection %s from %s:%s" % ((connection.name,) + client_address[:2]))
+        return self._is_connected
+
+    def _accept_failed(self, error):
+        if not self._is_connected:
+            return
+        if error.args[0] not in (errno.EMFILE, errno.ENFILE):
+            logger.debug("Accepting connection failed: %s" % error)
+        elif not self._accept_failing:
+            self._accept_failing = True
+            logger.warn("Accepting connections failed: %s" % error)
+
+    def wait_for_connections(self, count, timeout=None):
+        count = int(count)
+        timeout = self._get_timeout(timeout)
+        cutoff = time.time() + timeout if timeout is not None else None
+        while len(self._connections) < count:
+            remaining = cutoff - time.time() if cutoff is not None else None
+            if remaining is not None and remaining <= 0:
+                raise AssertionError('Timeout %fs exceeded while waiting for %d connections, got %d.'
+                                     % (timeout, count, len(self._connections)))
+            self._connections_changed.wait(remaining)
+        return len(self._connections)
+
+    @unsynchronized
     def send(self, msg, alias=None):
-        connection = self._connections.get(alias)
+        connection = self._get_connection(alias)
         connection.send(msg)
 
     def send_to(self, *args):
@@ -269,6 +873,8 @@ class StreamServer(_Server):
     def close(self):
         if self._is_connected:
             self._is_connected = False
+            if self._auto_accept:
+                REACTOR.unregister(self)
             for connection in self._connections:
                 connection.close()
             self._socket.close()
@@ -277,28 +883,246 @@ class StreamServer(_Server):
     def close_connection(self, alias=None):
         raise Exception("Not yet implemented")
 
-    def get_message(self, message_template, timeout=None, alias=None, header_filter=None):
-        connection = self._connections.get(alias)
-        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter)
-
+    @unsynchronized
+    def get_message(self, message_template, timeout=None, alias=None, header_filter=None, latest=None, lazy=None,
+                    any_connection=False):
+        if _is_set(any_connection):
+            return self._get_message_from_any_connection(message_template, timeout, header_filter, latest, lazy)
+        connection = self._get_connection(alias)
+        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter, latest=latest, lazy=lazy)
+
+    def _get_message_from_any_connection(self, message_template, timeout, header_filter, latest, lazy):
+        """Returns the first matching message from any connection and makes
+        its connection the current connection.
+
+        Connections are polled starting from a different connection every
+        time, so busy connections do not starve the others. Waiting is done in
+        slices to notice new connections and messages read on background.
+        """
+        timeout = self._get_timeout(timeout)
+        cutoff = time.time() + timeout if timeout is not None else None
+        waiter = self._get_connection_waiter()
+        try:
+            while True:
+                connections = self._get_polling_order()
+                for connection in connections:
+                    msg = connection.get_received_message(message_template, header_filter=header_filter,
+                                                          latest=latest, lazy=lazy)
+                    if msg:
+                        self._set_current_connection(connection)
+                        return msg
+                remaining = cutoff - time.time() if cutoff is not None else ANY_CONNECTION_POLL_INTERVAL
+                if remaining <= 0:
+                    raise AssertionError('Timeout %fs exceeded while receiving from any connection.' % timeout)
+                waiter.wait(connections, min(remaining, ANY_CONNECTION_POLL_INTERVAL))
+        finally:
+            waiter.close()
+
+    def _get_connection_waiter(self):
+        return _ConnectionPoller()
+
+    def _get_polling_order(self):
+        with self._lock:
+            connections = list(self._connections)
+            self._first_polled += 1
+        if not connections:
+            return connections
+        first = self._first_polled % len(connections)
+        return connections[first:] + connections[:first]
+
+    def _set_current_connection(self, connection):
+        with self._lock:
+            try:
+                self._connections.set_current(connection.name)
+            except KeyError:
+                pass
+        logger.info("Received message from connection %s" % connection.name)
+
+    def get_current_connection(self):
+        return self._connections.get_with_name()[1]
+
+    @unsynchronized
     def empty(self):
-        for connection in self._connections:
+        for connection in self._get_connections():
             connection.empty()
 
+    @unsynchronized
+    def get_evicted_messages_counts(self):
+        counts = {}
+        for connection in self._get_connections():
+            for key, count in connection.get_evicted_messages_counts().items():
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    @unsynchronized
     def get_peer_address(self, alias=None):
-        connection = self._connections.get(alias)
+        connection = self._get_connection(alias)
         return connection.get_peer_address()
 
 
+class _ConnectionPoller(object):
+    """Waits until any of the given connections is readable.
+
+    One poller is used for a whole receive. Connections are registered to it
+    when they first appear, and unregistered when they are gone or closed by
+    the peer, whose sockets would stay readable.
+    """
+
+    def __init__(self):
+        self._poller = get_poller()
+        self._fds = {}
+
+    def wait(self, connections, timeout):
+        self._update(connections)
+        try:
+            self._poller.poll(timeout)
+        except (select.error, socket.error, IOError, OSError, ValueError):
+            time.sleep(timeout)
+
+    def _update(self, connections):
+        open_connections = set()
+        for connection in connections:
+            try:
+                if not connection.is_closed_by_peer():
+                    open_connections.add(connection)
+            except socket.error:
+                pass
+        # Removing first lets a new connection reuse the file descriptor of
+        # a closed one.
+        for connection in set(self._fds) - open_connections:
+            self._poller.unregister(self._fds.pop(connection))
+        for connection in open_connections - set(self._fds):
+            try:
+                fd = connection.fileno()
+                self._poller.register(fd)
+            except (socket.error, IOError, OSError, ValueError):
+                continue
+            self._fds[connection] = fd
+
+    def close(self):
+        for fd in self._fds.values():
+            self._poller.unregister(fd)
+        self._fds.clear()
+        self._poller.close()
+
+
 class _TCPConnection(_NetworkNode, _TCPNode):
 
     def __init__(self, parent, socket, protocol=None):
+        _NetworkNode.__init__(self)
         self.parent = parent
         self._socket = socket
         self._protocol = protocol
+        self._set_cache(parent._cache_size, parent._cache_policy)
         self._message_stream = self._get_message_stream()
         self._is_connected = True
+
+
+class _UDPSession(_NetworkNode, _UDPNode):
+    """Datagrams of one peer of a `UDPSessionServer`, which reads them from
+    the shared socket."""
+
+    def __init__(self, parent, address, protocol=None, handlers=()):
         _NetworkNode.__init__(self)
+        self.parent = parent
+        self.name = '%s:%d' % address
+        self.last_active = time.time()
+        self._peer = address
+        self._socket = parent._socket
+        self._protocol = protocol
+        self._datagrams = deque()
+        self._evicted_datagrams = 0
+        self._overflow = None
+        self._waiters = 0
+        self._default_timeout = parent._default_timeout
+        self._set_cache(parent._cache_size, parent._cache_policy)
+        self._message_stream = self._get_message_stream()
+        for msg_template, handler_func, header_filter in handlers:
+            self._message_stream.set_handler(msg_template, handler_func, header_filter)
+        self._is_connected = True
+
+    def _get_buffered_stream(self):
+        return _QueuedStream(self, self._default_timeout, size=QUEUED_STREAM_BUFFER_SIZE)
+
+    def _queue_datagram(self, datagram):
+        """Queues a datagram read by the server. A full queue is handled
+        according to the cache size and policy, like a full message cache."""
+        if self._cache_size and len(self._datagrams) >= self._cache_size:
+            if self._cache_policy == 'fail':
+                self._overflow = AssertionError('Datagram queue of session %s is full with %d unread datagrams.'
+                                                % (self.name, self._cache_size))
+                return
+            self._evicted_datagrams += 1
+            if self._evicted_datagrams == 1:
+                logger.warn('Datagram queue of session %s is full with %d unread datagrams. Policy is %s.'
+                            % (self.name, self._cache_size, self._cache_policy))
+            if self._cache_policy == 'drop-newest':
+                return
+            self._datagrams.popleft()
+        self._datagrams.append(datagram)
+
+    def _has_received(self):
+        stream = self._message_stream
+        return bool(self._datagrams) or bool(stream and stream.has_received())
+
+    def _has_queued(self):
+        return bool(self._datagrams)
+
+    def _wait_for_queued(self, timeout):
+        self.parent._wait_for_datagram(self, timeout)
+
+    def _is_queue_closed(self):
+        return False
+
+    def _next_queued_size(self):
+        datagrams = self._datagrams
+        return len(datagrams[0]) if datagrams else 0
+
+    def get_peer_address(self, alias=None):
+        self._raise_error_if_alias_given(alias)
+        return self._peer
+
+    def empty(self):
+        with self.parent._sessions_changed:
+            self._datagrams.clear()
+            self._overflow = None
+        if self._message_stream:
+            self._message_stream.empty()
+
+    def get_evicted_messages_counts(self):
+        counts = _NetworkNode.get_evicted_messages_counts(self)
+        if self._evicted_datagrams:
+            counts['*'] = counts.get('*', 0) + self._evicted_datagrams
+        return counts
+
+    def close(self):
+        if self._is_connected:
+            self._is_connected = False
+            if self._message_stream:
+                self._message_stream.close()
+            self._message_stream = None
+            self._datagrams.clear()
+
+    def receive_from(self, timeout=None, alias=None):
+        self._raise_error_if_alias_given(alias)
+        msg = self._next_datagram(timeout)
+        ip, port = self._peer
+        self.log_receive(msg, ip, port)
+        return msg, ip, port
+
+    def receive_into(self, buffer, timeout=None):
+        msg = self._next_datagram(timeout)
+        buffer[:len(msg)] = msg
+        self.log_receive(msg, *self._peer)
+        return len(msg)
+
+    def _next_datagram(self, timeout):
+        self._wait_for_queued(self._get_timeout(timeout))
+        return self._datagrams.popleft()
+
+    def _sendall(self, msg):
+        self._socket.sendto(msg, self._peer)
+        self.last_active = time.time()
 
 
 class SCTPServer(StreamServer, _SCTPNode):
@@ -311,10 +1135,11 @@ class TCPServer(StreamServer, _TCPNode):
 
 class _Client(_NetworkNode):
 
-    def __init__(self, timeout=None, protocol=None, family=None):
+    def __init__(self, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None):
         self._is_connected = False
         self._init_socket(family)
         self._set_default_timeout(timeout)
+        self._set_cache(cache_size, cache_policy)
         self._protocol = protocol
         self._message_stream = None
         _NetworkNode.__init__(self)
@@ -351,6 +1176,98 @@ class SCTPClient(_Client, _SCTPNode):
     pass
 
 
+class AsyncUDPServer(_AsyncNode, UDPServer):
+    """UDP server whose datagrams are read on background by the reactor."""
+
+    def __init__(self, ip, port, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None):
+        self._init_async()
+        UDPServer.__init__(self, ip, port, timeout, protocol, family, cache_size, cache_policy)
+        self._start_async()
+
+    def _received_from(self, ip, port):
+        self._last_client = (ip, int(port))
+
+    def _send_available(self, data):
+        return self._socket.sendto(data, self.get_peer_address())
+
+
+class AsyncTCPServer(TCPServer):
+    """TCP server whose connections are read on background by the reactor.
+
+    Receiving from any connection waits until data arrives to any of them,
+    instead of polling the sockets of the connections.
+    """
+
+    def __init__(self, ip, port, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None,
+                 backlog=None, auto_accept=False):
+        self._arrived = threading.Condition(threading.Lock())
+        self._arrivals = 0
+        TCPServer.__init__(self, ip, port, timeout, protocol, family, cache_size, cache_policy, backlog,
+                           auto_accept)
+
+    def _create_connection(self, sock):
+        return _AsyncTCPConnection(self, sock, protocol=self._protocol)
+
+    def _data_arrived(self):
+        with self._arrived:
+            self._arrivals += 1
+            self._arrived.notify_all()
+
+    def _get_connection_waiter(self):
+        return _ArrivalWaiter(self)
+
+
+class _ArrivalWaiter(object):
+    """Waits until data arrives to any connection of an asynchronous server
+    after the previous wait, or after creating the waiter."""
+
+    def __init__(self, server):
+        self._server = server
+        with server._arrived:
+            self._seen = server._arrivals
+
+    def wait(self, connections, timeout):
+        with self._server._arrived:
+            if self._server._arrivals == self._seen:
+                self._server._arrived.wait(timeout)
+            self._seen = self._server._arrivals
+
+    def close(self):
+        pass
+
+
+class _AsyncTCPConnection(_AsyncNode, _TCPConnection):
+
+    def __init__(self, parent, socket, protocol=None):
+        self._init_async()
+        _TCPConnection.__init__(self, parent, socket, protocol)
+        self._start_async()
+
+
+class _AsyncClient(_AsyncNode):
+
+    def connect_to(self, server_ip, server_port):
+        _Client.connect_to(self, server_ip, server_port)
+        self._start_async()
+        return self
+
+
+class AsyncUDPClient(_AsyncClient, UDPClient):
+    """UDP client whose datagrams are read on background by the reactor."""
+
+    def __init__(self, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None):
+        self._init_async()
+        UDPClient.__init__(self, timeout, protocol, family, cache_size, cache_policy)
+
+
+class AsyncTCPClient(_AsyncClient, TCPClient):
+    """TCP client whose connection is read on background by the reactor."""
+
+    def __init__(self, timeout=None, protocol=None, family=None, cache_size=None, cache_policy=None):
+        self._init_async()
+        TCPClient.__init__(self, timeout, protocol, family, cache_size, cache_policy)
+
+
 class _NamedCache(object):
 
     def __init__(self, basename, miss_error):
@@ -381,6 +1298,9 @@ class _NamedCache(object):
     def get(self, name=None):
         return self.get_with_name(name)[0]
 
+    def __len__(self):
+        return len(self._cache)
+
     def __iter__(self):
         return self._cache.itervalues()
 
@@ -392,41 +1312,142 @@ class _NamedCache(object):
 
 
 class BufferedStream(_WithTimeouts):
+    """Receive buffer of a message stream.
 
-    def __init__(self, connection, default_timeout):
+    Data is received with `recv_into` straight into a preallocated bytearray.
+    Reading moves the start offset of unread data instead of slicing the
+    buffer. Unread data is moved to the front only when there is not enough
+    room left at the end, and the buffer grows when the unread data itself
+    does not fit.
+    """
+
+    def __init__(self, connection, default_timeout, size=STREAM_BUFFER_SIZE):
         self._connection = connection
-        self._buffer = ''
+        self._data = bytearray(size)
+        self._start = self._end = 0
         self._default_timeout = default_timeout
 
+    @property
+    def _unread(self):
+        return self._end - self._start
+
     def read(self, size, timeout=None):
-        result = ''
         timeout = float(timeout if timeout else self._default_timeout)
         cutoff = time.time() + timeout
-        while time.time() < cutoff:
-            result += self._get(size - len(result))
-            if self._size_full(result, size):
-                return result
+        while not self._size_full(size):
+            if time.time() >= cutoff:
+                raise AssertionError('Timeout %fs exceeded.' % timeout)
+            self._fill_buffer(timeout)
+        return self._get(size)
+
+    def read_frame(self, extract, timeout=None):
+        """Reads one frame found by `extract` from the unread data.
+
+        `extract` returns the frame and its length in bytes, or None when the
+        unread data does not yet contain a complete frame. It gets a view to
+        the receive buffer, so the frame must not keep references to it.
+        """
+        timeout = float(timeout if timeout else self._default_timeout)
+        cutoff = time.time() + timeout
+        while True:
+            result = extract(buffer(self._data, self._start, self._unread)) if self._unread else None
+            if result:
+                frame, length = result
+                self._consume(length)
+                return frame
+            if time.time() >= cutoff:
+                raise AssertionError('Timeout %fs exceeded.' % timeout)
             self._fill_buffer(timeout)
-        raise AssertionError('Timeout %fs exceeded.' % timeout)
 
-    def _size_full(self, result, size):
-        return len(result) == size or (size == -1 and len(result))
+    def _size_full(self, size):
+        return self._unread >= size if size != -1 else self._unread > 0
 
     def return_data(self, data):
-        if data:
-            self._buffer = data + self._buffer
+        if not data:
+            return
+        length = len(data)
+        if length <= self._start and self._data[self._start - length:self._start] == data:
+            self._start -= length
+        else:
+            self._data = bytearray(data) + self._data[self._start:self._end]
+            self._start, self._end = 0, len(self._data)
 
     def _get(self, size):
         if size == -1:
-            size = len(self._buffer)
-        if not self._buffer:
-            return ''
-        result = self._buffer[:size]
-        self._buffer = self._buffer[size:]
+            size = self._unread
+        result = str(buffer(self._data, self._start, size))
+        self._consume(size)
         return result
 
+    def _consume(self, size):
+        self._start += size
+        if self._start == self._end:
+            self._start = self._end = 0
+
     def _fill_buffer(self, timeout):
-        self._buffer += self._connection.receive(timeout=timeout)
+        self._reserve(self._connection._receive_size)
+        self._end += self._connection.receive_into(memoryview(self._data)[self._end:], timeout=timeout)
+
+    def _reserve(self, size):
+        if len(self._data) - self._end >= size:
+            return
+        unread = self._unread
+        if len(self._data) - unread >= size:
+            # Same size slice assignment does not resize the bytearray,
+            # which may still be referenced by a memoryview.
+            self._data[:unread] = self._data[self._start:self._end]
+        else:
+            data = bytearray(max(2 * len(self._data), unread + size))
+            data[:unread] = self._data[self._start:self._end]
+            self._data = data
+        self._start, self._end = 0, unread
+
+    def fileno(self):
+        return self._connection._socket.fileno()
+
+    def has_data(self):
+        return bool(self._unread) or self._is_readable()
+
+    def wait_for_data(self, timeout=None):
+        if not _wait_for_socket(self._connection._socket, self._get_timeout(timeout)):
+            raise socket.timeout('timed out')
+
+    def is_closed_by_peer(self):
+        sock = self._connection._socket
+        if self._unread or getattr(sock, 'type', None) != socket.SOCK_STREAM or not self._is_readable():
+            return False
+        try:
+            return not sock.recv(1, socket.MSG_PEEK)
+        except socket.error:
+            return False
+
+    def _is_readable(self):
+        return _wait_for_socket(self._connection._socket, 0)
 
     def empty(self):
-        self._buffer = ''
+        self._start = self._end = 0
+
+
+class _QueuedStream(BufferedStream):
+    """Receive buffer of a UDP session or an asynchronous node. The reactor
+    reads their data from the socket to a queue, so the stream has no socket
+    to wait for."""
+
+    def fileno(self):
+        return None
+
+    def wait_for_data(self, timeout=None):
+        self._connection._wait_for_queued(self._get_timeout(timeout))
+
+    def is_closed_by_peer(self):
+        return not self._unread and self._connection._is_queue_closed()
+
+    def _fill_buffer(self, timeout):
+        # Room is reserved only for the next queued data, so the buffers of
+        # thousands of sessions stay small.
+        self.wait_for_data(timeout)
+        self._reserve(max(self._connection._next_queued_size(), 1))
+        self._end += self._connection.receive_into(memoryview(self._data)[self._end:], timeout=timeout)
+
+    def _is_readable(self):
+        return self._connection._has_queued()
@@ -0,0 +1,234 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import errno
+import os
+import select
+import socket
+import threading
+import traceback
+
+from .logger import logger
+
+
+class _SelectPoller(object):
+    """Waits with `select`, which is available everywhere but only accepts
+    file descriptors smaller than `FD_SETSIZE`, usually 1024."""
+
+    def __init__(self):
+        self._fds = set()
+
+    def register(self, fd):
+        self._fds.add(fd)
+
+    def unregister(self, fd):
+        self._fds.discard(fd)
+
+    def poll(self, timeout):
+        return select.select(list(self._fds), [], [], timeout)[0]
+
+    def close(self):
+        self._fds.clear()
+
+
+class _PollPoller(object):
+    """Waits with `poll`, which has no limit for file descriptors."""
+
+    def __init__(self):
+        self._poll = select.poll()
+
+    def register(self, fd):
+        self._poll.register(fd, select.POLLIN)
+
+    def unregister(self, fd):
+        try:
+            self._poll.unregister(fd)
+        except KeyError:
+            pass
+
+    def poll(self, timeout):
+        events = self._poll.poll(None if timeout is None else timeout * 1000)
+        if any(event & select.POLLNVAL for _, event in events):
+            raise select.error(errno.EBADF, 'Bad file descriptor')
+        return [fd for fd, _ in events]
+
+    def close(self):
+        pass
+
+
+class _EpollPoller(object):
+    """Waits with `epoll`, which does not go through all the registered file
+    descriptors on every wait."""
+
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def register(self, fd):
+        self._epoll.register(fd, select.EPOLLIN)
+
+    def unregister(self, fd):
+        # Closed file descriptors are removed from epoll automatically.
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, OSError):
+            pass
+
+    def poll(self, timeout):
+        return [fd for fd, _ in self._epoll.poll(-1 if timeout is None else timeout)]
+
+    def close(self):
+        self._epoll.close()
+
+
+def get_poller():
+    if hasattr(select, 'epoll'):
+        return _EpollPoller()
+    if hasattr(select, 'poll'):
+        return _PollPoller()
+    return _SelectPoller()
+
+
+class Reactor(object):
+    """Runs background handlers of message streams when data arrives.
+
+    One thread waits until the socket of any registered message stream is
+    readable and lets the stream match the received messages to its handlers.
+    Streams are also scheduled explicitly when they may have complete messages
+    in their buffer, as the socket does not become readable for those.
+
+    Registered objects have `fileno()` and `handle_readable()`, which returns
+    False when the object should be unregistered. Besides message streams,
+    servers accepting connections automatically, UDP servers with peer
+    sessions and nodes with asynchronous transport are registered. Objects
+    whose `fileno()` is None are not waited for, but only handled when
+    scheduled.
+
+    Sockets are registered to the poller of the thread only when streams are
+    registered or unregistered, so waiting does not depend on the number of
+    streams and thousands of connections can be served by the one thread.
+    """
+
+    def __init__(self):
+        self._streams = set()
+        self._scheduled = set()
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = None
+        self._poller = None
+        self._fds = {}
+        self._streams_by_fd = {}
+
+    def register(self, stream):
+        with self._lock:
+            self._streams.add(stream)
+            self._scheduled.add(stream)
+            self._changed.add(stream)
+            self._start()
+        self._wake_up()
+
+    def unregister(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+            self._scheduled.discard(stream)
+            self._changed.add(stream)
+        self._wake_up()
+
+    def schedule(self, stream):
+        with self._lock:
+            if stream not in self._streams:
+                return
+            self._scheduled.add(stream)
+        self._wake_up()
+
+    def _start(self):
+        if self._thread:
+            return
+        self._wakeup = os.pipe()
+        self._poller = get_poller()
+        self._poller.register(self._wakeup[0])
+        self._thread = threading.Thread(target=self._run, name="Background handler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _wake_up(self):
+        if self._wakeup:
+            os.write(self._wakeup[1], 'x')
+
+    def _run(self):
+        while True:
+            with self._lock:
+                changed, self._changed = self._changed, set()
+                registered = set(stream for stream in changed if stream in self._streams)
+                scheduled, self._scheduled = self._scheduled, set()
+            self._update_poller(changed - registered, registered)
+            for stream in self._wait(0 if scheduled else None) | scheduled:
+                self._handle(stream)
+
+    def _update_poller(self, unregistered, registered):
+        # Removing first lets a new socket reuse the file descriptor of a
+        # socket closed meanwhile.
+        for stream in unregistered:
+            fd = self._fds.pop(stream, None)
+            if fd is not None and self._streams_by_fd.get(fd) is stream:
+                del self._streams_by_fd[fd]
+                self._poller.unregister(fd)
+        for stream in registered:
+            if stream in self._fds:
+                continue
+            try:
+                fd = stream.fileno()
+            except socket.error:
+                self.unregister(stream)
+                continue
+            if fd is None:
+                continue
+            self._fds[stream] = fd
+            self._streams_by_fd[fd] = stream
+            self._poller.register(fd)
+
+    def _wait(self, timeout):
+        try:
+            fds = self._poller.poll(timeout)
+        except (select.error, socket.error, IOError, OSError, ValueError):
+            self._drop_closed()
+            return set()
+        readable = set()
+        for fd in fds:
+            if fd == self._wakeup[0]:
+                os.read(fd, 4096)
+            elif fd in self._streams_by_fd:
+                readable.add(self._streams_by_fd[fd])
+        return readable
+
+    def _drop_closed(self):
+        for stream, fd in self._fds.items():
+            try:
+                os.fstat(fd)
+            except OSError:
+                self.unregister(stream)
+
+    def _handle(self, stream):
+        with self._lock:
+            if stream not in self._streams:
+                return
+        try:
+            if not stream.handle_readable():
+                logger.debug("Connection closed by peer. Stopping background handlers.")
+                self.unregister(stream)
+        except Exception:
+            logger.debug("failure in background handler %s" % traceback.format_exc())
+
+
+REACTOR = Reactor()
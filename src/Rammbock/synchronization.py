@@ -1,4 +1,27 @@
+"""Locks of the library.
+
+Threads take the locks in the order below, so they never wait for each
+other in a cycle:
+
+1. `LOCK`, the library lock, is held by keywords of the library and by
+   handlers run without workers. It guards the state of the library, for
+   example templates under construction and the named servers and clients.
+   Keywords release it while they wait for the network.
+2. The lock of a stream server guards its listening socket and the cache of
+   accepted connections. It is not held while using the connections, which
+   have their own locks.
+3. The lock of a network node guards its socket and the message stream of the
+   node, which shares the lock of its node. It is released while waiting for
+   data and while running handlers.
+4. The locks of the reactor and of the handler executor are only held for
+   short moments, never while taking other locks. The lock of the sessions of
+   a UDP server with peer sessions is taken by the sessions while holding
+   their own lock, and only the reactor lock is taken while holding it. The
+   lock of the receive queue of an asynchronous node is held only while
+   moving data to and from the queue.
+"""
 import threading
+from contextlib import contextmanager
 
 from .decorator import decorator
 
@@ -7,16 +30,44 @@ LOCK = threading.RLock()
 
 
 @decorator
-def synchronized(f, *args, **kw):
-    """ Synchronization decorator """
-    with LOCK:
-        return f(*args, **kw)
+def synchronized(f, self, *args, **kw):
+    """ Synchronization decorator, holds the lock of the instance """
+    with self._lock:
+        return f(self, *args, **kw)
+
+
+def unsynchronized(f):
+    """Marks a method that takes the locks it needs itself."""
+    f.unsynchronized = True
+    return f
+
+
+@contextmanager
+def released(lock):
+    """Releases `lock` for the block, also when it is held recursively.
+
+    `lock` is released until the current thread no longer owns it, and
+    acquired back the same number of times after the block. A lock that is not
+    held by the current thread is left as is.
+    """
+    depth = 0
+    while True:
+        try:
+            lock.release()
+        except RuntimeError:
+            break
+        depth += 1
+    try:
+        yield
+    finally:
+        for _ in range(depth):
+            lock.acquire()
 
 
 class SynchronizedType(type):
 
     def __new__(cls, clsname, bases, local):
         for name, item in local.items():
-            if callable(item) and not name.startswith("_"):
+            if callable(item) and not name.startswith("_") and not getattr(item, 'unsynchronized', False):
                 local[name] = synchronized(item)
         return type.__new__(cls, clsname, bases, local)
@@ -15,3 +15,4 @@
 from containers import Protocol, MessageTemplate, StructTemplate, ListTemplate, \
     UnionTemplate, BinaryContainerTemplate, ConditionalTemplate, TBCDContainerTemplate
 from primitives import UInt, Int, Char, PDU, Binary, Length, TBCD
+from message_image import MessageImage
@@ -19,21 +19,24 @@ from Rammbock.message import (Field, Union, Message, Header, List, Struct,
                               BinaryContainer, BinaryField, TBCDContainer,
                               Conditional, Bag)
 from message_stream import MessageStream
-from primitives import Length, Binary, TBCD, BagSize
+from primitives import Length, Binary, TBCD, BagSize, UInt, Char
 from Rammbock.ordered_dict import OrderedDict
-from Rammbock.binary_tools import (to_binary_string_of_length, to_bin,
-                                   to_tbcd_value, to_tbcd_binary)
+from Rammbock.binary_tools import (bin_to_int, int_to_bin, tbcd_length,
+                                   slice_tbcd, shared_struct)
 from Rammbock.condition_parser import ConditionParser
 from Rammbock.logger import logger
 
 
 class _Template(object):
 
+    decodes_lazily = True
+
     def __init__(self, name, parent):
         self.parent = parent
         self._fields = OrderedDict()
         self.name = name
         self._saved = False
+        self._static_layout = None
 
     def _pretty_print_fields(self, fields):
         return ', '.join('%s:%s' % (key, value) for key, value in fields.items())
@@ -52,6 +55,7 @@ class _Template(object):
         if field.has_length and field.length.has_references:
             self._mark_referenced_field(field)
         self._fields[field.name] = field
+        self._static_layout = None
 
     def _handle_pdu_field(self, field):
         raise AssertionError('PDU field not allowed')
@@ -86,7 +90,16 @@ class _Template(object):
     def _get_recursive_name(self):
         return (self.parent._get_recursive_name() + "." if self.parent else '') + self.name
 
+    def _get_static_layout(self):
+        if self._static_layout is None:
+            self._static_layout = _StaticLayout.compile(self) or False
+        return self._static_layout
+
     def _encode_fields(self, struct, params, little_endian=False):
+        layout = self._get_static_layout()
+        if layout and layout.encode(struct, params, little_endian):
+            self._check_params_empty(params, self.name)
+            return
         for field in self._fields.values():
             encoded = field.encode(params, struct, little_endian=little_endian)
             # TODO: clean away this ugly hack that makes it possible to skip PDU
@@ -95,14 +108,36 @@ class _Template(object):
                 struct[field.name] = encoded
         self._check_params_empty(params, self.name)
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, lazy=False):
         message = self._get_struct(name, parent)
+        layout = self._get_static_layout()
+        if layout and len(data) >= layout.size and (layout.flat or not lazy):
+            layout.decode(data, message, little_endian)
+            return message
         data_index = 0
         for field in self._fields.values():
-            message[field.name] = field.decode(data[data_index:], message, little_endian=little_endian)
+            message[field.name] = self._decode_field(field, buffer(data, data_index), message, little_endian=little_endian, lazy=lazy)
             data_index += len(message[field.name])
         return message
 
+    def _decode_field(self, field, data, parent, name=None, little_endian=False, lazy=False):
+        if lazy and isinstance(field, _Template) and field.decodes_lazily:
+            return field._decode_lazily(data, parent, name, little_endian)
+        return field.decode(data, parent, name=name, little_endian=little_endian)
+
+    def _decode_lazily(self, data, parent, name=None, little_endian=False):
+        length = self._get_decoded_length()
+        if length is None or len(data) < length:
+            return self.decode(data, parent, name=name, little_endian=little_endian, lazy=True)
+        element = self._get_struct(name, parent)
+        element._set_pending_decode(length, lambda: self.decode(data, parent, name=name, little_endian=little_endian, lazy=True))
+        return element
+
+    def _get_decoded_length(self):
+        """Returns the length of the decoded element if it is known without
+        decoding the data, otherwise None."""
+        return None
+
     def validate(self, message, message_fields):
         errors = []
         for field in self._fields.values():
@@ -137,6 +172,7 @@ class Protocol(_Template):
         self.pdu = None
         self.little_endian = little_endian
         self.library = library
+        self._framer = None
 
     def header_length(self):
         try:
@@ -144,12 +180,14 @@ class Protocol(_Template):
         except IndexError:
             return -1
 
-    def encode(self, message, header_params):
+    def encode(self, message, header_params, pdu_length=None):
         header_params = header_params.copy()
         header = Header(self.name)
         self._encode_fields(header, header_params, little_endian=self.little_endian)
         if self.pdu_length:
-            self.pdu_length.find_length_and_set_if_necessary(header, len(message._get_raw_bytes()), little_endian=self.little_endian)
+            if pdu_length is None:
+                pdu_length = len(message._get_raw_bytes())
+            self.pdu_length.find_length_and_set_if_necessary(header, pdu_length, little_endian=self.little_endian)
         return header
 
     def _handle_pdu_field(self, field):
@@ -165,35 +203,30 @@ class Protocol(_Template):
         if self.pdu:
             raise AssertionError('Fields after PDU not supported.')
         _Template.add(self, field)
+        self._framer = None
 
     # TODO: fields after the pdu
-    def _extract_values_from_data(self, data, header, values):
+    def _decode_header(self, data, header):
+        """Decodes the header fields from the start of `data` and returns the
+        length of the decoded header."""
+        layout = self._get_static_layout()
+        if layout and len(data) >= layout.size:
+            layout.decode(data, header, self.little_endian)
+            return layout.size
         data_index = 0
-        for field in values:
+        for field in self._fields.values():
             if field is not self.pdu:
-                header[field.name] = field.decode(data[data_index:], header, little_endian=self.little_endian)
+                header[field.name] = field.decode(buffer(data, data_index), header, little_endian=self.little_endian)
                 data_index += len(header[field.name])
-        return data[data_index:]
+        return data_index
 
     def read(self, stream, timeout=None):
-        # TODO: use all data if length cannot be obtained. Return amount of data
-        # used to stream
-        data = stream.read(self.header_length(), timeout=timeout)
-        header = Header(self.name)
-        unused_data = self._extract_values_from_data(data, header, self._fields.values())
-        stream.return_data(unused_data)
-        pdu_bytes = None
-        if self.pdu:
-            if self.pdu_length.static:
-                length = self.pdu_length.value
-            else:
-                length = self.pdu_length.calc_value(header[self.pdu_length.field].int)
-            # TODO: we need a timeout?
-            pdu_bytes = stream.read(length)
-        return header, pdu_bytes
+        if self._framer is None:
+            self._framer = _Framer(self)
+        return stream.read_frame(self._framer, timeout=timeout)
 
-    def get_message_stream(self, buffered_stream):
-        return MessageStream(buffered_stream, self)
+    def get_message_stream(self, buffered_stream, cache_size=None, cache_policy=None, lock=None):
+        return MessageStream(buffered_stream, self, cache_size, cache_policy, lock)
 
 
 class MessageTemplate(_Template):
@@ -205,8 +238,8 @@ class MessageTemplate(_Template):
         self._protocol = protocol
         self.header_parameters = header_params
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
-        msg = _Template.decode(self, data, parent, name, little_endian)
+    def decode(self, data, parent=None, name=None, little_endian=False, lazy=False):
+        msg = _Template.decode(self, data, parent, name, little_endian, lazy)
         self.check_message_lengths(msg, data)
         return msg
 
@@ -222,10 +255,21 @@ class MessageTemplate(_Template):
         msg = Message(self.name)
         self._encode_fields(msg, message_params, little_endian=little_endian)
         if self._protocol:
-            header = self._protocol.encode(msg, self._headers(header_params))
-            msg._add_header(header)
+            self._encode_header(msg, header_params)
         return msg
 
+    def _encode_header(self, msg, header_params):
+        # Bytes of a static length header are reserved in front of the PDU
+        # and patched in place once the PDU length is known.
+        header_length = max(self._protocol.header_length(), 0)
+        raw = bytearray(header_length)
+        msg._write_raw(raw)
+        header = self._protocol.encode(msg, self._headers(header_params),
+                                       pdu_length=len(raw) - header_length)
+        raw[:header_length] = header._get_raw_bytes()
+        msg._add_header(header)
+        msg._set_raw_bytes(raw)
+
     def _headers(self, header_params):
         result = {}
         result.update(self.header_parameters)
@@ -276,11 +320,17 @@ class StructTemplate(_Template):
     def get_static_length(self):
         return sum(field.get_static_length() for field in self._fields.values())
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, lazy=False):
         if self.has_length:
             length = self.length.decode(parent)
-            data = data[:length]
-        return _Template.decode(self, data, parent, name, little_endian)
+            data = buffer(data, 0, length)
+        return _Template.decode(self, data, parent, name, little_endian, lazy)
+
+    def _get_decoded_length(self):
+        layout = not self.has_length and self._get_static_layout()
+        if not layout:
+            return None
+        return layout.size + (self._align - layout.size % self._align) % self._align
 
     def encode(self, message_params, parent=None, name=None, little_endian=False):
         struct = self._get_struct(name, parent)
@@ -331,12 +381,15 @@ class UnionTemplate(_Template):
     def get_static_length(self):
         return max(field.get_static_length() for field in self._fields.values())
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, lazy=False):
         union = self._get_struct(name, parent)
         for field in self._fields.values():
-            union[field.name] = field.decode(data, union, little_endian=little_endian)
+            union[field.name] = self._decode_field(field, data, union, little_endian=little_endian, lazy=lazy)
         return union
 
+    def _get_decoded_length(self):
+        return self.get_static_length()
+
     def encode(self, union_params, parent=None, name=None, little_endian=False):
         name = name or self.name
         if name not in union_params:
@@ -366,6 +419,7 @@ class BagTemplate(_Template):
 
     has_length = False
     type = 'Bag'
+    decodes_lazily = False
 
     def __init__(self, name, parent):
         _Template.__init__(self, name, parent)
@@ -382,7 +436,7 @@ class BagTemplate(_Template):
         bag = self._get_struct(name, parent)
         while data:
             match = self._decode_one(data, bag, little_endian=little_endian)
-            data = data[len(match['0']):]
+            data = buffer(data, len(match['0']))
         return bag
 
     def _decode_one(self, data, bag, little_endian=False):
@@ -495,18 +549,24 @@ class ListTemplate(_Template):
         ls._parent = parent
         return ls
 
-    def decode(self, data, parent, name=None, little_endian=False):
+    def decode(self, data, parent, name=None, little_endian=False, lazy=False):
         name = name or self.name
         message = self._get_struct(name, parent)
         data_index = 0
         # maximum_length is given for free length (*) to limit the absolute maximum number of entries
         for index in range(0, self.length.decode(parent, maximum_length=len(data))):
-            message[str(index)] = self.field.decode(data[data_index:], message, name=str(index), little_endian=little_endian)
+            message[str(index)] = self._decode_field(self.field, buffer(data, data_index), message, name=str(index), little_endian=little_endian, lazy=lazy)
             data_index += len(message[index])
             if self.length.free and data_index == len(data):
                 break
         return message
 
+    def _get_decoded_length(self):
+        item_length = _get_decoded_length(self.field)
+        if not self.length.static or item_length is None:
+            return None
+        return self.length.value * item_length
+
     def validate(self, parent, message_fields, name=None):
         name = name or self.name
         params_subtree = self._get_params_sub_tree(message_fields, name)
@@ -546,6 +606,11 @@ class BinaryContainerTemplate(_Template):
 
     has_length = False
     type = 'BinaryContainer'
+    decodes_lazily = False
+
+    def __init__(self, name, parent):
+        _Template.__init__(self, name, parent)
+        self._layout = None
 
     def get_static_length(self):
         return self.binlength / 8
@@ -554,6 +619,7 @@ class BinaryContainerTemplate(_Template):
         if not isinstance(field, Binary):
             raise AssertionError('Binary container can only have binary fields.')
         _Template.add(self, field)
+        self._layout = None
 
     @property
     def binlength(self):
@@ -570,23 +636,23 @@ class BinaryContainerTemplate(_Template):
 
     def decode(self, data, parent=None, name=None, little_endian=False):
         container = self._get_struct(name, parent, little_endian=little_endian)
+        data = data[:self.binlength / 8]
         if little_endian:
             data = data[::-1]
-        bin_str = to_binary_string_of_length(self.binlength, data[:self.binlength / 8])
-        data_index = 2
-        for field in self._fields.values():
-            container[field.name] = self._create_field(bin_str, data_index,
-                                                       field)
-            data_index += field.length.value
+        value = bin_to_int(data)
+        for field, shift, mask in self._get_layout():
+            container[field.name] = BinaryField(field.length.value, field.name,
+                                                int_to_bin(value >> shift & mask))
         return container
 
-    def _create_field(self, bin_str, data_index, field):
-        return BinaryField(field.length.value, field.name,
-                           self._binary_substring(bin_str, data_index, field))
-
-    def _binary_substring(self, bin_str, data_index, field):
-        return to_bin(
-            "0b" + bin_str[data_index:data_index + field.length.value])
+    def _get_layout(self):
+        if self._layout is None:
+            self._layout = []
+            shift = self.binlength
+            for field in self._fields.values():
+                shift -= field.length.value
+                self._layout.append((field, shift, (1 << field.length.value) - 1))
+        return self._layout
 
     def validate(self, parent, message_fields, name=None):
         name = name or self.name
@@ -604,6 +670,7 @@ class TBCDContainerTemplate(_Template):
 
     has_length = False
     type = 'TBCDContainer'
+    decodes_lazily = False
 
     def get_static_length(self):
         return self.binlength / 8
@@ -626,11 +693,12 @@ class TBCDContainerTemplate(_Template):
     def decode(self, data, parent=None, name=None, little_endian=False):
         self._verify_not_little_endian(little_endian)
         container = self._get_struct(name, parent)
-        a = to_tbcd_value(data)
+        digits = tbcd_length(data)
         index = 0
         for field in self._fields.values():
             field_length = field.length.decode(container, len(data) * 2 - index)
-            container[field.name] = Field(field.type, field.name, to_tbcd_binary(a[index:index + field_length]))
+            value = slice_tbcd(data, index, min(field_length, digits - index))
+            container[field.name] = Field(field.type, field.name, value)
             index += field_length
         return container
 
@@ -667,9 +735,9 @@ class ConditionalTemplate(_Template):
                                 little_endian=little_endian)
         return conditional
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, lazy=False):
         if self.condition.evaluate(parent):
-            return _Template.decode(self, data, parent, name, little_endian)
+            return _Template.decode(self, data, parent, name, little_endian, lazy)
         else:
             return self._get_struct(name, parent)
 
@@ -685,3 +753,177 @@ class ConditionalTemplate(_Template):
         conditional._parent = parent
         conditional.exists = self.condition.evaluate(parent)
         return conditional
+
+
+def _get_decoded_length(field):
+    if isinstance(field, _Template):
+        return field._get_decoded_length()
+    if isinstance(field, (UInt, Char)) and field.length.static and \
+            not getattr(field, '_terminator', None):
+        return field.length.decode_lengths(None)[1]
+    return None
+
+
+class _NotStatic(Exception):
+    pass
+
+
+class _Framer(object):
+    """Finds the first complete frame of a protocol from received bytes.
+
+    The header is decoded straight from the bytes in the receive buffer and
+    the PDU length is taken from the decoded header, so a frame is read from
+    the stream at once. Headers with dynamic length are decoded from all the
+    received bytes and need more data while decoding fails.
+    """
+
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self._header_length = protocol.header_length()
+        self._pdu_length = protocol.pdu_length
+
+    def __call__(self, data):
+        """Returns `(header, pdu_bytes)` and the length of the frame, or None
+        if `data` does not contain a complete frame."""
+        if len(data) < self._header_length:
+            return None
+        header = Header(self._protocol.name)
+        try:
+            header_length = self._protocol._decode_header(data, header)
+        except Exception:
+            if self._header_length != -1:
+                raise
+            return None
+        if not self._pdu_length:
+            return (header, None), header_length
+        end = header_length + self._get_pdu_length(header)
+        if len(data) < end:
+            return None
+        return (header, data[header_length:end]), end
+
+    def _get_pdu_length(self, header):
+        if self._pdu_length.static:
+            return self._pdu_length.value
+        return self._pdu_length.calc_value(header[self._pdu_length.field].int)
+
+
+class _StaticLayout(object):
+    """Combined struct codec for a template whose fields all have static
+    lengths.
+
+    Decoding unpacks the bytes of every leaf field, also inside nested
+    structs, with a single `unpack_from`. Templates containing only
+    primitive fields are also encoded with a single `pack`.
+    """
+
+    @classmethod
+    def compile(cls, template):
+        try:
+            return cls(template)
+        except _NotStatic:
+            return None
+
+    def __init__(self, template):
+        self._leaves = []
+        self._plan, decode_format = self._compile(template)
+        self.flat = all(kind == 'leaf' for kind, _, _ in self._plan)
+        self._decoder = shared_struct('>' + decode_format)
+        self.size = self._decoder.size
+        self._encoders = self._compile_encoders(template)
+
+    def _compile(self, template):
+        plan, formats = [], []
+        for field in template._fields.values():
+            if field.type == 'pdu':
+                continue
+            if isinstance(field, (UInt, Char)):
+                if not field.length.static or getattr(field, '_terminator', None):
+                    raise _NotStatic()
+                length, aligned = field.length.decode_lengths(None)
+                plan.append(('leaf', field, (len(self._leaves), aligned)))
+                formats.append(self._bytes_format(length, aligned))
+                self._leaves.append(field)
+            elif isinstance(field, StructTemplate) and not field.has_length:
+                subplan, subformat = self._compile(field)
+                plan.append(('struct', field, subplan))
+                length = shared_struct('>' + subformat).size
+                align = field._align
+                formats.append(subformat + self._padding(length, length + (align - length % align) % align))
+            elif isinstance(field, BinaryContainerTemplate) and not field.binlength % 8:
+                plan.append(('decoded', field, len(self._leaves)))
+                formats.append('%ds' % field.get_static_length())
+                self._leaves.append(field)
+            else:
+                raise _NotStatic()
+        return plan, ''.join(formats)
+
+    def _bytes_format(self, length, aligned):
+        return '%ds' % length + self._padding(length, aligned)
+
+    def _padding(self, length, aligned):
+        return '%dx' % (aligned - length) if aligned > length else ''
+
+    def _compile_encoders(self, template):
+        if not self.flat:
+            return None
+        self._offsets, formats, offset = [], [], 0
+        for _, field, (_, aligned) in self._plan:
+            length = field.length.value
+            self._offsets.append((offset, length))
+            if isinstance(field, UInt) and field._codecs:
+                formats.append(field._codecs[0].format[-1] + self._padding(length, aligned))
+            else:
+                formats.append(self._bytes_format(length, aligned))
+            offset += aligned
+        fmt = ''.join(formats)
+        return shared_struct('>' + fmt), shared_struct('<' + fmt)
+
+    def decode(self, data, message, little_endian=False):
+        self._build(self._plan, self._decoder.unpack_from(data), message,
+                    little_endian)
+
+    def _build(self, plan, values, parent, little_endian):
+        for kind, field, arg in plan:
+            if kind == 'leaf':
+                index, aligned = arg
+                parent[field.name] = field._create_field(
+                    values[index], aligned,
+                    little_endian=little_endian and field.can_be_little_endian)
+            elif kind == 'struct':
+                struct = field._get_struct(None, parent)
+                self._build(arg, values, struct, little_endian)
+                parent[field.name] = struct
+            else:
+                parent[field.name] = field.decode(values[arg], parent,
+                                                  little_endian=little_endian)
+
+    def encode(self, struct, params, little_endian=False):
+        """Encodes the fields to `struct` with a single pack. Returns False
+        without consuming `params` when the values need the field by field
+        encoding, for example to report errors or to set length fields.
+        """
+        if not self._encoders:
+            return False
+        try:
+            values = [self._packable_value(field, params, struct, little_endian)
+                      for field in self._leaves]
+        except Exception:
+            return False
+        packed = self._encoders[little_endian].pack(*values)
+        for field, (offset, length), (_, _, (_, aligned)) in zip(self._leaves, self._offsets, self._plan):
+            params.pop(field._get_name(), None)
+            struct[field.name] = field._create_field(packed[offset:offset + length],
+                                                     aligned, little_endian=little_endian)
+        return True
+
+    def _packable_value(self, field, params, struct, little_endian):
+        wild_card = params.get('*') if not field.referenced_later else None
+        value = params.get(field._get_name(), field.default_value or wild_card)
+        if value in (None, ''):
+            raise _NotStatic()
+        if isinstance(field, UInt) and field._codecs:
+            return field._to_integer(value)
+        binary, _ = field._encode_value(value, struct, little_endian)
+        if len(binary) != field.length.value:
+            raise _NotStatic()
+        return binary
@@ -0,0 +1,175 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import re
+
+from Rammbock.binary_tools import to_integer
+
+try:
+    import numpy
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
+BATCH_SIZE = 65536
+
+
+def parse_generator(value):
+    """Returns a value generator for specs like `counter(1, 2)`, otherwise
+    None."""
+    match = re.match(r'\s*(counter|random|cycle)\((.*)\)\s*\Z', str(value))
+    if not match:
+        return None
+    name, args = match.groups()
+    args = [arg.strip() for arg in args.split(',') if arg.strip()]
+    if name == 'counter':
+        return Counter(*args)
+    if name == 'random':
+        return Random(*args)
+    return Cycle(*args)
+
+
+class Counter(object):
+
+    def __init__(self, start=0, step=1):
+        self.first = self._start = to_integer(start)
+        self._step = to_integer(step)
+
+    def values(self, index, count, rng):
+        start = self._start + index * self._step
+        return [start + i * self._step for i in xrange(count)]
+
+    def bounds(self, index, count):
+        first = self._start + index * self._step
+        last = first + (count - 1) * self._step
+        return min(first, last), max(first, last)
+
+    def array(self, index, count, rng, dtype):
+        first = dtype(self._start + index * self._step)
+        steps = numpy.arange(count, dtype=dtype) * dtype(abs(self._step))
+        # Unsigned arrays can not be multiplied with a negative step.
+        return first + steps if self._step >= 0 else first - steps
+
+
+class Random(object):
+
+    def __init__(self, minimum, maximum):
+        self.first = self._min = to_integer(minimum)
+        self._max = to_integer(maximum)
+
+    def values(self, index, count, rng):
+        return [rng.randint(self._min, self._max) for _ in xrange(count)]
+
+    def bounds(self, index, count):
+        return self._min, self._max
+
+    def array(self, index, count, rng, dtype):
+        return rng.randint(self._min, self._max + 1, size=count, dtype=dtype)
+
+
+class Cycle(object):
+
+    def __init__(self, *values):
+        if not values:
+            raise AssertionError('cycle() needs at least one value.')
+        self.first = values[0]
+        self._values = values
+
+    def values(self, index, count, rng):
+        length = len(self._values)
+        return [self._values[(index + i) % length] for i in xrange(count)]
+
+    def bounds(self, index, count):
+        integers = [to_integer(value) for value in self._values]
+        return min(integers), max(integers)
+
+    def array(self, index, count, rng, dtype):
+        values = numpy.array([to_integer(value) for value in self._values], dtype=dtype)
+        return values[numpy.arange(index, index + count) % len(values)]
+
+
+def generate_corpus(image, count, generators, seed=None):
+    """Encodes `count` messages from `image` with field values from
+    `generators` into one binary.
+
+    Returns the binary and a list of offsets where the messages start.
+    Integer fields with a fixed length are written in batches with NumPy when
+    it is available. Generators of fields with dynamic length patch the image
+    message by message instead.
+    """
+    slots = dict((name, image._slots[name]) for name in generators)
+    if any(slot.lengths for slot in slots.values()):
+        return _generate_one_by_one(image, count, generators, random.Random(seed))
+    base = image.encode({})
+    size = len(base)
+    data = bytearray(base * count)
+    rngs = random.Random(seed), numpy.random.RandomState(seed) if NUMPY_ENABLED else None
+    for index in xrange(0, count, BATCH_SIZE):
+        batch = min(BATCH_SIZE, count - index)
+        for name, generator in generators.items():
+            _write_slot(data, index, batch, size, slots[name], generator, rngs)
+    return str(data), range(0, count * size, size)
+
+
+def _write_slot(data, index, batch, size, slot, generator, rngs):
+    codecs = getattr(slot.template, '_codecs', None)
+    dtype = _get_array_type(slot, generator, index, batch) if NUMPY_ENABLED and codecs else None
+    if dtype:
+        _write_array(data, index, batch, size, slot, generator.array(index, batch, rngs[1], dtype))
+        return
+    offset = index * size + slot.offset
+    for value in generator.values(index, batch, rngs[0]):
+        if codecs:
+            codecs[slot.little_endian].pack_into(data, offset, slot.template._to_integer(value))
+        else:
+            binary = slot.encode(value)
+            data[offset:offset + len(binary)] = binary
+        offset += size
+
+
+def _get_array_type(slot, generator, index, batch):
+    """Returns the NumPy type holding all values of the batch, or None if
+    no 64 bit type does. Values are range checked here as Python integers,
+    because NumPy arrays would silently wrap around."""
+    lowest, highest = generator.bounds(index, batch)
+    for value in (lowest, highest):
+        slot.template._check_range(value, value)
+    if -2 ** 63 <= lowest and highest < 2 ** 63:
+        return numpy.int64
+    if 0 <= lowest and highest < 2 ** 64:
+        return numpy.uint64
+    return None
+
+
+def _write_array(data, index, batch, size, slot, values):
+    template = slot.template
+    length = template.length.value
+    dtype = '%s%s%d' % ('<' if slot.little_endian else '>', 'i' if template.signed else 'u', length)
+    messages = numpy.frombuffer(data, dtype=numpy.uint8, count=batch * size,
+                                offset=index * size).reshape(batch, size)
+    messages[:, slot.offset:slot.offset + length] = \
+        values.astype(dtype).view(numpy.uint8).reshape(batch, length)
+
+
+def _generate_one_by_one(image, count, generators, rng):
+    data, offsets = bytearray(), []
+    for index in xrange(0, count, BATCH_SIZE):
+        batch = min(BATCH_SIZE, count - index)
+        values = dict((name, generator.values(index, batch, rng))
+                      for name, generator in generators.items())
+        for i in xrange(batch):
+            offsets.append(len(data))
+            data.extend(image.encode(dict((name, values[name][i]) for name in values)))
+    return str(data), offsets
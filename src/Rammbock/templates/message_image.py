@@ -0,0 +1,189 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from Rammbock.message import Field, Struct, Union, BinaryContainer
+from Rammbock.binary_tools import to_bin_of_length
+from Rammbock.ordered_dict import OrderedDict
+from containers import ListTemplate, CaseTemplate, StructTemplate
+from primitives import Char
+
+
+class MessageImage(object):
+    """Encoded bytes of a message with patchable slots for variable fields.
+
+    Encoding a new instance writes the values of the variable fields straight
+    into the bytes of the original message. Length fields depending on the
+    size of a variable field, including the PDU length in the header, are
+    updated too. Fields not given keep their latest value.
+    """
+
+    def __init__(self, template, message, variable_fields):
+        self._raw = bytearray(message._raw)
+        self._regions = {}
+        self._slots = OrderedDict()
+        positions = {}
+        _collect_positions(message, 0, positions)
+        for name in variable_fields:
+            self._slots[name] = self._create_slot(template, message, name, positions)
+
+    def _create_slot(self, template, message, name, positions):
+        path = self._get_path(template, message, name)
+        field_template, field = path[-1]
+        if not isinstance(field, Field) or isinstance(field._parent, BinaryContainer):
+            raise AssertionError("Field '%s' can not be a variable field of a message image." % name)
+        if field_template.referenced_later:
+            raise AssertionError("Length field '%s' is updated automatically in message image." % name)
+        in_header = path[0][0] is not template
+        slot = _Slot(field_template, field, positions[id(field)],
+                     in_header and template._protocol.little_endian)
+        if not field_template.length.static:
+            self._add_lengths(slot, path, template, message, positions)
+        return slot
+
+    def _get_path(self, template, message, name):
+        if name.startswith('header:'):
+            template, element = template._protocol, message._header
+            name = name.partition(':')[2]
+        else:
+            element = message
+        path = [(template, element)]
+        for part in name.split('.'):
+            template = _get_child_template(template, part)
+            if not template or part not in element:
+                raise AssertionError("Unknown field '%s' in message image." % name)
+            element = element[part]
+            path.append((template, element))
+        return path
+
+    def _add_lengths(self, slot, path, template, message, positions):
+        name = slot.field._get_recursive_name()
+        if not isinstance(slot.template, Char):
+            raise AssertionError("Field '%s' with dynamic length can not be a variable field of a message image." % name)
+        if slot.template.length.has_references:
+            self._add_length(slot, slot.template.length, slot.field._parent, slot.field, positions)
+        for field_template, element in path[1:-1]:
+            if isinstance(element, Union) or (isinstance(element, Struct) and element._align > 1):
+                raise AssertionError("Field '%s' with dynamic length can not be a variable field of a message image "
+                                     "inside unions or aligned structs." % name)
+            if isinstance(field_template, StructTemplate) and field_template.has_length:
+                self._add_length(slot, field_template.length, element._parent, element, positions)
+        if path[0][1] is message:
+            pdu_length = template._protocol.pdu_length
+            if not pdu_length.has_references:
+                raise AssertionError("Field '%s' with dynamic length can not be a variable field of a message image "
+                                     "when PDU length is static." % name)
+            self._add_length(slot, pdu_length, message._header, None, positions,
+                             len(self._raw) - len(message._header))
+
+    def _add_length(self, slot, length, parent, element, positions, size=None):
+        if id(element) not in self._regions:
+            self._regions[id(element)] = _Region(len(element) if size is None else size)
+        reference = length._find_reference(parent)
+        slot.lengths.append(_LengthSlot(length, reference, positions[id(reference)],
+                                        self._regions[id(element)]))
+
+    @property
+    def variable_fields(self):
+        return self._slots.keys()
+
+    def encode(self, values):
+        """Patches the variable fields in `values` and returns the bytes."""
+        for name, value in values.items():
+            if name not in self._slots:
+                raise AssertionError("Field '%s' is not a variable field of the message image." % name)
+            self._patch(self._slots[name], value)
+        return str(self._raw)
+
+    def _patch(self, slot, value):
+        binary = slot.encode(value)
+        delta = len(binary) - slot.size
+        self._raw[slot.offset:slot.offset + slot.size] = binary
+        if delta:
+            self._move_after(slot, delta)
+            slot.size += delta
+            for length in slot.lengths:
+                length.region.size += delta
+                length.write(self._raw)
+
+    def _move_after(self, moved, delta):
+        for slot in self._slots.values():
+            for item in [slot] + slot.lengths:
+                if (item.offset, item.order) > (moved.offset, moved.order):
+                    item.offset += delta
+
+
+class _Slot(object):
+
+    def __init__(self, template, field, position, little_endian):
+        self.template = template
+        self.field = field
+        self.offset, self.order = position
+        self.size = len(field)
+        self.little_endian = little_endian
+        self.lengths = []
+
+    def encode(self, value):
+        if self.lengths:
+            return self._encode_resized(value)
+        binary, aligned_length = self.template._encode_value(value, self.field._parent,
+                                                             little_endian=self.little_endian)
+        if len(binary) != len(self.field._original_value):
+            raise AssertionError("Value '%s' does not fit field '%s' of length %d."
+                                 % (value, self.field._get_recursive_name(), len(self.field._original_value)))
+        return binary.ljust(aligned_length, '\x00')
+
+    def _encode_resized(self, value):
+        binary = str(value or '') + self.template._terminator
+        return binary.ljust(self.template.length._get_aligned_lengths(len(binary))[1], '\x00')
+
+
+class _LengthSlot(object):
+
+    def __init__(self, length, reference, position, region):
+        self._length = length
+        self._reference = reference
+        self._size = len(reference._original_value)
+        self.offset, self.order = position
+        self.region = region
+
+    def write(self, raw):
+        aligned = self._length._get_aligned_lengths(self.region.size)[1]
+        binary = to_bin_of_length(self._size, int(self._length.solve_parameter(aligned)))
+        if self._reference._little_endian:
+            binary = binary[::-1]
+        raw[self.offset:self.offset + self._size] = binary
+
+
+class _Region(object):
+
+    def __init__(self, size):
+        self.size = size
+
+
+def _get_child_template(template, name):
+    if isinstance(template, (ListTemplate, CaseTemplate)):
+        return template.field
+    if hasattr(template, '_get_field'):
+        return template._get_field(name)
+    return None
+
+
+def _collect_positions(element, offset, positions):
+    positions[id(element)] = (offset, len(positions))
+    if isinstance(element, (Field, BinaryContainer)):
+        return
+    for child in element._fields.values():
+        _collect_positions(child, offset, positions)
+        if not isinstance(element, Union):
+            offset += len(child)
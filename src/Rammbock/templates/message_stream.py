@@ -12,164 +12,543 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import time
-import threading
 import traceback
+from importlib import import_module
 import re
+import socket
+import threading
+from collections import deque
+from functools import partial
 
 from Rammbock.logger import logger
-from Rammbock.binary_tools import to_bin, to_int
-from Rammbock.synchronization import LOCK
+from Rammbock.binary_tools import to_bin, to_int, to_0xhex
+from Rammbock.ordered_dict import OrderedDict
+from Rammbock.synchronization import LOCK, released
+from Rammbock.reactor import REACTOR
+from Rammbock.executor import EXECUTOR
+
+CACHE_POLICIES = ('drop-oldest', 'drop-newest', 'fail')
+CACHE_HIGH_WATER_MARK = 0.8
+MAX_CACHED_MATCHERS = 100
+PARTIAL_MESSAGE_TIMEOUT = 0.01
+
+
+def get_cache_size(size):
+    if size in (None, '') or str(size).lower() == 'none':
+        return None
+    size = int(size)
+    if size < 1:
+        raise AssertionError('Message cache size must be positive, got %d.' % size)
+    return size
+
+
+def get_cache_policy(policy):
+    if not policy:
+        return CACHE_POLICIES[0]
+    if policy.lower() not in CACHE_POLICIES:
+        raise AssertionError("Unknown message cache policy '%s'. Available policies are %s."
+                             % (policy, ', '.join(CACHE_POLICIES)))
+    return policy.lower()
 
 
 class MessageStream(object):
 
-    def __init__(self, stream, protocol):
-        self._cache = []
+    def __init__(self, stream, protocol, cache_size=None, cache_policy=None, lock=None):
+        self._cache_size = cache_size
+        self._cache_policy = cache_policy
+        self._cache = _MessageCache(cache_size, cache_policy)
         self._stream = stream
         self._protocol = protocol
-        self._handlers = []
-        self._handler_thread = None
-        self._running = True
-        self._interval = 0.5
+        self._handlers = _HandlerTable()
+        self._matchers = {}
+        self._lock = lock or threading.RLock()
+        self._condition = threading.Condition(self._lock)
+        self._reading = False
 
     def close(self):
-        self._running = False
+        REACTOR.unregister(self)
         self.empty()
 
-    def set_handler(self, msg_template, handler_func, header_filter, interval):
-        self._handlers.append((msg_template, handler_func, header_filter))
-        if interval:
-            self._interval = float(interval)
-        if not self._handler_thread:
-            self._handler_thread = threading.Thread(target=self.match_handlers_periodically, name="Background handler")
-            self._handler_thread.daemon = True
-            self._handler_thread.start()
+    def fileno(self):
+        return self._stream.fileno()
+
+    def set_handler(self, msg_template, handler_func, header_filter, interval=None):
+        matcher = self._get_matcher(msg_template, header_filter)
+        self._handlers.add(msg_template, handler_func, matcher)
+        REACTOR.register(self)
+
+    def get(self, message_template, timeout=None, header_filter=None, latest=None, lazy=False):
+        """Returns the first or `latest` received message matching the template.
 
-    def get(self, message_template, timeout=None, header_filter=None, latest=None):
+        The lock of the stream is released while waiting for data, so other
+        threads can wait on the same stream meanwhile. One waiter at a time
+        waits for the socket. The others wait until it has read a message,
+        because the message may be theirs.
+        """
+        try:
+            with self._lock:
+                return self._get(message_template, timeout, header_filter, latest, lazy)
+        finally:
+            if self._handlers:
+                REACTOR.schedule(self)
+
+    def get_received(self, message_template, header_filter=None, latest=None, lazy=False):
+        """Returns the first or `latest` matching message that has already
+        been received, or None without waiting for more data."""
+        try:
+            with self._lock:
+                self._cache.check_overflow()
+                matcher = self._get_matcher(message_template, header_filter)
+                self._fill_cache()
+                return self._get_from_cache(message_template, matcher, latest, lazy)
+        finally:
+            if self._handlers:
+                REACTOR.schedule(self)
+
+    def has_received(self):
+        """Tells without taking the lock if there may be received messages,
+        so idle streams can be skipped cheaply."""
+        return bool(self._cache) or self._stream.has_data()
+
+    def is_closed_by_peer(self):
+        with self._lock:
+            return self._stream.is_closed_by_peer()
+
+    def _get(self, message_template, timeout, header_filter, latest, lazy):
+        """A receive that has got data while waiting, but no matching message,
+        fails with the timeout of the message stream like it did when data
+        was read with the whole timeout. A receive that got no data fails
+        with the timeout of the socket."""
         header_fields = message_template.header_parameters
         logger.trace("Get message with params %s" % header_fields)
+        self._cache.check_overflow()
+        matcher = self._get_matcher(message_template, header_filter)
         if latest:
             self._fill_cache()
-        msg = self._get_from_cache(message_template, header_fields, header_filter, latest)
-        if msg:
-            logger.trace("Cache hit. Cache currently has %s messages" % len(self._cache))
-            return msg
-        cutoff = time.time() + float(timeout if timeout else 0)
-        while not timeout or time.time() < cutoff:
-            with LOCK:
+        cutoff = time.time() + float(timeout) if timeout else None
+        data_arrived = False
+        while True:
+            msg = self._get_from_cache(message_template, matcher, latest, lazy)
+            if msg:
+                logger.trace("Cache hit. Cache currently has %s messages" % len(self._cache))
+                return msg
+            if cutoff is not None and time.time() >= cutoff:
+                raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
+            if self._reading:
+                self._condition.wait(_get_remaining(cutoff))
+            elif not self._stream.has_data():
+                try:
+                    self._wait_for_data(cutoff)
+                except socket.timeout:
+                    if data_arrived and cutoff is not None:
+                        raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
+                    raise
+                data_arrived = True
+            else:
                 header, pdu_bytes = self._protocol.read(self._stream, timeout=timeout)
-                if self._matches(header, header_fields, header_filter):
-                    return self._to_msg(message_template, header, pdu_bytes)
-                else:
-                    self._match_or_cache(header, pdu_bytes)
-        raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
+                if not matcher or matcher.matches(header):
+                    return self._to_msg(message_template, header, pdu_bytes, lazy)
+                handler_call = self._match_or_cache(header, pdu_bytes)
+                self._condition.notify_all()
+                if handler_call:
+                    with released(self._lock):
+                        self._run_handler(handler_call)
+
+    def _wait_for_data(self, cutoff):
+        self._reading = True
+        try:
+            with released(self._lock):
+                self._stream.wait_for_data(_get_remaining(cutoff))
+        finally:
+            self._reading = False
+            self._condition.notify_all()
 
     def _match_or_cache(self, header, pdu_bytes):
-        for template, func, handler_filter in self._handlers:
-            if self._matches(header, template.header_parameters, handler_filter):
-                msg_to_be_sent = self._to_msg(template, header, pdu_bytes)
-                logger.debug("Calling handler %s for message %s" % (func, msg_to_be_sent))
-                self._call_handler_function(func, msg_to_be_sent)
-                return
-        self._cache.append((header, pdu_bytes))
-
-    def _get_call_handler(self, handler_name):
-        module, function = handler_name.split('.')
-        mod = __import__(module)
-        return getattr(mod, function)
-
-    def _get_from_cache(self, template, fields, header_filter, latest):
-        indexes = range(len(self._cache))
-        for index in indexes if not latest else reversed(indexes):
-            header, pdu = self._cache[index]
-            if self._matches(header, fields, header_filter):
-                self._cache.pop(index)
-                return self._to_msg(template, header, pdu)
+        """Caches the message or returns the call of its handler, which must
+        be run after releasing the lock of the stream."""
+        handler = self._handlers.find(header)
+        if handler:
+            msg_to_be_sent = self._to_msg(handler.template, header, pdu_bytes)
+            logger.debug("Calling handler %s for message %s" % (handler.name, msg_to_be_sent))
+            return partial(self._call_handler_function, handler, msg_to_be_sent)
+        self._cache.append(header, pdu_bytes)
+        return None
+
+    def _get_from_cache(self, template, matcher, latest, lazy=False):
+        if not self._cache:
+            return None
+        cached = self._cache.pop(matcher, latest)
+        if cached:
+            header, pdu = cached
+            return self._to_msg(template, header, pdu, lazy)
         return None
 
-    def _to_msg(self, template, header, pdu_bytes):
+    def _to_msg(self, template, header, pdu_bytes, lazy=False):
         if template.only_header:
             return header
-        msg = template.decode(pdu_bytes, parent=header)
+        msg = template.decode(pdu_bytes, parent=header, lazy=lazy)
         msg._add_header(header)
         return msg
 
-    def _matches(self, header, fields, header_filter):
-        if header_filter:
-            if header_filter not in fields:
-                raise AssertionError('Trying to filter messages by header field %s, but no value has been set for %s' %
-                                     (header_filter, header_filter))
-            field = header[header_filter]
-            if field._type == 'chars':
-                if fields[header_filter].startswith('REGEXP:'):
-                    try:
-                        regexp = fields[header_filter].split(':')[1].strip()
-                        return bool(re.match(regexp, field.ascii))
-                    except re.error as e:
-                        raise Exception("Invalid RegEx Error : " + str(e))
-                return field.ascii == fields[header_filter]
-            if field._type == 'uint':
-                return field.uint == to_int(fields[header_filter])
-            if header[header_filter].bytes != to_bin(fields[header_filter]):
-                return False
-        return True
+    def _get_matcher(self, template, header_filter):
+        if not header_filter:
+            return None
+        key = (header_filter, template.header_parameters.get(header_filter))
+        if key not in self._matchers:
+            if len(self._matchers) >= MAX_CACHED_MATCHERS:
+                self._matchers.clear()
+            self._matchers[key] = HeaderMatcher(self._protocol, template.header_parameters, header_filter)
+        return self._matchers[key]
 
     def empty(self):
-        self._cache = []
-        self._stream.empty()
+        with self._lock:
+            self._cache = _MessageCache(self._cache_size, self._cache_policy)
+            self._stream.empty()
+
+    def get_evicted_messages_counts(self):
+        with self._lock:
+            return dict(self._cache.evicted)
 
     def get_messages_count_in_cache(self):
-        self._fill_cache()
-        for msg in self._cache:
-            logger.info(msg)
-        return len(self._cache)
+        with self._lock:
+            self._fill_cache()
+            return len(self._cache)
 
     def _fill_cache(self):
-        try:
-            while True:
-                header, pdu_bytes = self._protocol.read(self._stream, timeout=0.2)
-                self._cache.append((header, pdu_bytes))
-        except:
-            pass
-
-    def match_handlers_periodically(self):
-        while self._running:
-            time.sleep(self._interval)
-            self.match_handlers()
-
-    def match_handlers(self):
-        try:
-            while True:
-                with LOCK:
-                    self._try_matching_cached_to_templates()
-                    header, pdu_bytes = self._protocol.read(self._stream, timeout=0.01)
-                    self._match_or_cache(header, pdu_bytes)
-        except Exception:
-            logger.debug("failure in matching cache %s" % traceback.format_exc())
+        """Reads the messages already received to the cache without waiting.
+
+        Data is left to a receiver waiting for it, which would otherwise keep
+        waiting for data already read. Failures are only logged, because
+        counting messages must not fail. A full cache with the `fail` policy
+        fails the next receive instead.
+        """
+        while not self._reading and self._stream.has_data():
+            try:
+                header, pdu_bytes = self._protocol.read(self._stream, timeout=PARTIAL_MESSAGE_TIMEOUT)
+            except (AssertionError, socket.timeout):
+                break
+            except Exception, e:
+                logger.warn("Reading received message to cache failed: %s" % e)
+                break
+            try:
+                self._cache.append(header, pdu_bytes)
+            except AssertionError, e:
+                logger.warn(e.args[0])
+                break
+        self._condition.notify_all()
+
+    def handle_readable(self):
+        """Matches cached and received messages to handlers.
+
+        Returns False if the connection has been closed by the peer.
+        """
+        with self._lock:
+            handler_calls = self._try_matching_cached_to_templates()
+        for handler_call in handler_calls:
+            self._run_background_handler(handler_call)
+        while True:
+            handler_call = None
+            with self._lock:
+                # A receiver waiting for data reads and handles it itself.
+                if self._reading:
+                    return True
+                if self._stream.is_closed_by_peer():
+                    return False
+                if not self._stream.has_data():
+                    return True
+                try:
+                    header, pdu_bytes = self._protocol.read(self._stream, timeout=PARTIAL_MESSAGE_TIMEOUT)
+                except (AssertionError, socket.timeout):
+                    return True
+                try:
+                    handler_call = self._match_or_cache(header, pdu_bytes)
+                except Exception:
+                    logger.debug("failure in background handler %s" % traceback.format_exc())
+                self._condition.notify_all()
+            if handler_call:
+                self._run_background_handler(handler_call)
 
     # FIXME: Is this actually necessary? Wouldnt we always match before caching?
     # Unless of course the handler was set after caching happened...
     def _try_matching_cached_to_templates(self):
+        handler_calls = []
         if not self._cache:
-            return
-        for template, func, handler_filter in self._handlers:
-            msg = self._get_from_cache(template, template.header_parameters, handler_filter, False)
+            return handler_calls
+        for handler in self._handlers:
+            msg = self._get_from_cache(handler.template, handler.matcher, False)
             if msg:
-                logger.debug("Calling handler %s for cached message %s" % (func, msg))
-                self._call_handler_function(func, msg)
+                logger.debug("Calling handler %s for cached message %s" % (handler.name, msg))
+                handler_calls.append(partial(self._call_handler_function, handler, msg))
+        return handler_calls
+
+    def _run_background_handler(self, handler_call):
+        try:
+            self._run_handler(handler_call)
+        except Exception:
+            logger.debug("failure in background handler %s" % traceback.format_exc())
+
+    def _run_handler(self, handler_call):
+        # Handlers run without workers hold the library lock like keywords do.
+        EXECUTOR.submit(self, handler_call, inline_lock=LOCK)
 
-    def _call_handler_function(self, func, msg):
-        func = self._get_call_handler(func)
+    def _call_handler_function(self, handler, msg):
         node, connection = self._get_node_and_connection()
-        args = func.func_code.co_argcount
-        if args == 3:
-            return func(self._protocol.library, msg, node)
-        if args == 4:
-            return func(self._protocol.library, msg, node, connection)
-        return func(self._protocol.library, msg)
+        return handler(self._protocol.library, msg, node, connection)
 
     def _get_node_and_connection(self):
         connection = self._stream._connection
         if connection.parent:
             return connection.parent, connection
         return connection, None
+
+
+class _MessageCache(object):
+    """Received messages that no receive or handler has taken yet.
+
+    Messages are kept in arrival order. Header fields used as header filters
+    get an index from field value to messages, so taking the first or the
+    latest message with a given header value does not scan the whole cache.
+
+    A cache with `max_size` handles new messages on a full cache according to
+    `policy`. Evicted messages are counted by their values of the indexed
+    header fields.
+    """
+
+    def __init__(self, max_size=None, policy=None):
+        self._messages = OrderedDict()
+        self._indexes = {}
+        self._sequence = 0
+        self._max_size = get_cache_size(max_size)
+        self._policy = get_cache_policy(policy)
+        self._high_water_mark = int(self._max_size * CACHE_HIGH_WATER_MARK) if self._max_size else None
+        self._above_high_water_mark = False
+        self._overflow = None
+        self.evicted = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages.values())
+
+    def append(self, header, pdu_bytes):
+        if self._max_size and len(self._messages) >= self._max_size:
+            if not self._make_room(header):
+                return
+        self._sequence += 1
+        self._messages[self._sequence] = (header, pdu_bytes)
+        for index in self._indexes.values():
+            index.add(self._sequence, header)
+        self._check_high_water_mark()
+
+    def _make_room(self, header):
+        if self._policy == 'fail':
+            self._overflow = AssertionError('Message cache is full with %d unread messages.' % self._max_size)
+            raise self._overflow
+        if self._policy == 'drop-newest':
+            self._count_evicted(header)
+            return False
+        self._count_evicted(self.pop()[0])
+        return True
+
+    def _count_evicted(self, header):
+        key = ', '.join(index.describe(header) for _, index in sorted(self._indexes.items())) or '*'
+        self.evicted[key] = self.evicted.get(key, 0) + 1
+
+    def _check_high_water_mark(self):
+        if not self._high_water_mark:
+            return
+        if len(self._messages) < self._high_water_mark:
+            self._above_high_water_mark = False
+        elif not self._above_high_water_mark:
+            self._above_high_water_mark = True
+            logger.warn('Message cache has %d unread messages. Maximum size is %d and policy %s.'
+                        % (len(self._messages), self._max_size, self._policy))
+
+    def check_overflow(self):
+        if self._overflow:
+            raise self._overflow
+
+    def pop(self, matcher=None, latest=False):
+        if not self._messages:
+            return None
+        if matcher:
+            sequence = self._get_index(matcher.name).find(matcher, latest)
+        else:
+            sequence = next(reversed(self._messages) if latest else iter(self._messages))
+        if sequence is None:
+            return None
+        header, pdu_bytes = self._messages.pop(sequence)
+        for index in self._indexes.values():
+            index.remove(sequence, header)
+        self._check_high_water_mark()
+        return header, pdu_bytes
+
+    def _get_index(self, name):
+        if name not in self._indexes:
+            index = self._indexes[name] = _HeaderIndex(name)
+            for sequence, (header, _) in self._messages.items():
+                index.add(sequence, header)
+        return self._indexes[name]
+
+
+def _get_remaining(cutoff):
+    if cutoff is None:
+        return None
+    return max(cutoff - time.time(), 0.0)
+
+
+class _Handler(object):
+
+    def __init__(self, template, name, matcher, order):
+        self.template = template
+        self.name = name
+        self.matcher = matcher
+        self.order = order
+        self._function = _import_handler(name)
+        self._arity = self._function.func_code.co_argcount
+
+    def __call__(self, library, msg, node, connection):
+        if self._arity == 3:
+            return self._function(library, msg, node)
+        if self._arity == 4:
+            return self._function(library, msg, node, connection)
+        return self._function(library, msg)
+
+
+def _import_handler(name):
+    module, function = name.rsplit('.', 1)
+    return getattr(import_module(module), function)
+
+
+class _HandlerTable(object):
+    """Handlers of a message stream grouped by the header values they match.
+
+    Handlers with a plain header filter are found with one dictionary lookup
+    per filtered header field. Handlers without a header filter or with a
+    `REGEXP:` filter are tried in turn. Like before, the first registered
+    handler matching a header is used.
+    """
+
+    def __init__(self):
+        self._handlers = []
+        self._tables = {}
+        self._others = []
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def __iter__(self):
+        return iter(self._handlers)
+
+    def add(self, template, name, matcher):
+        handler = _Handler(template, name, matcher, len(self._handlers))
+        self._handlers.append(handler)
+        if matcher and not matcher.regexp:
+            self._tables.setdefault(matcher.name, {}).setdefault(matcher.key, handler)
+        else:
+            self._others.append(handler)
+
+    def find(self, header):
+        found = None
+        for name, table in self._tables.items():
+            handler = table.get(_get_key(header[name]))
+            if handler and (not found or handler.order < found.order):
+                found = handler
+        for handler in self._others:
+            if found and handler.order > found.order:
+                break
+            if not handler.matcher or handler.matcher.matches(header):
+                return handler
+        return found
+
+
+class HeaderMatcher(object):
+    """Header filter of a receive or a handler compiled for matching headers.
+
+    The expected value is converted once to the form it is compared in: an
+    integer for uint fields, a string for chars fields, a compiled regular
+    expression for `REGEXP:` values of chars fields and bytes otherwise.
+    """
+
+    def __init__(self, protocol, fields, header_filter):
+        if header_filter not in fields:
+            raise AssertionError('Trying to filter messages by header field %s, but no value has been set for %s' %
+                                 (header_filter, header_filter))
+        field = protocol._get_field(header_filter)
+        if not field:
+            raise AssertionError("Trying to filter messages by header field %s, which is not in protocol '%s'."
+                                 % (header_filter, protocol.name))
+        self.name = header_filter
+        self.type = field.type
+        self.regexp = None
+        self.key = None
+        value = fields[header_filter]
+        if self.type == 'chars' and value.startswith('REGEXP:'):
+            try:
+                self.regexp = re.compile(value.split(':', 1)[1].strip())
+            except re.error as e:
+                raise Exception("Invalid RegEx Error : " + str(e))
+        elif self.type == 'chars':
+            self.key = value
+        elif self.type == 'uint':
+            self.key = to_int(value)
+        else:
+            self.key = to_bin(value)
+
+    def matches(self, header):
+        return self.matches_key(_get_key(header[self.name]))
+
+    def matches_key(self, key):
+        if self.regexp:
+            return bool(self.regexp.match(key))
+        return key == self.key
+
+
+def _get_key(field):
+    if field._type == 'chars':
+        return field.ascii
+    if field._type == 'uint':
+        return int(field)
+    return field.bytes
+
+
+class _HeaderIndex(object):
+
+    def __init__(self, name):
+        self._name = name
+        self._type = None
+        self._sequences = {}
+
+    def add(self, sequence, header):
+        field = header[self._name]
+        self._type = field._type
+        self._sequences.setdefault(_get_key(field), deque()).append(sequence)
+
+    def remove(self, sequence, header):
+        key = _get_key(header[self._name])
+        sequences = self._sequences[key]
+        if sequences[0] == sequence:
+            sequences.popleft()
+        elif sequences[-1] == sequence:
+            sequences.pop()
+        else:
+            sequences.remove(sequence)
+        if not sequences:
+            del self._sequences[key]
+
+    def describe(self, header):
+        key = _get_key(header[self._name])
+        return '%s=%s' % (self._name, to_0xhex(key) if isinstance(key, str) and self._type != 'chars' else key)
+
+    def find(self, matcher, latest):
+        if matcher.regexp:
+            candidates = [sequences[-1] if latest else sequences[0]
+                          for key, sequences in self._sequences.items() if matcher.matches_key(key)]
+            if not candidates:
+                return None
+            return max(candidates) if latest else min(candidates)
+        sequences = self._sequences.get(matcher.key)
+        if not sequences:
+            return None
+        return sequences[-1] if latest else sequences[0]
@@ -19,7 +19,7 @@ import re
 
 from Rammbock.message import Field, BinaryField
 from Rammbock.binary_tools import to_bin_of_length, to_0xhex, to_tbcd_binary, \
-    to_tbcd_value, to_bin, to_twos_comp, to_int
+    to_tbcd_value, to_bin, to_twos_comp, to_int, to_integer, int_struct
 
 
 class _TemplateField(object):
@@ -53,31 +53,32 @@ class _TemplateField(object):
 
     def _to_field(self, name, value, parent, little_endian=False):
         field_name, field_value = self._encode_value(value, parent, little_endian=little_endian)
-        return Field(self.type, self._get_name(name), field_name, field_value, little_endian=little_endian)
+        return self._create_field(field_name, field_value, name, little_endian)
 
     def decode(self, data, message, name=None, little_endian=False):
         data = self._prepare_data(data)
         length, aligned_length = self.length.decode_lengths(message, len(data))
         if len(data) < aligned_length:
             raise Exception("Not enough data for '%s'. Needs %s bytes, given %s" % (self._get_recursive_name(message), aligned_length, len(data)))
-        return Field(self.type,
-                     self._get_name(name),
-                     data[:length],
-                     aligned_len=aligned_length,
-                     little_endian=little_endian and self.can_be_little_endian)
+        return self._create_field(data[:length], aligned_length, name,
+                                  little_endian and self.can_be_little_endian)
+
+    def _create_field(self, value, aligned_length, name=None, little_endian=False):
+        return Field(self.type, self._get_name(name), value,
+                     aligned_len=aligned_length, little_endian=little_endian)
 
     def _prepare_data(self, data):
         return data
 
     def validate(self, parent, paramdict, name=None):
         name = name or self.name
+        forced_value = self._get_element_value_and_remove_from_params(paramdict, name)
+        if not forced_value or forced_value == 'None':
+            return []
         field = parent[name]
         value = field.bytes
-        forced_value = self._get_element_value_and_remove_from_params(paramdict, name)
         try:
-            if not forced_value or forced_value == 'None':
-                return []
-            elif forced_value.startswith('('):
+            if forced_value.startswith('('):
                 return self._validate_pattern(forced_value, value, field)
         except AttributeError as e:
             e.args = ('Validating {}:{} failed. {}.\n    Did you set default value as numeric object instead of string?'
@@ -162,27 +163,69 @@ class UInt(_TemplateField):
 
     type = 'uint'
     can_be_little_endian = True
+    signed = False
 
     def __init__(self, length, name, default_value=None, align=None):
         _TemplateField.__init__(self, name, default_value)
         self.length = Length(length, align)
+        self._codecs = self._get_codecs()
+
+    def _get_codecs(self):
+        if not self.length.static or not int_struct(self.length.value):
+            return None
+        self._min, self._max = self._get_range(self.length.value * 8)
+        return (int_struct(self.length.value, False, self.signed),
+                int_struct(self.length.value, True, self.signed))
+
+    def _get_range(self, bits):
+        return 0, (1 << bits) - 1
+
+    def _check_range(self, integer, value):
+        if not self._min <= integer <= self._max:
+            raise AssertionError('Too long binary value %s (max length %d)'
+                                 % (value, self.length.value))
 
     def _encode_value(self, value, message, little_endian=False):
         self._raise_error_if_no_value(value, message)
         length, aligned_length = self.length.decode_lengths(message)
+        if self._codecs:
+            return self._pack(value, little_endian), aligned_length
         binary = to_bin_of_length(length, value)
         binary = binary[::-1] if little_endian else binary
         return binary, aligned_length
 
+    def _pack(self, value, little_endian):
+        return self._codecs[little_endian].pack(self._to_integer(value))
+
+    def _to_integer(self, value):
+        integer = to_integer(value)
+        self._check_range(integer, value)
+        return integer
+
+    def _create_field(self, value, aligned_length, name=None, little_endian=False):
+        field = _TemplateField._create_field(self, value, aligned_length, name, little_endian)
+        if self._codecs:
+            field._codec = int_struct(self.length.value, little_endian)
+        return field
+
 
 class Int(UInt):
 
     type = 'int'
     can_be_little_endian = True
+    signed = True
 
     def __init__(self, length, name, default_value=None, align=None):
         UInt.__init__(self, length, name, default_value, align)
 
+    def _get_range(self, bits):
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+
+    def _check_range(self, integer, value):
+        if not self._min <= integer <= self._max:
+            raise AssertionError('Value %s out of range (%d..%d)'
+                                 % (value, self._min, self._max))
+
     def _get_int_value(self, message, value):
         bin_len = self.length.decode_lengths(message)[0] * 8
         min = pow(-2, (bin_len - 1))
@@ -194,7 +237,8 @@ class Int(UInt):
 
     def _encode_value(self, value, message, little_endian=False):
         self._raise_error_if_no_value(value, message)
-        value = self._get_int_value(message, value)
+        if not self._codecs:
+            value = self._get_int_value(message, value)
         return UInt._encode_value(self, value, message, little_endian)
 
 
@@ -205,6 +249,7 @@ class Char(_TemplateField):
     def __init__(self, length, name, default_value=None, terminator=None):
         _TemplateField.__init__(self, name, default_value)
         self._terminator = to_bin(terminator)
+        self._terminator_regexp = re.escape(self._terminator)
         self.length = Length(length)
 
     def _encode_value(self, value, message, little_endian=False):
@@ -218,7 +263,10 @@ class Char(_TemplateField):
 
     def _prepare_data(self, data):
         if self._terminator:
-            return data[0:data.index(self._terminator) + len(self._terminator)]
+            match = re.search(self._terminator_regexp, data)
+            if not match:
+                raise ValueError("Terminator %s not found for '%s'" % (to_0xhex(self._terminator), self.name))
+            return data[0:match.end()]
         return data
 
     def _validate_regexp(self, forced_pattern, value, field):
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Benchmark of UDP round trips while another receive keyword waits.
+
+Usage:  [interpreter] utest/benchmark_lock_contention.py [round trips]
+
+Measures the time of round trips between one client and server while no
+receive is waiting, while a receive waits on another server, and while a
+receive waits on another server holding the library lock during the wait like
+keywords did before they released it. Prints the times without asserting
+anything. Round trips default to 200.
+
+Examples:
+
+    utest/benchmark_lock_contention.py
+    python utest/benchmark_lock_contention.py 1000
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+from os.path import abspath, dirname, join
+from threading import Event, Thread
+
+
+ROOT = dirname(dirname(abspath(__file__)))
+LOCAL_IP = '127.0.0.1'
+PORT = 23456
+WAITER_TIMEOUT = 2
+
+
+def start_nodes(rammbock):
+    for index in range(2):
+        rammbock.start_udp_server(LOCAL_IP, PORT + index, name='Server%d' % index)
+        rammbock.start_udp_client(LOCAL_IP, PORT + 10 + index, name='Client%d' % index)
+        rammbock.connect(LOCAL_IP, PORT + index, name='Client%d' % index)
+
+
+def round_trips(rammbock, count):
+    start = time.time()
+    for _ in range(count):
+        rammbock.client_sends_binary('ping', name='Client1')
+        rammbock.server_receives_binary(name='Server1')
+    return time.time() - start
+
+
+def round_trips_with_waiting_receiver(rammbock, count):
+    receiving = Event()
+    server = rammbock._servers.get('Server0')
+    receive_from = server.receive_from
+
+    def signaling_receive_from(*args, **kwargs):
+        receiving.set()
+        return receive_from(*args, **kwargs)
+    server.receive_from = signaling_receive_from
+    waiter = Thread(target=receive_ignoring_timeout, args=[rammbock])
+    waiter.start()
+    receiving.wait(WAITER_TIMEOUT)
+    try:
+        return round_trips(rammbock, count)
+    finally:
+        rammbock.client_sends_binary('pong', name='Client0')
+        waiter.join()
+        server.receive_from = receive_from
+
+
+def receive_ignoring_timeout(rammbock):
+    try:
+        rammbock.server_receives_binary(name='Server0', timeout=WAITER_TIMEOUT)
+    except Exception:
+        pass
+
+
+@contextmanager
+def holding(lock):
+    yield
+
+
+def run_benchmark(count):
+    from Rammbock import Rammbock, core
+    rammbock = Rammbock()
+    start_nodes(rammbock)
+    try:
+        print('No waiting receiver:           %.3fs' % round_trips(rammbock, count))
+        print('Receiver waiting:              %.3fs' % round_trips_with_waiting_receiver(rammbock, count))
+        released, core.released = core.released, holding
+        try:
+            print('Receiver waiting holding lock: %.3fs'
+                  % round_trips_with_waiting_receiver(rammbock, count))
+        finally:
+            core.released = released
+    finally:
+        rammbock.reset_rammbock()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 or sys.argv[1:] and not sys.argv[1].isdigit():
+        print(__doc__)
+        sys.exit(251)
+    sys.path.insert(0, join(ROOT, 'src'))
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -1,7 +1,39 @@
+import random
+import copy
 from unittest import TestCase, main
 from Rammbock.binary_tools import to_bin, to_bin_of_length, to_hex, to_0xhex, \
     to_binary_string_of_length, to_tbcd_value, to_bin_str_from_int_string, \
-    to_tbcd_binary, to_twos_comp, from_twos_comp
+    to_tbcd_binary, to_twos_comp, from_twos_comp, to_integer, int_struct, \
+    tbcd_length, slice_tbcd
+
+# Fixed seed keeps failures of the randomized equivalence tests reproducible.
+RANDOM = random.Random(20140807)
+
+
+def legacy_to_tbcd_value(binary):
+    bin_str, value = to_binary_string_of_length(len(to_hex(binary)) *
+                                                4, binary), ""
+    for index in range(2, len(bin_str), 8):
+        if int(bin_str[index:index + 4], 2) == 15:
+            return value + str(int(bin_str[index + 4: index + 8], 2))
+        value += "%s%s" % (int(bin_str[index + 4:index + 8], 2),
+                           int(bin_str[index: index + 4], 2))
+    return value
+
+
+def legacy_to_tbcd_binary(tbcd_string):
+    value, index = "0b", 0
+    while index <= len(tbcd_string) - 2:
+        value += to_bin_str_from_int_string(4, tbcd_string[index + 1]) +\
+            to_bin_str_from_int_string(4, tbcd_string[index])
+        index += 2
+    return to_bin(value if index == len(tbcd_string)
+                  else value + to_bin_str_from_int_string(4, 15) +
+                  to_bin_str_from_int_string(4, tbcd_string[index]))
+
+
+def random_digits(length):
+    return ''.join(RANDOM.choice('0123456789') for _ in range(length))
 
 
 class TestBinaryConversions(TestCase):
@@ -86,6 +118,42 @@ class TestBinaryConversions(TestCase):
         self.assertEquals(to_bin('0b0010000111110011'), to_tbcd_binary('123'))
         self.assertEquals(to_bin('0b0110001000010010000000100000000000000000000000000000000011110001'), to_tbcd_binary('262120000000001'))
 
+    def test_to_tbcd_value_matches_legacy_implementation(self):
+        for byte in range(256):
+            self.assertEquals(to_tbcd_value(chr(byte)), legacy_to_tbcd_value(chr(byte)))
+        for length in range(1, 20):
+            binary = ''.join(chr(RANDOM.randint(0, 255)) for _ in range(length))
+            self.assertEquals(to_tbcd_value(binary), legacy_to_tbcd_value(binary))
+
+    def test_to_tbcd_binary_matches_legacy_implementation(self):
+        for length in range(1, 20):
+            digits = RANDOM.choice('123456789') + random_digits(length - 1)
+            self.assertEquals(to_tbcd_binary(digits), legacy_to_tbcd_binary(digits))
+            self.assertEquals(to_tbcd_value(to_tbcd_binary(digits)), digits)
+
+    def test_to_tbcd_binary_keeps_leading_zeros(self):
+        self.assertEquals(to_tbcd_binary('0010'), '\x00\x01')
+        self.assertEquals(to_tbcd_value(to_tbcd_binary('0010')), '0010')
+
+    def test_to_tbcd_binary_with_illegal_digits(self):
+        self.assertRaises(ValueError, to_tbcd_binary, '12a4')
+
+    def test_tbcd_length(self):
+        self.assertEquals(tbcd_length(to_tbcd_binary('1234')), 4)
+        self.assertEquals(tbcd_length(to_tbcd_binary('123')), 3)
+        self.assertEquals(tbcd_length(to_tbcd_binary('123') + '\x21'), 3)
+
+    def test_slice_tbcd_matches_decoding_digits(self):
+        for _ in range(20):
+            digits = RANDOM.choice('123456789') + random_digits(RANDOM.randint(0, 20))
+            binary = to_tbcd_binary(digits)
+            start = RANDOM.randint(0, len(digits) - 1)
+            length = RANDOM.randint(1, len(digits) - start)
+            self.assertEquals(slice_tbcd(binary, start, length),
+                              to_tbcd_binary(digits[start:start + length]))
+            self.assertEquals(to_tbcd_value(slice_tbcd(binary, start, length)),
+                              digits[start:start + length])
+
     def test_to_bin_str_from_int_string(self):
         self.assertEquals('00000001', to_bin_str_from_int_string(8, '1'))
         self.assertEquals('00000010', to_bin_str_from_int_string(8, '2'))
@@ -109,5 +177,25 @@ class TestBinaryConversions(TestCase):
         self.assertEquals(-21, from_twos_comp(65515, 16))
         self.assertEquals(-46, from_twos_comp(65490, 16))
 
+    def test_to_integer(self):
+        self.assertEquals(to_integer(5), 5)
+        self.assertEquals(to_integer('5'), 5)
+        self.assertEquals(to_integer('-72'), -72)
+        self.assertEquals(to_integer('-0x48'), -72)
+        self.assertEquals(to_integer('0xcafe'), 0xcafe)
+        self.assertEquals(to_integer('0xca 0xfe'), 0xcafe)
+        self.assertEquals(to_integer('0b1111 1111'), 255)
+        self.assertEquals(to_integer('0b01 0b01 0b01'), 0x15)
+        self.assertRaises(ValueError, to_integer, 'foo')
+
+    def test_int_struct(self):
+        self.assertEquals(int_struct(2).pack(258), '\x01\x02')
+        self.assertEquals(int_struct(2, little_endian=True).pack(258), '\x02\x01')
+        self.assertEquals(int_struct(1, signed=True).pack(-1), '\xff')
+        self.assertEquals(int_struct(8).size, 8)
+        self.assertTrue(int_struct(4) is int_struct(4))
+        self.assertTrue(copy.deepcopy(int_struct(4)) is int_struct(4))
+        self.assertEquals(int_struct(3), None)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+from unittest import TestCase, main
+from threading import Event, Lock, Timer
+import time
+
+from Rammbock.executor import HandlerExecutor
+
+
+class TestHandlerExecutor(TestCase):
+
+    def setUp(self):
+        self.executor = HandlerExecutor()
+        self.calls = []
+
+    def tearDown(self):
+        self.executor.configure(0)
+
+    def _record(self, value, wait_for=None):
+        def handler():
+            if wait_for:
+                wait_for.wait(2)
+            self.calls.append(value)
+        return handler
+
+    def _wait_for_calls(self, count):
+        cutoff = time.time() + 2
+        while len(self.calls) < count and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertEquals(len(self.calls), count)
+
+    def test_handlers_run_inline_without_workers(self):
+        self.executor.submit('a', self._record(1))
+        self.assertEquals(self.calls, [1])
+        self.assertRaises(ZeroDivisionError, self.executor.submit, 'a', lambda: 1 / 0)
+        statistics = self.executor.get_statistics()
+        self.assertEquals((statistics['handled'], statistics['failed'], statistics['workers']), (1, 1, 0))
+
+    def test_handlers_of_one_key_run_in_order(self):
+        self.executor.configure(4)
+        for index in range(100):
+            self.executor.submit('a', self._record(index))
+        self._wait_for_calls(100)
+        self.assertEquals(self.calls, range(100))
+
+    def test_handlers_of_different_keys_run_in_parallel(self):
+        self.executor.configure(2)
+        release = Event()
+        self.executor.submit('a', self._record('a', release))
+        self.executor.submit('b', self._record('b'))
+        self._wait_for_calls(1)
+        self.assertEquals(self.calls, ['b'])
+        release.set()
+        self._wait_for_calls(2)
+
+    def test_messages_to_full_queue_are_rejected(self):
+        self.executor.configure(1, queue_size=1)
+        release = Event()
+        self.executor.submit('a', self._record(1, release))
+        time.sleep(0.05)
+        self.executor.submit('a', self._record(2))
+        self.executor.submit('b', self._record(3))
+        statistics = self.executor.get_statistics()
+        self.assertEquals((statistics['queued'], statistics['rejected']), (1, 1))
+        release.set()
+        self._wait_for_calls(2)
+        self.assertEquals(self.calls, [1, 2])
+        self.assertEquals(self.executor.get_statistics()['max_queued'], 1)
+
+    def test_failures_in_workers_are_counted(self):
+        self.executor.configure(1)
+        self.executor.submit('a', lambda: 1 / 0)
+        self.executor.submit('a', self._record(1))
+        self._wait_for_calls(1)
+        self.assertEquals(self.executor.get_statistics()['failed'], 1)
+
+    def test_queued_handlers_are_run_before_removing_workers(self):
+        self.executor.configure(1)
+        release = Event()
+        self.executor.submit('a', self._record(1, release))
+        self.executor.submit('a', self._record(2))
+        Timer(0.05, release.set).start()
+        self.executor.configure(0)
+        self.assertEquals(self.calls, [1, 2])
+        self.executor.submit('a', self._record(3))
+        self.assertEquals(self.calls, [1, 2, 3])
+
+    def test_inline_lock_is_held_only_without_workers(self):
+        lock = Lock()
+
+        def record_lock_state():
+            acquired = lock.acquire(False)
+            if acquired:
+                lock.release()
+            self.calls.append(not acquired)
+        self.executor.submit('a', record_lock_state, inline_lock=lock)
+        self.executor.configure(1)
+        self.executor.submit('a', record_lock_state, inline_lock=lock)
+        self._wait_for_calls(2)
+        self.assertEquals(self.calls, [True, False])
+
+    def test_invalid_configuration(self):
+        self.assertRaises(AssertionError, self.executor.configure, -1)
+        self.assertRaises(AssertionError, self.executor.configure, 1, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from unittest import TestCase, main
-from Rammbock.message import Struct, Field, BinaryContainer, BinaryField
+from Rammbock.message import Struct, Field, BinaryContainer, BinaryField, Union, Message
 from Rammbock.binary_tools import to_bin
 
 
@@ -34,6 +34,23 @@ class TestMessages(TestCase):
         self.assertEquals(field.chars, 'ab')
         self.assertEquals(field.bin, '0b00000000' + '01100001' + '01100010' + '00000000')
 
+    def test_long_value_conversions(self):
+        field = Field('uint', 'name', to_bin('0x0102030405060708090a'))
+        self.assertEquals(field.int, 0x0102030405060708090a)
+        self.assertEquals(field.hex, '0x0102030405060708090a')
+
+    def test_ascii_filters_non_printable_characters(self):
+        field = Field('chars', 'name', '\x00foo\x80\x1fbar\xff')
+        self.assertEquals(field.ascii, 'foobar')
+        self.assertEquals(Field('chars', 'name', u'f\x00oo').ascii, 'foo')
+
+    def test_views_are_cached(self):
+        field = Field('uint', 'name', to_bin('0x0100'), little_endian=True)
+        self.assertEquals(field.int, 1)
+        self.assertTrue(field.bytes is field.bytes)
+        self.assertTrue(field.hex is field.hex)
+        self.assertEquals(field.__dict__['int'], 1)
+
     def test_not_iterable(self):
         msg = Struct('foo', 'foo_type')
         msg['a'] = uint_field()
@@ -124,5 +141,39 @@ class TestLittleEndian(TestCase):
         self.assertEquals(field.hex, '0x0001')
 
 
+class TestRawBytes(TestCase):
+
+    def test_nested_aligned_structs(self):
+        inner = Struct('inner', 'Inner', align=4)
+        inner['a'] = Field('uint', 'a', to_bin('0x01'), aligned_len=2)
+        outer = Struct('outer', 'Outer', align=8)
+        outer['inner'] = inner
+        outer['b'] = uint_field('0x02')
+        union = Union('union', 3)
+        union['c'] = uint_field('0x03')
+        outer['union'] = union
+        self.assertEquals(outer._raw, to_bin('0x01000000 02 030000'))
+        self.assertEquals(len(outer._raw), len(outer))
+
+    def test_message_raw_bytes_are_reset_when_changed(self):
+        msg = Message('msg')
+        msg['a'] = uint_field('0x01')
+        msg._set_raw_bytes(bytearray(to_bin('0xcafe')))
+        self.assertEquals(msg._raw, to_bin('0xcafe'))
+        msg['b'] = uint_field('0x02')
+        self.assertEquals(msg._raw, to_bin('0x0102'))
+
+    def test_message_raw_bytes_are_reset_when_nested_element_changes(self):
+        msg = Message('msg')
+        inner = Struct('inner', 'Inner')
+        inner['a'] = uint_field('0x01')
+        msg['inner'] = inner
+        msg._set_raw_bytes(bytearray(msg._raw))
+        inner['b'] = uint_field('0x02')
+        self.assertEquals(msg._raw, to_bin('0x0102'))
+        del inner['a']
+        self.assertEquals(msg._raw, to_bin('0x02'))
+
+
 if __name__ == "__main__":
     main()
@@ -1,12 +1,19 @@
 from contextlib import contextmanager
 from unittest import TestCase, main
+import errno
+import os
+import resource
 import time
 import socket
-from threading import Timer, Semaphore
-from Rammbock.networking import UDPServer, TCPServer, UDPClient, TCPClient, BufferedStream
-from Rammbock.templates.containers import Protocol
+from threading import Timer, Thread
+from Rammbock.networking import (UDPServer, UDPSessionServer, TCPServer, UDPClient, TCPClient, BufferedStream,
+                                 AsyncUDPServer, AsyncTCPServer, AsyncUDPClient, AsyncTCPClient,
+                                 QUEUED_STREAM_BUFFER_SIZE, _QueuedStream)
+from Rammbock.templates.containers import Protocol, MessageTemplate
 from Rammbock.templates.primitives import UInt, PDU
-from Rammbock import synchronization
+from Rammbock import networking
+from Rammbock.reactor import REACTOR, get_poller
+from Rammbock.executor import EXECUTOR
 
 
 LOCAL_IP = '127.0.0.1'
@@ -15,6 +22,12 @@ CONNECTION_ALIAS = "Connection alias"
 ports = {'SERVER_PORT': 12345,
          'CLIENT_PORT': 54321}
 
+HANDLED_MESSAGES = []
+
+
+def record_handled_message(library, msg):
+    HANDLED_MESSAGES.append((time.time(), msg))
+
 
 class _NetworkingTests(TestCase):
 
@@ -149,15 +162,6 @@ class TestNetworking(_NetworkingTests):
         server, _ = self._udp_server_and_client(ports['SERVER_PORT'], ports['CLIENT_PORT'], timeout=0.1)
         self._assert_timeout(server)
 
-    @contextmanager
-    def _without_sync(self):
-        original_LOCK = synchronization.LOCK
-        try:
-            synchronization.LOCK = Semaphore(100)
-            yield
-        finally:
-            synchronization.LOCK = original_LOCK
-
     @contextmanager
     def _client_and_server(self, port):
         server = TCPServer(LOCAL_IP, port)
@@ -169,22 +173,19 @@ class TestNetworking(_NetworkingTests):
             client.close()
 
     def test_connection_timeout(self):
-        with self._without_sync():
-            with self._client_and_server(ports['SERVER_PORT']) as (client, server):
-                timer_obj = Timer(0.1, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
-                timer_obj.start()
-                server.accept_connection(timeout="0.5")
+        with self._client_and_server(ports['SERVER_PORT']) as (client, server):
+            timer_obj = Timer(0.1, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
+            timer_obj.start()
+            server.accept_connection(timeout="0.5")
 
     def test_connection_timeout_failure(self):
-        with self._without_sync():
-            with self._client_and_server(ports['SERVER_PORT']) as (client, server):
-                timer_obj = Timer(0.2, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
-                timer_obj.start()
-                self.assertRaises(socket.timeout, server.accept_connection, timeout=0.1)
-                timer_obj.cancel()
-
-    # FIXME: this deadlocks
-    def xtest_blocking_timeout(self):
+        with self._client_and_server(ports['SERVER_PORT']) as (client, server):
+            timer_obj = Timer(0.2, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
+            timer_obj.start()
+            self.assertRaises(socket.timeout, server.accept_connection, timeout=0.1)
+            timer_obj.cancel()
+
+    def test_blocking_timeout(self):
         server, client = self._udp_server_and_client(ports['SERVER_PORT'], ports['CLIENT_PORT'], timeout=0.1)
         t = Timer(0.2, client.send, args=['foofaa'])
         t.start()
@@ -200,6 +201,499 @@ class TestNetworking(_NetworkingTests):
         self._verify_emptying(server, client)
 
 
+class TestAutoAccept(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2, backlog=50, auto_accept=True)
+        self.sockets.append(self.server)
+
+    def _connect_clients(self, count):
+        for _ in range(count):
+            client = TCPClient()
+            client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+            self.sockets.append(client)
+        return client
+
+    def test_connections_are_accepted_on_background(self):
+        self._connect_clients(30)
+        self.assertEquals(self.server.wait_for_connections(30), 30)
+        self.assertEquals(sorted(connection.name for connection in self.server._get_connections()),
+                          sorted('connection%d' % index for index in range(1, 31)))
+
+    def test_messages_are_received_from_accepted_connection(self):
+        client = self._connect_clients(1)
+        self.server.wait_for_connections(1)
+        client.send('foofaa')
+        self.assertEquals(self.server.receive(alias='connection1'), 'foofaa')
+        self.server.send('bar')
+        self.assertEquals(client.receive(), 'bar')
+
+    def test_waiting_for_connections_times_out(self):
+        self._connect_clients(1)
+        self.assertRaises(AssertionError, self.server.wait_for_connections, 2, timeout=0.1)
+
+    def test_accepting_manually_is_not_allowed(self):
+        self.assertRaises(AssertionError, self.server.accept_connection)
+
+    def test_closed_server_is_unregistered(self):
+        self.server.close()
+        cutoff = time.time() + 2
+        while self.server in REACTOR._streams and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertFalse(self.server in REACTOR._streams)
+
+
+class AcceptFailingSocket(object):
+    """Listening socket whose accept fails with the given errors first."""
+
+    def __init__(self, sock, errors):
+        self._sock = sock
+        self._errors = list(errors)
+
+    def accept(self):
+        if self._errors:
+            error = self._errors.pop(0)
+            raise socket.error(error, os.strerror(error))
+        return self._sock.accept()
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class TestAcceptErrors(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2)
+        self.server._socket.setblocking(0)
+        self.sockets.append(self.server)
+
+    def _connect_client(self):
+        client = TCPClient()
+        client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.append(client)
+
+    def _fail_accepting_with(self, *errors):
+        self.server._socket = AcceptFailingSocket(self.server._socket, errors)
+
+    def test_connections_reset_before_accepting_are_skipped(self):
+        self._connect_client()
+        self._fail_accepting_with(errno.ECONNABORTED, errno.EPROTO)
+        self.assertTrue(self.server.handle_readable())
+        self.assertEquals(self.server.wait_for_connections(1, timeout=0), 1)
+
+    def test_server_stays_registered_when_out_of_file_descriptors(self):
+        self._connect_client()
+        self._fail_accepting_with(errno.EMFILE)
+        self.assertTrue(self.server.handle_readable())
+        self.assertEquals(len(self.server._get_connections()), 0)
+        self.assertTrue(self.server.handle_readable())
+        self.assertEquals(self.server.wait_for_connections(1, timeout=0), 1)
+
+    def test_closed_server_is_unregistered(self):
+        self._fail_accepting_with(errno.EBADF)
+        self.server.close()
+        self.assertFalse(self.server.handle_readable())
+
+
+class TestReceiveFromAnyConnection(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length-2'))
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], protocol=protocol, auto_accept=True)
+        self.clients = [TCPClient(protocol=protocol) for _ in range(5)]
+        for client in self.clients:
+            client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.extend(self.clients + [self.server])
+        self.server.wait_for_connections(len(self.clients), timeout=2)
+        self.template = MessageTemplate('Message', protocol, {'id': '1'})
+        self.template.add(UInt(1, 'value', None))
+
+    def _get_message(self, timeout=2, header_filter='id'):
+        return self.server.get_message(self.template, timeout=timeout, header_filter=header_filter, any_connection='True')
+
+    def test_message_is_received_from_any_connection(self):
+        start = time.time()
+        Timer(0.05, self.clients[3].send, ['\x01\x03\x07']).start()
+        msg = self._get_message()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEquals(msg.value.int, 7)
+
+    def test_connection_of_message_becomes_current(self):
+        self.clients[2].send('\x01\x03\x07')
+        self._get_message()
+        self.assertEquals(self.server.get_current_connection(), 'connection3')
+        self.server.send('\x01\x03\x08')
+        self.assertEquals(self.clients[2].receive(timeout=1), '\x01\x03\x08')
+
+    def test_messages_of_all_connections_are_received(self):
+        for index, client in enumerate(self.clients):
+            client.send('\x02\x03\x00\x01\x03' + chr(index))
+        values = sorted(self._get_message().value.int for _ in self.clients)
+        self.assertEquals(values, range(len(self.clients)))
+        self.assertRaises(AssertionError, self._get_message, timeout=0.1)
+
+    def test_not_matching_messages_are_cached(self):
+        self.clients[0].send('\x02\x03\x05')
+        self.assertRaises(AssertionError, self._get_message, timeout=0.1)
+        self.assertEquals(self.server._get_connection('connection1').get_messages_count_in_buffer(), 1)
+
+    def test_any_connection_is_not_supported_on_other_nodes(self):
+        self.clients[0].send('\x01\x03\x07')
+        self.server.wait_for_connections(len(self.clients))
+        connection = self.server._get_connection('connection1')
+        for node in (self.clients[0], connection):
+            try:
+                node.get_message(self.template, timeout=0.1, any_connection='True')
+            except AssertionError, e:
+                self.assertEquals(e.args[0], 'any_connection is only supported on stream servers')
+            else:
+                self.fail('AssertionError not raised')
+        self.assertEquals(connection.get_message(self.template, timeout=1, any_connection='False').value.int, 7)
+
+    def test_one_poller_is_used_for_whole_receive_and_closed(self):
+        pollers = []
+
+        def get_recording_poller():
+            poller = get_poller()
+            poller.closed = False
+            close = poller.close
+
+            def recording_close():
+                poller.closed = True
+                close()
+            poller.close = recording_close
+            pollers.append(poller)
+            return poller
+        networking.get_poller = get_recording_poller
+        try:
+            self.assertRaises(AssertionError, self._get_message, timeout=0.35)
+        finally:
+            networking.get_poller = get_poller
+        self.assertEquals([poller.closed for poller in pollers], [True])
+
+
+class TestUDPSessions(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        del HANDLED_MESSAGES[:]
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length-2'))
+        self.server = UDPSessionServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2, protocol=protocol)
+        self.clients = [UDPClient(timeout=2, protocol=protocol) for _ in range(3)]
+        for client in self.clients:
+            client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.extend(self.clients + [self.server])
+        self.template = MessageTemplate('Message', protocol, {'id': '1'})
+        self.template.add(UInt(1, 'value', None))
+
+    def _session_name(self, client):
+        return '%s:%d' % client.get_own_address()
+
+    def _send_from_all_clients(self, msg):
+        for client in self.clients:
+            client.send(msg)
+        self.server.wait_for_connections(len(self.clients))
+
+    def test_datagrams_are_received_from_session_of_peer(self):
+        for index, client in enumerate(self.clients):
+            client.send('foo%d' % index)
+        self.assertEquals(self.server.wait_for_connections(3), 3)
+        self.assertEquals(self.server.receive(alias=self._session_name(self.clients[2])), 'foo2')
+        self.assertEquals(self.server.receive(alias=self._session_name(self.clients[0])), 'foo0')
+        self.assertRaises(socket.timeout, self.server.receive, timeout=0.1, alias=self._session_name(self.clients[0]))
+
+    def test_messages_are_received_from_session_of_peer(self):
+        for index, client in enumerate(self.clients):
+            client.send('\x01\x03' + chr(index))
+        self.server.wait_for_connections(3)
+        msg = self.server.get_message(self.template, alias=self._session_name(self.clients[1]))
+        self.assertEquals(msg.value.int, 1)
+        self.assertEquals(self.server.get_messages_count_in_buffer(), 2)
+
+    def test_reply_is_sent_to_peer_of_received_message(self):
+        self.clients[1].send('\x01\x03\x07')
+        self.assertEquals(self.server.get_message(self.template).value.int, 7)
+        self.assertEquals(self.server.get_current_connection(), self._session_name(self.clients[1]))
+        self.server.send('\x01\x03\x08')
+        self.assertEquals(self.clients[1].receive(), '\x01\x03\x08')
+        self.assertEquals(self.server.get_peer_address(), self.clients[1].get_own_address())
+
+    def test_messages_of_all_peers_are_received(self):
+        self._send_from_all_clients('\x01\x03\x05')
+        for _ in self.clients:
+            self.server.get_message(self.template)
+        self.assertRaises(AssertionError, self.server.get_message, self.template, timeout=0.1)
+
+    def test_sending_to_address_creates_session(self):
+        self.server.send_to('\x01\x03\x05', *self.clients[0].get_own_address())
+        self.assertEquals(self.clients[0].receive(), '\x01\x03\x05')
+        self.server.send('\x01\x03\x06', alias=self._session_name(self.clients[0]))
+        self.assertEquals(self.clients[0].receive(), '\x01\x03\x06')
+
+    def test_unknown_session(self):
+        self.assertRaises(AssertionError, self.server.send, 'foo')
+        self.assertRaises(AssertionError, self.server.send, 'foo', alias='%s:1' % LOCAL_IP)
+        self.assertRaises(AssertionError, self.server.send, 'foo', alias='connection1')
+
+    def test_handler_is_used_for_all_sessions(self):
+        self.clients[0].send('\x01\x03\x05')
+        self.server.wait_for_connections(1)
+        self.server.set_handler(self.template, 'test_networking.record_handled_message', 'id')
+        self.clients[1].send('\x01\x03\x06')
+        self.clients[2].send('\x01\x03\x07')
+        cutoff = time.time() + 2
+        while len(HANDLED_MESSAGES) < 3 and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertEquals(sorted(msg.value.int for _, msg in HANDLED_MESSAGES), [5, 6, 7])
+
+    def test_idle_sessions_are_closed(self):
+        self.server.close()
+        self.server = UDPSessionServer(LOCAL_IP, ports['SERVER_PORT'], idle_timeout=0.1)
+        self.sockets.append(self.server)
+        self.clients[0].send('foo')
+        self.server.wait_for_connections(1)
+        time.sleep(0.2)
+        self.clients[1].send('bar')
+        expected = [self._session_name(self.clients[1])]
+        cutoff = time.time() + 2
+        while [session.name for session in self.server._get_sessions()] != expected and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertEquals([session.name for session in self.server._get_sessions()], expected)
+        self.assertRaises(AssertionError, self.server.receive, alias=self._session_name(self.clients[0]))
+
+    def test_closed_server_is_unregistered(self):
+        self.server.close()
+        cutoff = time.time() + 2
+        while self.server in REACTOR._streams and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertFalse(self.server in REACTOR._streams)
+
+    def test_stream_buffers_of_sessions_grow_only_for_received_data(self):
+        self._send_from_all_clients('\x01\x03\x05')
+        self.clients[0].send('\x02\xff' + 'x' * 253)
+        for _ in self.clients:
+            self.server.get_message(self.template, header_filter='id')
+        sizes = [len(session._message_stream._stream._data) for session in self.server._get_sessions()]
+        self.assertTrue(max(sizes) <= QUEUED_STREAM_BUFFER_SIZE, sizes)
+        self.clients[1].send('\x02\xff' + 'x' * 253)
+        self.clients[1].send('\x01\x03\x07')
+        self.assertEquals(self.server.get_message(self.template, header_filter='id', timeout=1,
+                                                  alias=self._session_name(self.clients[1])).value.int, 7)
+
+    def _queue_datagrams(self, cache_policy, count):
+        self.server.close()
+        self.server = UDPSessionServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2, cache_size=2,
+                                       cache_policy=cache_policy)
+        self.sockets.append(self.server)
+        for index in range(count):
+            self.clients[0].send('foo%d' % index)
+        cutoff = time.time() + 2
+        while self.server._arrivals < count and time.time() < cutoff:
+            time.sleep(0.001)
+        return self._session_name(self.clients[0])
+
+    def test_datagram_queue_drops_oldest_datagrams_when_full(self):
+        session = self._queue_datagrams('drop-oldest', 5)
+        self.assertEquals([self.server.receive(alias=session) for _ in range(2)], ['foo3', 'foo4'])
+        self.assertEquals(self.server.get_evicted_messages_counts(), {'*': 3})
+
+    def test_datagram_queue_drops_newest_datagrams_when_full(self):
+        session = self._queue_datagrams('drop-newest', 5)
+        self.assertEquals([self.server.receive(alias=session) for _ in range(2)], ['foo0', 'foo1'])
+        self.assertRaises(socket.timeout, self.server.receive, timeout=0.1, alias=session)
+
+    def test_full_datagram_queue_fails_receiving_until_emptied(self):
+        session = self._queue_datagrams('fail', 3)
+        self.assertRaises(AssertionError, self.server.receive, alias=session)
+        self.server.empty()
+        self.clients[0].send('bar')
+        self.assertEquals(self.server.receive(alias=session), 'bar')
+
+
+class TestAsyncTransport(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        del HANDLED_MESSAGES[:]
+        self.protocol = Protocol('Test')
+        self.protocol.add(UInt(1, 'id', None))
+        self.protocol.add(UInt(1, 'length', None))
+        self.protocol.add(PDU('length-2'))
+        self.template = MessageTemplate('Message', self.protocol, {'id': '1'})
+        self.template.add(UInt(1, 'value', None))
+
+    def _udp_server_and_clients(self, count, protocol=None):
+        server = AsyncUDPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2, protocol=protocol)
+        clients = [AsyncUDPClient(timeout=2, protocol=protocol) for _ in range(count)]
+        for client in clients:
+            client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.extend(clients + [server])
+        return server, clients
+
+    def _tcp_server_and_clients(self, count, protocol=None):
+        server = AsyncTCPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2, protocol=protocol, backlog=count,
+                                auto_accept=True)
+        clients = [AsyncTCPClient(timeout=2, protocol=protocol) for _ in range(count)]
+        for client in clients:
+            client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.extend(clients + [server])
+        server.wait_for_connections(count)
+        return server, clients
+
+    def test_send_and_receive_udp(self):
+        server, clients = self._udp_server_and_clients(2)
+        clients[1].send('foofaa')
+        self._assert_receive(server, 'foofaa')
+        server.send('reply')
+        self._assert_receive(clients[1], 'reply')
+        self.assertEquals(server.get_peer_address(), clients[1].get_own_address())
+
+    def test_send_and_receive_tcp(self):
+        server, clients = self._tcp_server_and_clients(1)
+        clients[0].send(u'foofaa')
+        self._assert_receive(server, 'foofaa')
+        server.send('reply')
+        self._assert_receive(clients[0], 'reply')
+
+    def test_stream_data_longer_than_buffer_is_kept(self):
+        server, clients = self._tcp_server_and_clients(1)
+        clients[0].send('foofaa')
+        received = bytearray(4)
+        self.assertEquals(server._get_connection().receive_into(received), 4)
+        self.assertEquals(str(received), 'foof')
+        self._assert_receive(server, 'aa')
+
+    def test_large_data_is_sent_and_received(self):
+        server, clients = self._tcp_server_and_clients(1)
+        data = 'x' * 5000000
+        sender = Thread(target=server.send, args=[data])
+        sender.start()
+        received = []
+        while sum(len(chunk) for chunk in received) < len(data):
+            received.append(clients[0].receive())
+        sender.join()
+        self.assertEquals(''.join(received), data)
+
+    def test_receiving_times_out(self):
+        server, clients = self._udp_server_and_clients(1)
+        self._assert_timeout(server, 0.1)
+        self._assert_timeout(clients[0], 0.1)
+
+    def test_messages_are_decoded_from_received_data(self):
+        server, clients = self._udp_server_and_clients(3, self.protocol)
+        for index, client in enumerate(clients):
+            client.send('\x01\x03' + chr(index))
+        values = sorted(server.get_message(self.template, header_filter='id').value.int for _ in clients)
+        self.assertEquals(values, [0, 1, 2])
+        server.send('\x01\x03\x07')
+        self.assertEquals(clients[values[-1]].get_message(self.template).value.int, 7)
+
+    def test_message_is_received_from_any_connection_when_it_arrives(self):
+        server, clients = self._tcp_server_and_clients(5, self.protocol)
+        start = time.time()
+        Timer(0.05, clients[3].send, ['\x01\x03\x07']).start()
+        msg = server.get_message(self.template, timeout=2, header_filter='id', any_connection='True')
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEquals(msg.value.int, 7)
+        server.send('\x01\x03\x08')
+        self.assertEquals(clients[3].get_message(self.template).value.int, 8)
+
+    def test_handlers_of_many_connections_are_called(self):
+        server, clients = self._tcp_server_and_clients(50, self.protocol)
+        for connection in server._get_connections():
+            connection.set_handler(self.template, 'test_networking.record_handled_message', 'id')
+        for index, client in enumerate(clients):
+            client.send('\x01\x03' + chr(index))
+        cutoff = time.time() + 2
+        while len(HANDLED_MESSAGES) < len(clients) and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertEquals(sorted(msg.value.int for _, msg in HANDLED_MESSAGES), range(len(clients)))
+
+    def test_connection_closed_by_peer_is_unregistered(self):
+        server, clients = self._tcp_server_and_clients(1, self.protocol)
+        connection = server._get_connection()
+        connection.set_handler(self.template, 'test_networking.record_handled_message', 'id')
+        clients[0].close()
+        cutoff = time.time() + 2
+        while (connection in REACTOR._streams or connection._message_stream in REACTOR._streams) \
+                and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertFalse(connection in REACTOR._streams)
+        self.assertFalse(connection._message_stream in REACTOR._streams)
+        self.assertTrue(connection.is_closed_by_peer())
+        self.assertEquals(connection.receive(), '')
+
+    def test_closing_wakes_up_receiver(self):
+        server, clients = self._udp_server_and_clients(1)
+        Timer(0.05, server.close).start()
+        start = time.time()
+        self.assertRaises(socket.error, server.receive)
+        self.assertTrue(time.time() - start < 1)
+        self.assertFalse(server in REACTOR._streams)
+
+
+class TestHighFileDescriptors(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        del HANDLED_MESSAGES[:]
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1200:
+            self.skipTest('File descriptor limit %d is too low.' % hard)
+        if soft != resource.RLIM_INFINITY and soft < 1200:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (1200, hard))
+        # Sockets get the lowest free file descriptors, so low ones are used up.
+        self.fillers = [os.open(os.devnull, os.O_RDONLY)]
+        while self.fillers[-1] < 1100:
+            self.fillers.append(os.dup(self.fillers[0]))
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length-2'))
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=2, protocol=protocol)
+        self.client = TCPClient(timeout=2, protocol=protocol)
+        self.client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.server.accept_connection()
+        self.sockets.extend([self.client, self.server])
+        self.template = MessageTemplate('Message', protocol, {'id': '1'})
+        self.template.add(UInt(1, 'value', None))
+
+    def tearDown(self):
+        _NetworkingTests.tearDown(self)
+        for fd in getattr(self, 'fillers', []):
+            os.close(fd)
+
+    def test_message_is_received_when_it_arrives(self):
+        self.assertTrue(self.client.fileno() > 1024)
+        Timer(0.05, self.server.send, ['\x01\x03\x07']).start()
+        self.assertEquals(self.client.get_message(self.template, timeout=1).value.int, 7)
+
+    def test_handler_is_run_on_background(self):
+        self.client.set_handler(self.template, 'test_networking.record_handled_message', 'id')
+        self.server.send('\x01\x03\x07')
+        cutoff = time.time() + 2
+        while not HANDLED_MESSAGES and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertEquals([msg.value.int for _, msg in HANDLED_MESSAGES], [7])
+
+    def test_closing_by_peer_is_noticed(self):
+        self.assertFalse(self.client.is_closed_by_peer())
+        self.server.close()
+        cutoff = time.time() + 2
+        while not self.client.is_closed_by_peer() and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertTrue(self.client.is_closed_by_peer())
+
+
 class TestGetEndPoints(_NetworkingTests):
 
     def test_get_udp_endpoints(self):
@@ -228,6 +722,130 @@ def _get_template():
     return protocol
 
 
+class TestBackgroundHandlers(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        del HANDLED_MESSAGES[:]
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length-2'))
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], protocol=protocol)
+        self.client = TCPClient(protocol=protocol)
+        self.client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.server.accept_connection()
+        self.sockets.extend([self.client, self.server])
+        self.handled = MessageTemplate('Handled', protocol, {'id': '0x01'})
+        self.received = MessageTemplate('Received', protocol, {'id': '0x02'})
+        self.client.set_handler(self.handled, 'test_networking.record_handled_message', 'id')
+
+    def _wait_for_handled_messages(self, count):
+        cutoff = time.time() + 2
+        while len(HANDLED_MESSAGES) < count and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertEquals(len(HANDLED_MESSAGES), count)
+
+    def test_handler_is_called_when_message_arrives(self):
+        sent = time.time()
+        self.server.send('\x01\x02')
+        self._wait_for_handled_messages(1)
+        self.assertTrue(HANDLED_MESSAGES[0][0] - sent < 0.2)
+
+    def test_handler_is_called_for_message_left_in_buffer(self):
+        with self.client._lock:
+            self.server.send('\x02\x02\x01\x02')
+            time.sleep(0.05)
+            self.client.get_message(self.received, header_filter='id')
+            self.assertEquals(HANDLED_MESSAGES, [])
+        self._wait_for_handled_messages(1)
+
+    def test_handler_is_called_by_worker(self):
+        EXECUTOR.configure(workers=2)
+        try:
+            self.server.send('\x01\x02\x01\x02')
+            self._wait_for_handled_messages(2)
+            self.assertEquals(EXECUTOR.get_statistics()['workers'], 2)
+        finally:
+            EXECUTOR.configure(workers=0)
+
+    def test_handlers_stop_when_peer_closes_connection(self):
+        stream = self.client._message_stream
+        self.server.close()
+        time.sleep(0.1)
+        self.assertFalse(stream in REACTOR._streams)
+
+
+class TestConcurrentReceivers(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length-2'))
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], protocol=protocol)
+        self.client = TCPClient(protocol=protocol)
+        self.client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.server.accept_connection()
+        self.sockets.extend([self.client, self.server])
+        self.templates = [MessageTemplate('Message%d' % index, protocol, {'id': str(index)})
+                          for index in range(3)]
+        for template in self.templates:
+            template.add(UInt(1, 'value', None))
+        self.received = {}
+
+    def _receive_on_background(self, index, timeout=2):
+        def receive():
+            msg = self.client.get_message(self.templates[index], timeout=timeout, header_filter='id')
+            self.received[index] = (time.time(), msg)
+        thread = Thread(target=receive)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_receivers_get_their_own_messages(self):
+        threads = [self._receive_on_background(index) for index in range(3)]
+        time.sleep(0.05)
+        self.server.send('\x02\x03\x02\x00\x03\x00\x01\x03\x01')
+        for thread in threads:
+            thread.join(2)
+        self.assertEquals([self.received[index][1].value.int for index in range(3)], [0, 1, 2])
+
+    def test_waiting_receiver_does_not_block_other_keywords(self):
+        thread = self._receive_on_background(1)
+        time.sleep(0.05)
+        start = time.time()
+        self.server.send('\x01\x03\x01')
+        self.assertTrue(time.time() - start < 0.5)
+        thread.join(2)
+        self.assertTrue(1 in self.received)
+
+    def test_unread_messages_are_counted_without_waiting(self):
+        self.server.send('\x01\x03\x01\x02\x03\x02')
+        time.sleep(0.05)
+        for _ in range(2):
+            start = time.time()
+            self.assertEquals(self.client.get_messages_count_in_buffer(), 2)
+            self.assertTrue(time.time() - start < 0.05)
+
+    def test_latest_message_is_received_without_waiting(self):
+        self.server.send('\x01\x03\x01\x01\x03\x02')
+        time.sleep(0.05)
+        start = time.time()
+        msg = self.client.get_message(self.templates[1], header_filter='id', latest=True)
+        self.assertTrue(time.time() - start < 0.05)
+        self.assertEquals(msg.value.int, 2)
+
+    def test_receiver_wakes_up_when_its_message_arrives(self):
+        thread = self._receive_on_background(2)
+        time.sleep(0.05)
+        sent = time.time()
+        self.server.send('\x02\x03\x02')
+        thread.join(2)
+        self.assertTrue(self.received[2][0] - sent < 0.2)
+
+
 class TestBufferedStream(TestCase):
 
     DATA = 'foobardiibadaa'
@@ -253,16 +871,74 @@ class TestBufferedStream(TestCase):
         data = self._buffered_stream.read(-1)
         self.assertEquals(data, 'badaa')
 
+    def test_return_other_data(self):
+        self._buffered_stream.read(3)
+        self._buffered_stream.return_data('xy')
+        self.assertEquals(self._buffered_stream.read(-1), 'xybardiibadaa')
+
+    def test_partial_data_is_kept_on_timeout(self):
+        self.assertRaises(AssertionError, self._buffered_stream.read, len(self.DATA) + 1)
+        self.assertEquals(self._buffered_stream.read(-1), self.DATA)
+
+    def test_buffer_is_compacted_and_grown(self):
+        data = ''.join(chr(index) for index in range(256)) * 4
+        stream = BufferedStream(MockConnection(data), 0.1, size=8)
+        result = [stream.read(3) for _ in range(100)]
+        result.append(stream.read(len(data) - 300))
+        self.assertEquals(''.join(result), data)
+
+    def test_read_frames(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length-2'))
+        stream = BufferedStream(MockConnection('\x01\x05abc\x02\x03d\x03'), 0.1)
+        header, pdu = protocol.read(stream)
+        self.assertEquals((header.id.int, pdu), (1, 'abc'))
+        header, pdu = protocol.read(stream)
+        self.assertEquals((header.id.int, pdu), (2, 'd'))
+        self.assertRaises(AssertionError, protocol.read, stream)
+        self.assertEquals(stream.read(-1), '\x03')
+
+    def test_queued_stream_grows_only_for_queued_data(self):
+        big = 'x' * (3 * QUEUED_STREAM_BUFFER_SIZE)
+        stream = _QueuedStream(MockQueuedConnection(['small', big]), 0.1, size=QUEUED_STREAM_BUFFER_SIZE)
+        self.assertEquals(stream.read(5), 'small')
+        self.assertEquals(len(stream._data), QUEUED_STREAM_BUFFER_SIZE)
+        self.assertEquals(stream.read(len(big)), big)
+        self.assertEquals(len(stream._data), len(big))
+
+
+class MockQueuedConnection(object):
+
+    def __init__(self, datagrams):
+        self._datagrams = list(datagrams)
+
+    def _wait_for_queued(self, timeout):
+        if not self._datagrams:
+            raise socket.timeout('timed out')
+
+    def _next_queued_size(self):
+        return len(self._datagrams[0]) if self._datagrams else 0
+
+    def receive_into(self, buffer, timeout):
+        datagram = self._datagrams.pop(0)
+        buffer[:len(datagram)] = datagram
+        return len(datagram)
+
 
 class MockConnection(object):
 
+    _receive_size = 4
+
     def __init__(self, mock_data_to_receive):
         self._data = mock_data_to_receive
 
-    def receive(self, timeout):
-        ret = self._data
-        self._data = ''
-        return ret
+    def receive_into(self, buffer, timeout):
+        size = min(len(buffer), len(self._data))
+        buffer[:size] = self._data[:size]
+        self._data = self._data[size:]
+        return size
 
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 from unittest import TestCase, main
+from threading import Event, Thread
 from Rammbock import Rammbock
+from Rammbock.synchronization import LOCK
+from Rammbock.binary_tools import to_bin
 
 
 class TestParamParsing(TestCase):
@@ -27,6 +30,28 @@ class TestParamParsing(TestCase):
         self.assertEquals(pdus['header'], 'poo')
 
 
+class TestMessageCorpus(TestCase):
+
+    def setUp(self):
+        self.rammbock = Rammbock()
+        self.rammbock.new_protocol('TestProtocol')
+        self.rammbock.uint(2, 'msgId', 5)
+        self.rammbock.uint(2, 'length', None)
+        self.rammbock.pdu('length-4')
+        self.rammbock.end_protocol()
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', '0xcafe')
+        self.rammbock.uint(2, 'sequence')
+
+    def test_generate_corpus(self):
+        corpus, offsets = self.rammbock.generate_message_corpus('3', 'sequence:counter(7)', 'header:msgId:cycle(1, 2)')
+        self.assertEquals(offsets, [0, 8, 16])
+        self.assertEquals(corpus, to_bin('0x0001 0008 cafe 0007 0002 0008 cafe 0008 0001 0008 cafe 0009'))
+
+    def test_unknown_config_fails(self):
+        self.assertRaises(AssertionError, self.rammbock.generate_message_corpus, '3', 'foo=bar')
+
+
 LOCAL_IP = '127.0.0.1'
 
 ports = {'SERVER_PORT': 12345,
@@ -80,6 +105,17 @@ class TestMessageSequence(TestCase):
         self._sequence_should_equal(self.rammbock._message_sequence.get(),
                                     [['Client', 'Server', 'TestProtocol:FooRequest', 'Value of field foo does not match 0xcafe!=5', 'received']])
 
+    def test_send_message_image(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        self.rammbock.save_message_image('foo image', 'variables=foo,header:msgId')
+        self.rammbock.client_sends_message_image('foo image', 'foo:0xbabe', 'header:msgId:7')
+        msg = self.rammbock.server_receives_message('foo:0xbabe', 'header:msgId:7')
+        self.assertEquals(msg.foo.hex, '0xbabe')
+        self._sequence_should_equal(self.rammbock._message_sequence.get(),
+                                    [['Client', 'Server', 'TestProtocol:FooRequest', '', 'received']])
+
     def test_send_binary_without_protocol(self):
         self._start_client_server()
         self.rammbock.client_sends_binary('foobar')
@@ -98,5 +134,57 @@ class TestMessageSequence(TestCase):
         self.assertEquals(list_seq, expected)
 
 
+class TestLockContention(TestCase):
+
+    def setUp(self):
+        self.rammbock = Rammbock()
+        for index in range(2):
+            self.rammbock.start_udp_server(LOCAL_IP, ports['SERVER_PORT'] + 10 + index, name='Server%d' % index)
+            self.rammbock.start_udp_client(LOCAL_IP, ports['CLIENT_PORT'] + 10 + index, name='Client%d' % index)
+            self.rammbock.connect(LOCAL_IP, ports['SERVER_PORT'] + 10 + index, name='Client%d' % index)
+        self.receiving = Event()
+        server = self.rammbock._servers.get('Server0')
+        receive_from = server.receive_from
+
+        def signaling_receive_from(*args, **kwargs):
+            self.receiving.set()
+            return receive_from(*args, **kwargs)
+        server.receive_from = signaling_receive_from
+
+    def tearDown(self):
+        self.rammbock.reset_rammbock()
+
+    def _in_thread(self, function):
+        done = Event()
+
+        def run():
+            function()
+            done.set()
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return done
+
+    def _acquire_and_release_library_lock(self):
+        LOCK.acquire()
+        LOCK.release()
+
+    def _round_trip(self):
+        self.rammbock.client_sends_binary('ping', name='Client1')
+        self.rammbock.server_receives_binary(name='Server1', timeout=1)
+
+    def test_waiting_receiver_does_not_block_library_lock_or_other_nodes(self):
+        waiter = Thread(target=self.rammbock.server_receives_binary, kwargs={'name': 'Server0', 'timeout': 5})
+        waiter.start()
+        try:
+            self.assertTrue(self.receiving.wait(5))
+            self.assertTrue(self._in_thread(self._acquire_and_release_library_lock).wait(1))
+            self.assertTrue(self._in_thread(self._round_trip).wait(1))
+            self.assertTrue(waiter.is_alive())
+        finally:
+            self.rammbock.client_sends_binary('pong', name='Client0')
+            waiter.join(5)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+from unittest import TestCase, main
+import fcntl
+import os
+import select
+import time
+
+from Rammbock.reactor import Reactor, _SelectPoller, _PollPoller, _EpollPoller, get_poller
+
+
+class _PollerTests(object):
+
+    def setUp(self):
+        self.reader, self.writer = os.pipe()
+        self.poller = self._get_poller()
+        self.poller.register(self.reader)
+
+    def tearDown(self):
+        self.poller.close()
+        os.close(self.reader)
+        os.close(self.writer)
+
+    def test_readable_fd_is_returned(self):
+        self.assertEquals(list(self.poller.poll(0)), [])
+        os.write(self.writer, 'x')
+        self.assertEquals(list(self.poller.poll(1)), [self.reader])
+
+    def test_unregistered_fd_is_not_returned(self):
+        os.write(self.writer, 'x')
+        self.poller.unregister(self.reader)
+        self.poller.unregister(self.reader)
+        self.assertEquals(list(self.poller.poll(0)), [])
+
+
+class TestSelectPoller(_PollerTests, TestCase):
+    _get_poller = _SelectPoller
+
+
+if hasattr(select, 'poll'):
+    class TestPollPoller(_PollerTests, TestCase):
+        _get_poller = _PollPoller
+
+
+if hasattr(select, 'epoll'):
+    class TestEpollPoller(_PollerTests, TestCase):
+        _get_poller = _EpollPoller
+
+        def test_closing_releases_epoll_descriptor(self):
+            self.poller.close()
+            self.assertTrue(self.poller._epoll.closed)
+
+
+class PipeStream(object):
+
+    def __init__(self):
+        self.reader, self.writer = os.pipe()
+        fcntl.fcntl(self.reader, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.handled = 0
+
+    def fileno(self):
+        return self.reader
+
+    def handle_readable(self):
+        try:
+            os.read(self.reader, 4096)
+        except OSError:
+            return True
+        self.handled += 1
+        return True
+
+    def close(self):
+        os.close(self.reader)
+        os.close(self.writer)
+
+
+class TestReactor(TestCase):
+
+    def setUp(self):
+        self.reactor = Reactor()
+        self.streams = [PipeStream() for _ in range(50)]
+
+    def tearDown(self):
+        for stream in self.streams:
+            self.reactor.unregister(stream)
+            stream.close()
+
+    def _wait_until(self, condition):
+        cutoff = time.time() + 2
+        while not condition() and time.time() < cutoff:
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_readable_streams_are_handled(self):
+        for stream in self.streams:
+            self.reactor.register(stream)
+        self._wait_until(lambda: self.reactor._fds and len(self.reactor._fds) == len(self.streams))
+        for stream in self.streams[::2]:
+            os.write(stream.writer, 'x')
+        self._wait_until(lambda: all(stream.handled == 1 for stream in self.streams[::2]))
+        self.assertTrue(all(stream.handled == 0 for stream in self.streams[1::2]))
+
+    def test_unregistered_streams_are_removed_from_poller(self):
+        for stream in self.streams:
+            self.reactor.register(stream)
+        for stream in self.streams[1:]:
+            self.reactor.unregister(stream)
+        self._wait_until(lambda: self.reactor._fds.keys() == self.streams[:1])
+        self.assertEquals(self.reactor._streams_by_fd, {self.streams[0].reader: self.streams[0]})
+
+    def test_poller_is_chosen_by_platform(self):
+        expected = _EpollPoller if hasattr(select, 'epoll') else _PollPoller if hasattr(select, 'poll') else _SelectPoller
+        self.assertTrue(isinstance(get_poller(), expected))
+
+
+if __name__ == '__main__':
+    main()
@@ -57,6 +57,34 @@ class TestBinaryContainerTemplate(TestCase):
         self.assertEqual(0, decoded.spare.int)
         self.assertEqual(1, decoded.value.int)
 
+    def test_decode_little_endian_container_followed_by_data(self):
+        container = self._2_byte_container()
+        decoded = container.decode(to_bin("0x0190 ffff"), little_endian=True)
+        self.assertEqual(1, decoded.oneBit.int)
+        self.assertEqual(1, decoded.threeBits.int)
+        self.assertEqual(1, decoded.twelveBits.int)
+
+    def test_encode_and_decode_container_longer_than_8_bytes(self):
+        container = BinaryContainerTemplate('foo', None)
+        container.add(Binary(4, 'head', 0xa))
+        container.add(Binary(72, 'middle', '0x0102030405060708ff'))
+        container.add(Binary(4, 'tail', 0x5))
+        encoded = container.encode({})
+        self.assertEquals(encoded._raw, to_bin('0xa0102030405060708ff5'))
+        decoded = container.decode(encoded._raw)
+        self.assertEquals(decoded.middle.hex, '0x0102030405060708ff')
+        self.assertEquals(decoded.tail.int, 5)
+
+    def test_decoded_field_values_are_minimal_bytes(self):
+        decoded = self._2_byte_container().decode(to_bin("0x9001"))
+        self.assertEquals(decoded.twelveBits.bytes, '\x01')
+        self.assertEquals(decoded.twelveBits.bin, '0b000000000001')
+
+    def test_encode_too_long_value_fails(self):
+        container = self._1_byte_container()
+        encoded = container.encode({'foo.spare': 0, 'foo.value': 16})
+        self.assertRaises(AssertionError, encoded._get_raw_bytes)
+
     def _1_byte_container(self):
         container = BinaryContainerTemplate('foo', None)
         container.add(Binary(4, 'spare', 0))
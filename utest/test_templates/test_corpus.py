@@ -0,0 +1,111 @@
+from unittest import TestCase, main
+from Rammbock.templates import (Protocol, MessageTemplate, MessageImage, UInt,
+                                Int, Char, PDU)
+from Rammbock.templates import corpus
+from Rammbock.templates.corpus import parse_generator, generate_corpus
+
+
+class TestGenerators(TestCase):
+
+    def test_plain_value_is_not_generator(self):
+        self.assertEquals(parse_generator('0xcafe'), None)
+
+    def test_counter(self):
+        self.assertEquals(parse_generator('counter(5, 2)').values(2, 3, None), [9, 11, 13])
+        self.assertEquals(parse_generator('counter()').values(0, 2, None), [0, 1])
+
+    def test_cycle(self):
+        self.assertEquals(parse_generator('cycle(a, b, c)').values(2, 4, None), ['c', 'a', 'b', 'c'])
+
+
+class TestCorpus(TestCase):
+
+    def setUp(self):
+        self._numpy_enabled = corpus.NUMPY_ENABLED
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+        self.tmp = MessageTemplate('FooRequest', self._protocol, {})
+        self.tmp.add(UInt(4, 'sequence', 1))
+        self.tmp.add(Int(2, 'signed', -1))
+        self.tmp.add(UInt(3, 'odd', '0'))
+        self.tmp.add(Char(2, 'chars', 'ab'))
+        self.tmp.add(UInt(1, 'name_length', None))
+        self.tmp.add(Char('name_length', 'name', 'foo'))
+        self.tmp.add(UInt(8, 'big', '0'))
+
+    def tearDown(self):
+        corpus.NUMPY_ENABLED = self._numpy_enabled
+
+    def _generate(self, count, specs, seed=None):
+        generators = dict((name, parse_generator(spec)) for name, spec in specs.items())
+        image = MessageImage(self.tmp, self.tmp.encode({}, {}), generators.keys())
+        return generate_corpus(image, count, generators, seed=seed)
+
+    def _expected(self, params_list):
+        data, offsets = '', []
+        for params in params_list:
+            offsets.append(len(data))
+            data += self.tmp.encode(params, {})._raw
+        return data, offsets
+
+    def _assert_fixed_length_corpus(self):
+        specs = {'sequence': 'counter(10, 3)', 'signed': 'cycle(-5, 7)',
+                 'odd': 'counter(0x10000)', 'chars': 'cycle(xy, z)'}
+        expected = self._expected([{'sequence': 10 + 3 * i, 'signed': [-5, 7][i % 2],
+                                    'odd': 0x10000 + i, 'chars': ['xy', 'z'][i % 2]}
+                                   for i in range(5)])
+        self.assertEquals(self._generate(5, specs), expected)
+
+    def test_fixed_length_fields(self):
+        self._assert_fixed_length_corpus()
+
+    def test_fixed_length_fields_without_numpy(self):
+        corpus.NUMPY_ENABLED = False
+        self._assert_fixed_length_corpus()
+
+    def test_several_batches(self):
+        corpus.BATCH_SIZE, batch_size = 2, corpus.BATCH_SIZE
+        try:
+            self._assert_fixed_length_corpus()
+        finally:
+            corpus.BATCH_SIZE = batch_size
+
+    def test_dynamic_length_fields(self):
+        data, offsets = self._generate(3, {'name': 'cycle(a, bcd, ef)', 'sequence': 'counter(1)'})
+        self.assertEquals((data, offsets), self._expected([{'name': 'a', 'sequence': 1},
+                                                           {'name': 'bcd', 'sequence': 2},
+                                                           {'name': 'ef', 'sequence': 3}]))
+
+    def test_random_values_are_in_range_and_repeatable(self):
+        for numpy_enabled in set([False, self._numpy_enabled]):
+            corpus.NUMPY_ENABLED = numpy_enabled
+            data, offsets = self._generate(50, {'sequence': 'random(3, 5)'}, seed=1)
+            self.assertEquals((data, offsets), self._generate(50, {'sequence': 'random(3, 5)'}, seed=1))
+            values = set(self.tmp.decode(data[offset + 4:offset + len(data) / 50]).sequence.int
+                         for offset in offsets)
+            self.assertTrue(values <= set([3, 4, 5]))
+
+    def test_values_out_of_range_fail(self):
+        for numpy_enabled in set([False, self._numpy_enabled]):
+            corpus.NUMPY_ENABLED = numpy_enabled
+            self.assertRaises(AssertionError, self._generate, 3, {'signed': 'counter(32766)'})
+
+    def test_unsigned_64_bit_values(self):
+        top = 2 ** 64 - 1
+        for numpy_enabled in set([False, self._numpy_enabled]):
+            corpus.NUMPY_ENABLED = numpy_enabled
+            self.assertEquals(self._generate(3, {'big': 'counter(%d, -2)' % top}),
+                              self._expected([{'big': top - 2 * i} for i in range(3)]))
+            self.assertEquals(self._generate(3, {'big': 'cycle(%d, 1)' % top}),
+                              self._expected([{'big': value} for value in (top, 1, top)]))
+            data, offsets = self._generate(20, {'big': 'random(%d, %d)' % (top - 2, top)}, seed=1)
+            values = set(self.tmp.decode(data[offset + 4:offset + len(data) / 20]).big.int
+                         for offset in offsets)
+            self.assertTrue(values <= set([top - 2, top - 1, top]))
+            self.assertRaises(AssertionError, self._generate, 2, {'big': 'counter(%d)' % top})
+
+
+if __name__ == '__main__':
+    main()
@@ -108,3 +108,14 @@ List listlist[]
     def test_not_enough_data(self):
         template = get_list_of_three()
         self.assertRaises(Exception, template.decode, to_bin('0x00010002'))
+
+    def test_decoded_values_are_copied_out_of_data(self):
+        list = ListTemplate('*', 'free', parent=None)
+        list.add(Char('*', None, terminator='0x00'))
+        decoded = list.decode('foo\x00barbaz\x00x\x00', {})
+        self.assertEquals([decoded[i].ascii for i in range(decoded.len)], ['foo', 'barbaz', 'x'])
+        self.assertEquals(type(decoded[1].bytes), str)
+
+    def test_missing_terminator_fails(self):
+        template = Char('*', 'field', terminator='0x00')
+        self.assertRaises(ValueError, template.decode, 'foo', {})
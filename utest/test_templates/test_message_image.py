@@ -0,0 +1,58 @@
+from unittest import TestCase, main
+from Rammbock.templates import (Protocol, MessageTemplate, StructTemplate,
+                                MessageImage, UInt, Char, PDU)
+
+
+class TestMessageImage(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+        self.tmp = MessageTemplate('FooRequest', self._protocol, {})
+        self.tmp.add(UInt(4, 'sequence', 1))
+        self.tmp.add(UInt(1, 'name_length', None))
+        self.tmp.add(Char('name_length', 'name', 'foo'))
+        struct = StructTemplate('Named', 'named', self.tmp, length='struct_length')
+        self.tmp.add(UInt(2, 'struct_length', None))
+        struct.add(Char('*', 'value', 'abc'))
+        struct.add(UInt(1, 'last', 7))
+        self.tmp.add(struct)
+
+    def _image(self, *variables):
+        return MessageImage(self.tmp, self.tmp.encode({}, {}), variables)
+
+    def _encoded(self, params, header_params=None):
+        return self.tmp.encode(params, header_params or {})._raw
+
+    def test_encode_without_changes(self):
+        self.assertEquals(self._image('sequence').encode({}), self._encoded({}))
+
+    def test_patch_fixed_length_fields(self):
+        image = self._image('sequence', 'header:msgId', 'named.last')
+        self.assertEquals(image.encode({'sequence': '42', 'header:msgId': '0x0102'}),
+                          self._encoded({'sequence': '42'}, {'msgId': '0x0102'}))
+        self.assertEquals(image.encode({'sequence': '43', 'named.last': 9}),
+                          self._encoded({'sequence': '43', 'named.last': 9}, {'msgId': '0x0102'}))
+
+    def test_patch_dynamic_length_updates_length_fields(self):
+        image = self._image('name', 'named.value', 'sequence')
+        for name, value in [('foobar', 'x'), ('', 'abcdefgh'), ('f', '')]:
+            self.assertEquals(image.encode({'name': name, 'named.value': value, 'sequence': 3}),
+                              self._encoded({'name': name, 'named.value': value, 'sequence': 3}))
+
+    def test_too_long_value_fails(self):
+        image = self._image('named.last')
+        self.assertRaises(AssertionError, image.encode, {'named.last': 256})
+
+    def test_unknown_variable_fails(self):
+        self.assertRaises(AssertionError, self._image, 'foo')
+        self.assertRaises(AssertionError, self._image('sequence').encode, {'name': 'bar'})
+
+    def test_length_field_can_not_be_variable(self):
+        self.assertRaises(AssertionError, self._image, 'name_length')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 from unittest import TestCase, main
 from .tools import MockStream
 import socket
-from Rammbock.templates.message_stream import MessageStream
-from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU
+from threading import Thread
+from Rammbock.templates.message_stream import MessageStream, HeaderMatcher, _MessageCache, _HandlerTable
+from Rammbock.templates import Protocol, MessageTemplate, StructTemplate, UInt, Char, PDU
+from Rammbock.message import Field, Header
 from Rammbock.binary_tools import to_bin
 
 
@@ -20,6 +22,82 @@ class TestProtocolMessageReceiving(TestCase):
         self.assertEquals(header.id.hex, '0xff')
         self.assertEquals(data, '\xca\xfe')
 
+    def test_incomplete_frame_is_not_read(self):
+        stream = MockStream(to_bin('0xff0004ca'))
+        self.assertRaises(socket.timeout, self._protocol.read, stream, timeout=0.1)
+        self.assertEquals(stream.data, to_bin('0xff0004ca'))
+
+    def test_read_header_with_dynamic_length(self):
+        protocol = Protocol('Dynamic')
+        protocol.add(UInt(1, 'name_length', None))
+        protocol.add(Char('name_length', 'name', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length'))
+        self.assertEquals(protocol.header_length(), -1)
+        stream = MockStream('\x03foo\x02\xca')
+        self.assertRaises(socket.timeout, protocol.read, stream, timeout=0.1)
+        stream.data += '\xfe\x01'
+        header, data = protocol.read(stream)
+        self.assertEquals(header.name.ascii, 'foo')
+        self.assertEquals(data, '\xca\xfe')
+        self.assertEquals(stream.data, '\x01')
+
+
+HANDLED_MESSAGES = []
+
+
+def record_handled_message(library, msg):
+    HANDLED_MESSAGES.append(msg)
+
+
+class ReactorRacingStream(MockStream):
+    """Data arrives while a receiver waits for it, and the reactor handles
+    the stream before the receiver wakes up."""
+
+    def __init__(self, arriving):
+        MockStream.__init__(self, '')
+        self._arriving = arriving
+        self._connection = self
+        self.parent = None
+        self.message_stream = None
+
+    def wait_for_data(self, timeout=None):
+        self.data, self._arriving = self.data + self._arriving, ''
+        reactor = Thread(target=self.message_stream.handle_readable)
+        reactor.start()
+        reactor.join()
+        MockStream.wait_for_data(self, timeout)
+
+    def fileno(self):
+        return None
+
+    def is_closed_by_peer(self):
+        return False
+
+
+class ArrivingStream(MockStream):
+    """The given data arrives while a receiver waits for the first time."""
+
+    def __init__(self, arriving):
+        MockStream.__init__(self, '')
+        self._arriving = arriving
+
+    def wait_for_data(self, timeout=None):
+        self.data, self._arriving = self.data + self._arriving, ''
+        MockStream.wait_for_data(self, timeout)
+
+
+class ResettingStream(MockStream):
+    """Connection is reset after the given data has been read."""
+
+    def read_frame(self, extract, timeout=None):
+        if not self.data:
+            raise socket.error(104, 'Connection reset by peer')
+        return MockStream.read_frame(self, extract, timeout)
+
+    def has_data(self):
+        return True
+
 
 class TestMessageStream(TestCase):
 
@@ -38,6 +116,17 @@ class TestMessageStream(TestCase):
         msg = self._msg_stream.get(self._msg, header_filter='id')
         self.assertEquals(msg.field_1.hex, '0xde')
 
+    def test_get_message_lazily(self):
+        template = MessageTemplate('FooRequest', self._protocol, {'id': '0xdd'})
+        pair = StructTemplate('Pair', 'pair', template)
+        pair.add(UInt(1, 'first', None))
+        pair.add(UInt(1, 'second', None))
+        template.add(pair)
+        msg = self._msg_stream.get(template, header_filter='id', lazy=True)
+        self.assertFalse('_fields' in msg.pair.__dict__)
+        self.assertEquals(msg.pair.second.hex, '0xef')
+        self.assertEquals(msg._header.id.hex, '0xdd')
+
     def test_get_message_from_cache(self):
         _ = self._msg_stream.get(self._msg, header_filter='id')
         self._msg.header_parameters = {'id': '0xdd'}
@@ -57,6 +146,16 @@ class TestMessageStream(TestCase):
         self._msg.header_parameters = {'id': '0x00'}
         self.assertRaises(socket.timeout, self._msg_stream.get, self._msg, timeout=0.1, header_filter='id')
 
+    def test_timeout_after_not_matching_message_arrives_fails_in_message_stream(self):
+        msg_stream = MessageStream(ArrivingStream(to_bin('0xff0004cafe')), self._protocol)
+        try:
+            msg_stream.get(self._msg, timeout=0.1, header_filter='id')
+        except AssertionError, e:
+            self.assertEquals(e.args[0], 'Timeout 0.100000s exceeded in message stream.')
+        else:
+            self.fail('AssertionError not raised')
+        self.assertEquals(msg_stream.get_messages_count_in_cache(), 1)
+
     def test_get_messages_count_from_cache_two_messages(self):
         _ = self._msg_stream.get(self._msg, header_filter='id')
         self._msg.header_parameters = {'id': '0xdd'}
@@ -67,6 +166,222 @@ class TestMessageStream(TestCase):
         count = self._msg_stream.get_messages_count_in_cache()
         self.assertEquals(count, 3)
 
+    def test_header_filter_is_compiled_once(self):
+        matcher = self._msg_stream._get_matcher(self._msg, 'id')
+        self.assertTrue(self._msg_stream._get_matcher(self._msg, 'id') is matcher)
+        self._msg.header_parameters = {'id': '0xdd'}
+        self.assertFalse(self._msg_stream._get_matcher(self._msg, 'id') is matcher)
+
+    def test_get_latest_message_from_cache(self):
+        self._msg_stream = MessageStream(MockStream(to_bin('0xaa0004dead aa0004beef ff0004cafe')), self._protocol)
+        self._msg.header_parameters = {'id': '0xff'}
+        _ = self._msg_stream.get(self._msg, header_filter='id')
+        self._msg.header_parameters = {'id': '0xaa'}
+        msg = self._msg_stream.get(self._msg, header_filter='id', latest=True)
+        self.assertEquals(msg.field_1.hex, '0xbe')
+        msg = self._msg_stream.get(self._msg, header_filter='id')
+        self.assertEquals(msg.field_1.hex, '0xde')
+
+    def test_data_arriving_to_waiting_receiver_is_left_to_it(self):
+        del HANDLED_MESSAGES[:]
+        stream = ReactorRacingStream(to_bin('0xff0004cafe aa0004dead'))
+        self._msg_stream = stream.message_stream = MessageStream(stream, self._protocol)
+        handled = MessageTemplate('Handled', self._protocol, {'id': '0xff'})
+        handled.add(UInt(2, 'value', None))
+        self._msg_stream.set_handler(handled, 'test_templates.test_message_stream.record_handled_message', 'id')
+        try:
+            msg = self._msg_stream.get(self._msg, timeout=1, header_filter='id')
+        finally:
+            self._msg_stream.close()
+        self.assertEquals(msg.field_1.hex, '0xde')
+        self.assertEquals([msg.value.hex for msg in HANDLED_MESSAGES], ['0xcafe'])
+
+
+def handle_with_node(library, msg, node):
+    return 'node', node
+
+
+def handle_with_connection(library, msg, node, connection):
+    return 'connection', connection
+
+
+def _matcher(name, value):
+    protocol = Protocol('Test')
+    protocol.add(UInt(1, 'id', None))
+    protocol.add(Char(3, 'name', None))
+    return HeaderMatcher(protocol, {name: value}, name)
+
+
+def _header(msg_id, name):
+    header = Header('Test')
+    header['id'] = Field('uint', 'id', to_bin(msg_id))
+    header['name'] = Field('chars', 'name', name)
+    return header
+
+
+class TestMessageCache(TestCase):
+
+    def setUp(self):
+        self._cache = _MessageCache()
+        for index, (msg_id, name) in enumerate([(1, 'foo'), (2, 'bar'), (1, 'bar'), (2, 'foo')]):
+            self._cache.append(_header(msg_id, name), str(index))
+
+    def test_pop_in_arrival_order(self):
+        self.assertEquals(self._cache.pop()[1], '0')
+        self.assertEquals(self._cache.pop(latest=True)[1], '3')
+        self.assertEquals(len(self._cache), 2)
+
+    def test_pop_by_header_value(self):
+        self.assertEquals(self._cache.pop(_matcher('id', '2'))[1], '1')
+        self.assertEquals(self._cache.pop(_matcher('id', '0x01'), latest=True)[1], '2')
+        self.assertEquals(self._cache.pop(_matcher('name', 'foo'))[1], '0')
+        self.assertEquals(self._cache.pop(_matcher('name', 'foo'))[1], '3')
+        self.assertEquals(self._cache.pop(_matcher('name', 'foo')), None)
+        self.assertEquals(len(self._cache), 0)
+
+    def test_messages_added_after_indexing(self):
+        self._cache.pop(_matcher('id', '3'))
+        self._cache.append(_header(3, 'baz'), '4')
+        self.assertEquals(self._cache.pop(_matcher('id', '3'))[1], '4')
+        self.assertEquals([pdu for _, pdu in self._cache], ['0', '1', '2', '3'])
+
+    def test_pop_by_regexp(self):
+        self.assertEquals(self._cache.pop(_matcher('name', 'REGEXP:b.*'))[1], '1')
+        self.assertEquals(self._cache.pop(_matcher('name', 'REGEXP:(foo|bar)'), latest=True)[1], '3')
+        self.assertEquals(self._cache.pop(_matcher('name', 'REGEXP:x')), None)
+
+
+class TestHandlerTable(TestCase):
+
+    def setUp(self):
+        self._table = _HandlerTable()
+
+    def _add(self, name=None, value=None, function='handle_with_node'):
+        matcher = _matcher(name, value) if name else None
+        self._table.add(None, 'test_templates.test_message_stream.' + function, matcher)
+
+    def _find(self, msg_id, name):
+        handler = self._table.find(_header(msg_id, name))
+        return handler.order if handler else None
+
+    def test_find_by_header_value(self):
+        self._add('id', '1')
+        self._add('id', '2')
+        self._add('name', 'foo')
+        self.assertEquals(self._find(2, 'bar'), 1)
+        self.assertEquals(self._find(2, 'foo'), 1)
+        self.assertEquals(self._find(3, 'foo'), 2)
+        self.assertEquals(self._find(3, 'bar'), None)
+
+    def test_first_registered_handler_wins(self):
+        self._add('id', '1')
+        self._add('name', 'REGEXP:f.*')
+        self._add('id', '1')
+        self._add()
+        self.assertEquals(self._find(1, 'foo'), 0)
+        self.assertEquals(self._find(2, 'foo'), 1)
+        self.assertEquals(self._find(2, 'bar'), 3)
+
+    def test_handler_function_and_arity_are_resolved_once(self):
+        self._add('id', '1', function='handle_with_connection')
+        self._add(function='handle_with_node')
+        self.assertEquals(self._table.find(_header(2, 'foo'))(None, None, 'n', 'c'), ('node', 'n'))
+        self.assertEquals(self._table.find(_header(1, 'foo'))(None, None, 'n', 'c'), ('connection', 'c'))
+
+    def test_unknown_handler_fails_when_registered(self):
+        self.assertRaises(AttributeError, self._add, function='no_such_handler')
+
+
+class TestHeaderMatcher(TestCase):
+
+    def test_match_uint(self):
+        matcher = _matcher('id', '0x0a')
+        self.assertTrue(matcher.matches(_header(10, 'foo')))
+        self.assertFalse(matcher.matches(_header(11, 'foo')))
+
+    def test_match_chars(self):
+        self.assertTrue(_matcher('name', 'foo').matches(_header(1, 'foo')))
+        self.assertFalse(_matcher('name', 'fo').matches(_header(1, 'foo')))
+
+    def test_regexp_with_colon(self):
+        header = _header(1, 'a:b')
+        self.assertTrue(_matcher('name', 'REGEXP:a:.').matches(header))
+        self.assertFalse(_matcher('name', 'REGEXP:a:c').matches(header))
+
+    def test_invalid_regexp(self):
+        self.assertRaises(Exception, _matcher, 'name', 'REGEXP:(')
+
+    def test_filter_by_unknown_field_fails(self):
+        self.assertRaises(AssertionError, _matcher, 'foo', '1')
+
+
+class TestBoundedMessageCache(TestCase):
+
+    def _fill(self, cache, count, start=0):
+        for index in range(start, start + count):
+            cache.append(_header(index % 2, 'foo'), str(index))
+
+    def test_drop_oldest(self):
+        cache = _MessageCache(3)
+        self._fill(cache, 3)
+        self.assertEquals(cache.pop(_matcher('id', '5')), None)
+        self._fill(cache, 2, start=3)
+        self.assertEquals([pdu for _, pdu in cache], ['2', '3', '4'])
+        self.assertEquals(cache.evicted, {'id=0': 1, 'id=1': 1})
+        self.assertEquals(cache.pop(_matcher('id', '1'))[1], '3')
+
+    def test_drop_newest(self):
+        cache = _MessageCache('3', 'DROP-NEWEST')
+        self._fill(cache, 5)
+        self.assertEquals([pdu for _, pdu in cache], ['0', '1', '2'])
+        self.assertEquals(cache.evicted, {'*': 2})
+
+    def test_fail(self):
+        cache = _MessageCache(2, 'fail')
+        self._fill(cache, 2)
+        self.assertRaises(AssertionError, self._fill, cache, 1)
+        cache.pop()
+        self.assertRaises(AssertionError, cache.check_overflow)
+
+    def test_invalid_configuration(self):
+        self.assertRaises(AssertionError, _MessageCache, 10, 'drop-random')
+        self.assertRaises(AssertionError, _MessageCache, 0)
+        self.assertEquals(len(_MessageCache('None')), 0)
+
+    def test_full_cache_fails_receive_until_emptied(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', 1))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length-2'))
+        template = MessageTemplate('FooRequest', protocol, {'id': '0xdd'})
+        stream = MessageStream(MockStream(to_bin('0xff0003ca aa0003fe dd0003be')), protocol,
+                               cache_size=1, cache_policy='fail')
+        self.assertRaises(AssertionError, stream.get, template, header_filter='id')
+        self.assertRaises(AssertionError, stream.get, template, header_filter='id')
+        stream.empty()
+        self.assertRaises(socket.timeout, stream.get, template, timeout=0.1)
+
+    def test_counting_messages_to_full_cache_does_not_fail(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', 1))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length-2'))
+        template = MessageTemplate('FooRequest', protocol, {'id': '0xaa'})
+        stream = MessageStream(MockStream(to_bin('0xff0003ca aa0003fe dd0003be')), protocol,
+                               cache_size=1, cache_policy='fail')
+        self.assertEquals(stream.get_messages_count_in_cache(), 1)
+        self.assertEquals(stream.get_messages_count_in_cache(), 1)
+        self.assertRaises(AssertionError, stream.get, template, header_filter='id', latest=True)
+
+    def test_counting_messages_does_not_fail_to_read_errors(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', 1))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length-2'))
+        stream = MessageStream(ResettingStream(to_bin('0xff0003ca')), protocol)
+        self.assertEquals(stream.get_messages_count_in_cache(), 1)
+        self.assertEquals(stream.get_messages_count_in_cache(), 1)
+
 
 if __name__ == '__main__':
     main()
@@ -1,7 +1,8 @@
 from unittest import TestCase, main
-from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate
+from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate, ListTemplate, UnionTemplate
 from Rammbock.templates.primitives import UInt, PDU, Char
 from Rammbock.binary_tools import to_bin_of_length, to_bin
+from Rammbock.message import Header
 from .tools import *
 
 
@@ -24,6 +25,12 @@ class TestMessageTemplate(TestCase):
         self.assertEquals(msg.field_1.int, 1)
         self.assertEquals(msg.field_2.int, 2)
 
+    def test_encode_patches_pdu_length_into_raw_bytes(self):
+        msg = self.tmp.encode({}, {})
+        self.assertEquals(msg._header.length.int, 8)
+        self.assertEquals(msg._raw, to_bin('0x0005 0008 0001 0002'))
+        self.assertEquals(msg._raw, msg._header._raw + msg.field_1._raw + msg.field_2._raw)
+
     def test_message_field_type_conversions(self):
         msg = self.tmp.encode({'field_1': 1024}, {})
         self.assertEquals(msg.field_1.int, 1024)
@@ -182,5 +189,58 @@ class TestTemplateFieldValidation(TestCase, WithValidation):
         self._should_fail(struct.validate({'foo': encoded}, {'foo.text': 'fob'}), 1)
 
 
+class TestLazyDecoding(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-2'))
+        self.tmp = MessageTemplate('FooRequest', self._protocol, {})
+        self.tmp.add(UInt(1, 'count', None))
+        self.tmp.add(get_struct_with_length_and_alignment())
+        pairs = ListTemplate(2, 'liststruct', None)
+        pairs.add(get_empty_pair())
+        self.tmp.add(pairs)
+        union = UnionTemplate('Union', 'union', None)
+        union.add(UInt(2, 'number', None))
+        union.add(Char(2, 'chars', None))
+        self.tmp.add(union)
+        items = ListTemplate('count', 'items', None)
+        items.add(UInt(1, None, None))
+        self.tmp.add(items)
+        self.data = to_bin('0x02 00010200 cafebabe d00df00d 6162 0102')
+
+    def test_subtrees_are_decoded_on_access(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        self.assertFalse('_fields' in msg.liststruct.__dict__)
+        self.assertEqual(len(msg), len(self.data))
+        self.assertEqual(msg.liststruct[1].second.hex, '0xf00d')
+        self.assertTrue('_fields' in msg.liststruct.__dict__)
+        self.assertFalse('_fields' in msg.pair.__dict__)
+        self.assertFalse('_fields' in msg.union.__dict__)
+
+    def test_lazy_decoding_matches_eager_decoding(self):
+        lazy = self.tmp.decode(self.data, lazy=True)
+        eager = self.tmp.decode(self.data)
+        self.assertEqual(repr(lazy), repr(eager))
+        self.assertEqual(lazy._raw, eager._raw)
+        self.assertEqual(lazy.union.chars.ascii, 'ab')
+        self.assertEqual(lazy.items[1].int, 2)
+        self.assertEqual(lazy.pair._get_recursive_name(), 'pair.')
+
+    def test_validation_decodes_needed_subtrees(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        msg._add_header(Header('TestProtocol'))
+        errors = self.tmp.validate(msg, {'pair.second': '3'}, {})
+        self.assertEqual(len(errors), 1)
+        self.assertFalse('_fields' in msg.union.__dict__)
+
+    def test_too_long_message_fails(self):
+        self.assertRaises(AssertionError, self.tmp.decode, self.data + '\x00', lazy=True)
+
+    def test_not_enough_data_fails_while_decoding(self):
+        self.assertRaises(Exception, self.tmp.decode, self.data[:6], lazy=True)
+
+
 if __name__ == '__main__':
     main()
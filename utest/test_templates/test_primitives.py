@@ -216,5 +216,41 @@ class TestAlignment(TestCase):
     # TODO: more combinations, handling chars
 
 
+class TestIntegerCodecs(TestCase):
+
+    def test_native_lengths_use_struct_codec(self):
+        for length in (1, 2, 4, 8):
+            self.assertTrue(UInt(length, 'foo', None)._codecs)
+            self.assertTrue(Int(length, 'foo', None)._codecs)
+        self.assertFalse(UInt(3, 'foo', None)._codecs)
+        self.assertFalse(UInt('len', 'foo', None)._codecs)
+
+    def test_encode_uint_in_all_value_formats(self):
+        for value in (258, '258', '0x0102', '0x01 0x02', '0b1 0000 0010'):
+            self.assertEquals(UInt(2, 'foo', None).encode({'foo': value}, {}).hex, '0x0102')
+
+    def test_encode_uint_limits(self):
+        self.assertEquals(UInt(8, 'foo', '18446744073709551615').encode({}, {})._raw, '\xff' * 8)
+        self.assertRaises(AssertionError, UInt(1, 'foo', '256').encode, {}, {})
+        self.assertRaises(AssertionError, UInt(1, 'foo', '-1').encode, {}, {})
+
+    def test_encode_int_limits(self):
+        self.assertEquals(Int(4, 'foo', '-2147483648').encode({}, {}).hex, '0x80000000')
+        self.assertEquals(Int(4, 'foo', '2147483647').encode({}, {}).hex, '0x7fffffff')
+        self.assertRaises(AssertionError, Int(4, 'foo', '2147483648').encode, {}, {})
+        self.assertRaises(AssertionError, Int(4, 'foo', '-2147483649').encode, {}, {})
+
+    def test_little_endian_codecs(self):
+        encoded = Int(4, 'foo', '-2').encode({}, {}, little_endian=True)
+        self.assertEquals(encoded._raw, to_bin('0xfeff ffff'))
+        self.assertEquals(encoded.int, -2)
+        decoded = UInt(8, 'foo', None).decode(to_bin('0x0100 0000 0000 0080'), None, little_endian=True)
+        self.assertEquals(decoded.int, 0x8000000000000001)
+
+    def test_non_native_length_is_encoded_as_before(self):
+        self.assertEquals(UInt(3, 'foo', '0x010203').encode({}, {}).int, 0x010203)
+        self.assertEquals(Int(3, 'foo', '-1').encode({}, {}).hex, '0xffffff')
+
+
 if __name__ == '__main__':
     main()
@@ -1,6 +1,6 @@
 from unittest import TestCase
-from Rammbock.templates.containers import Protocol, MessageTemplate
-from Rammbock.templates.primitives import UInt, PDU
+from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate
+from Rammbock.templates.primitives import UInt, Int, Char, PDU
 from Rammbock.binary_tools import to_bin
 from .tools import *
 
@@ -91,3 +91,55 @@ class TestStructs(TestCase):
         self.assertEqual(encoded.third.int, 3)
         self.assertEqual(len(encoded), 8)
         self.assertEqual(encoded._raw, to_bin('0x00010200 00000003'))
+
+
+class TestStaticLayout(TestCase):
+
+    def _get_static_struct(self):
+        struct = StructTemplate('Static', 'static', parent=None)
+        struct.add(UInt(1, 'first', 1, align=2))
+        struct.add(Int(2, 'second', -2))
+        struct.add(Char(3, 'name', 'abc'))
+        struct.add(UInt(3, 'third', 3))
+        return struct
+
+    def _without_layout(self, template):
+        template._static_layout = False
+        return template
+
+    def test_decode_matches_field_by_field_decoding(self):
+        outer = StructTemplate('Outer', 'outer', parent=None)
+        outer.add(self._get_static_struct())
+        outer.add(UInt(2, 'last', None))
+        data = to_bin('0x0100 fffe 616263 000003 0004')
+        decoded = outer.decode(data, {})
+        self.assertTrue(outer._get_static_layout())
+        self.assertEqual(decoded.static.first.int, 1)
+        self.assertEqual(decoded.static.second.int, -2)
+        self.assertEqual(decoded.static.name.ascii, 'abc')
+        self.assertEqual(decoded.last.int, 4)
+        self.assertEqual(decoded._raw, self._without_layout(outer).decode(data, {})._raw)
+
+    def test_encode_matches_field_by_field_encoding(self):
+        for little_endian in (False, True):
+            encoded = self._get_static_struct().encode({'static.third': 7}, {}, little_endian=little_endian)
+            expected = self._without_layout(self._get_static_struct()).encode({'static.third': 7}, {}, little_endian=little_endian)
+            self.assertEqual(encoded._raw, expected._raw)
+            self.assertEqual(encoded.third.int, 7)
+
+    def test_invalid_value_fails_as_before(self):
+        self.assertRaises(AssertionError, self._get_static_struct().encode, {'static.first': 256}, {})
+
+    def test_unknown_parameter_fails(self):
+        self.assertRaises(AssertionError, self._get_static_struct().encode, {'static.foo': 1}, {})
+
+    def test_adding_field_resets_layout(self):
+        struct = self._get_static_struct()
+        struct.encode({}, {})
+        struct.add(UInt(1, 'fourth', 4))
+        self.assertEqual(struct.encode({}, {}).fourth.int, 4)
+
+    def test_dynamic_length_is_not_static(self):
+        struct = get_pair()
+        struct.add(Char('first', 'name', 'ab'))
+        self.assertFalse(struct._get_static_layout())
@@ -90,3 +90,14 @@ class TestTBCDContainerTemplate(TestCase):
         container.add(TBCD('4', 'second', '1234'))
         encoded = container.encode({})
         self.assertEquals(4, len(encoded))
+
+    def test_decode_odd_and_even_fields(self):
+        container = TBCDContainerTemplate('tbcd', None)
+        container.add(TBCD('3', 'first', None))
+        container.add(TBCD('4', 'second', None))
+        container.add(TBCD('*', 'third', None))
+        decoded = container.decode(to_bin('0x21 43 65 87 f9'))
+        self.assertEquals('123', decoded.first.tbcd)
+        self.assertEquals('4567', decoded.second.tbcd)
+        self.assertEquals('89', decoded.third.tbcd)
+        self.assertEquals(to_bin('0x98'), decoded.third.bytes)
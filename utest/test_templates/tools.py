@@ -85,9 +85,27 @@ class MockStream(object):
         self.data = self.data[length:]
         return result
 
+    def read_frame(self, extract, timeout=None):
+        result = extract(self.data)
+        if not result:
+            if timeout:
+                raise socket.timeout('timeout')
+            else:
+                raise AssertionError('No timeout, but out of data.')
+        frame, length = result
+        self.data = self.data[length:]
+        return frame
+
     def return_data(self, data):
         self.data = data + self.data
 
+    def has_data(self):
+        return bool(self.data)
+
+    def wait_for_data(self, timeout=None):
+        if not self.data:
+            raise socket.timeout('timed out')
+
     def empty(self):
         self.data = ''
 